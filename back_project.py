@@ -2,46 +2,561 @@ import numpy as np
 import math
 import scipy
 from scipy import interpolate
-import sys
+from scipy import ndimage
+from ct_kernels import *
+from ct_monitor import *
+from ct_tune import *
 
-def back_project(sinogram, skip=1):
+@monitored('back_project')
+def back_project(sinogram, skip=1, jit=None, monitor=None, centre=None, extent=None, pixel=None, shape=None, preview=None, interpolation='cubic', symmetry=True, mask=True):
 
 	"""back_project back-projection to reconstruct CT data
 	back_project(sinogram) back-projects the filtered sinogram
 	(angles x samples) to create the reconstruted data (samples x
-	samples)"""
+	samples)
+
+	sinogram can also be a stack (slices x angles x samples), in which case
+	each rotated coordinate grid is used for all of the slices and the
+	output is (slices x samples x samples)
+
+	back_project(sinogram, skip, jit) chooses whether to use the compiled
+	kernel from ct_kernels, which by default is used whenever numba is
+	available. This gives the same result, but does the rotation,
+	interpolation and sum in one multithreaded pass over the pixels.
+
+	interpolation chooses how the sinogram is interpolated at the rotated
+	pixel coordinates, trading accuracy for speed:
+
+		'cubic' - a cubic spline for each angle, as from interp1d, which is
+			the only one the compiled kernel does
+		'spline' - a cubic B-spline, whose coefficients are found once for
+			the whole sinogram with scipy.ndimage.spline_filter1d and then
+			evaluated for every angle as by map_coordinates. This is as
+			accurate as 'cubic' except at the ends of each projection
+		'linear' - linear interpolation, which blurs slightly
+		'nearest' - the nearest sample, which is fastest but least accurate
+
+	If jit is not given, the compiled kernel is used if that is what
+	ct_benchmark.autotune chose for the size of sinogram, or if it has not
+	been tuned and numba is available, as this only changes the speed. The
+	interpolation changes the result, so that chosen by autotune is only
+	used if interpolation is 'tuned', and otherwise defaults to 'cubic'.
+	The jit and interpolation used are noted in monitor.
+
+	If symmetry is True and the whole image is reconstructed, with or
+	without the compiled kernel, the angles are back-projected in the
+	groups given by symmetric_angles. The rotated coordinates, and for
+	'cubic' the spline search or otherwise the interpolation weights, are
+	then shared by up to four angles, each of which is added to a
+	transposed or flipped view of the output. The result is the same to
+	within rounding. Whether the angles were grouped is noted in monitor.
+
+	monitor is an optional ct_monitor.Monitor which is told about the
+	progress, time and memory used.
+
+	Pixels outside the reconstructed circle are set to -1, unless mask is
+	False, for instance when hu(..., fov=True) is going to set them anyway.
+
+	The output is np.float32 if sinogram is, with the coordinates and
+	interpolation also done in single precision, otherwise np.float64.
+
+	back_project(sinogram, centre=centre, extent=extent, pixel=pixel,
+	shape=shape) reconstructs only a region of interest, on the output grid
+	described by output_grid. The time taken is then proportional to the
+	number of pixels in the region rather than in the whole image.
+
+	back_project(sinogram, preview=f) reconstructs progressively, calling
+	f(image) with a quick low resolution image before the full
+	reconstruction is finished, as described in back_project_progressive."""
+
+	if preview is not None:
+		if (skip != 1) or (centre is not None) or (extent is not None) or (pixel is not None) or (shape is not None):
+			raise ValueError('preview can only be used to reconstruct the whole image')
+		return back_project_progressive(sinogram, preview, jit=jit, monitor=monitor, interpolation=interpolation, symmetry=symmetry, mask=mask)
 
 	# get input dimensions
-	ns = sinogram.shape[1]
-	angles = sinogram.shape[0]
-	n = int(math.floor((ns-1) // skip) + 1)
+	ns = sinogram.shape[-1]
+	dtype = sinogram.dtype if sinogram.dtype == np.float32 else np.float64
 
 	# zero output and form input coordinates
 	# these have centre in the middle of the image
-	reconstruction = np.zeros((n, n))
-	xi, yi = np.meshgrid(np.arange(0,ns,skip) - (ns/2) + 0.5, np.arange(0,ns,skip) - (ns/2) + 0.5)
-
-	# back project over each angle in turn
-	for angle in range(angles):
-		sys.stdout.write("Reconstructing angle: %d   \r" % (angle + 1) )
-		
-		# Form rotated coordinates for output interpolation
-		# the rotation is about the middle of the image,
-		# but the output coordinates need to be relative to the top left
-		p = math.pi / 2 + angle * math.pi / angles
-		x0 = xi * math.cos(p) - yi * math.sin(p) + (ns / 2) - 0.5
-		
-		# interpolate and add this data to output
-		# remembering to multiply by dtheta as well as sum
-		# Either of the following options will work
-		x2 = scipy.interpolate.interp1d(np.arange(0, ns, 1), sinogram[angle], kind='cubic', copy=False, assume_sorted=True, bounds_error=False, fill_value=0, axis=0)
-		reconstruction = reconstruction + x2(x0) * (math.pi / angles)
-		# x2 = scipy.ndimage.map_coordinates(sinogram[angle], [x0], order=1, mode='constant', cval=0, prefilter=False)
-		# reconstruction = reconstruction + x2 * (math.pi / angles)
+	xs, ys = output_grid(ns, skip, centre, extent, pixel, shape)
+	reconstruction = np.zeros(sinogram.shape[:-2] + (len(ys), len(xs)), dtype=dtype)
+	monitor.count('back_project', reconstruction.nbytes)
 
-	# ensure any data outside the reconstructed circle is set to invalid
-	reconstruction[np.where((xi ** 2 + yi ** 2) > (ns/2)**2)] = -1
+	jit, interpolation = _choose_kernel(sinogram, jit, interpolation, monitor)
+	_back_project_grid(sinogram, xs, ys, reconstruction, jit, monitor, mask=mask, interpolation=interpolation, symmetry=symmetry)
+
+	return reconstruction
+
+
+@monitored('back_project')
+def back_project_tiled(sinogram, memory=256e6, skip=1, out=None, mmap_file=None, jit=None, monitor=None, centre=None, extent=None, pixel=None, shape=None, interpolation='cubic', mask=True):
+
+	"""back_project_tiled memory-bounded back-projection
+	reconstruction = back_project_tiled(sinogram, memory) gives the same
+	result as back_project(sinogram), but reconstructs the output one square
+	tile at a time, with the tile size chosen so that the temporary arrays
+	for each tile take no more than about memory bytes. This does not
+	include sinogram or the output.
+
+	reconstruction = back_project_tiled(sinogram, memory, skip, out) writes
+	into the existing array out, which can be a memory-mapped array, and
+	reconstruction = back_project_tiled(sinogram, memory, mmap_file=filename)
+	creates the output as a memory-mapped .npy file, so that the whole
+	reconstruction never has to be in memory.
+
+	The spline coefficients of every angle are found once, rather than for
+	every tile, and then shared by all of the tiles. For 'cubic', with or
+	without the compiled kernel, these are four times the size of sinogram,
+	and for 'spline' the same size. They are found for the whole stack at
+	once if they fit within half of memory, and otherwise for one slice at a
+	time. If even one slice's 'cubic' coefficients do not fit, the 'spline'
+	interpolation is used instead, which is noted in monitor with
+	fallback True, along with the interpolation actually used. The other
+	arguments are the same as for back_project."""
+
+	# get input dimensions
+	ns = sinogram.shape[-1]
+	angles = sinogram.shape[-2]
+	dtype = sinogram.dtype if sinogram.dtype == np.float32 else np.float64
+	slices = int(np.prod(sinogram.shape[:-2]))
+
+	xs, ys = output_grid(ns, skip, centre, extent, pixel, shape)
+	output_shape = sinogram.shape[:-2] + (len(ys), len(xs))
+
+	# create output
+	if out is None:
+		if mmap_file is None:
+			out = np.zeros(output_shape, dtype=dtype)
+		else:
+			out = np.lib.format.open_memmap(mmap_file, mode='w+', dtype=dtype, shape=output_shape)
+	elif out.shape != output_shape:
+		raise ValueError('input out has shape ' + str(out.shape) + ', expected ' + str(output_shape))
+
+	# the spline coefficients of one slice, which for 'cubic' are four for
+	# each sample, or if they cannot fit the smaller 'spline' ones
+	jit, interpolation = _choose_kernel(sinogram, jit, interpolation, monitor)
+	itemsize = np.dtype(dtype).itemsize
+	coefficient_bytes = {'cubic': 4, 'spline': 1}.get(interpolation, 0) * angles * ns * itemsize
+	if (interpolation == 'cubic') and (coefficient_bytes > memory / 2):
+		jit, interpolation = False, 'spline'
+		coefficient_bytes = coefficient_bytes // 4
+		monitor.note('back_project', jit=False, interpolation=interpolation, fallback=True)
+
+	# find the coefficients for the whole stack at once if they fit,
+	# otherwise one slice at a time
+	batch = slices if slices * coefficient_bytes <= memory / 2 else 1
+	parts = [()] if batch == slices else list(np.ndindex(sinogram.shape[:-2]))
+	memory = max(memory - batch * coefficient_bytes, 0)
+
+	# choose the tile size from the bytes needed per output pixel, which in
+	# NumPy is the coordinates, the interpolated values, the accumulator and
+	# the interpolation's own temporaries, for every slice, and the
+	# interpolation weights shared by the slices
+	if jit:
+		pixel_bytes = batch * itemsize
+	else:
+		pixel_bytes = (batch * 12 + 12) * 8
+	tile = max(1, int(math.sqrt(memory / pixel_bytes)))
+
+	tiles = [(r, c) for r in range(0, len(ys), tile) for c in range(0, len(xs), tile)]
+	done = 0
+	allocated = 0
+	arrays = 0
+	for part in parts:
+		part_sinogram = sinogram[part]
+		coefficients = None
+		if interpolation == 'spline':
+			coefficients = [spline_coefficients(part_sinogram[index], dtype) for index in np.ndindex(part_sinogram.shape[:-2])]
+		elif interpolation == 'cubic':
+			coefficients = [cubic_coefficients(part_sinogram[index]).astype(dtype, copy=False) for index in np.ndindex(part_sinogram.shape[:-2])]
+		if coefficients is not None:
+			allocated += sum(c.nbytes for c in coefficients)
+			arrays += len(coefficients)
+
+		for r, c in tiles:
+			tile_ys = ys[r:r + tile]
+			tile_xs = xs[c:c + tile]
+			reconstruction = np.zeros(part_sinogram.shape[:-2] + (len(tile_ys), len(tile_xs)), dtype=dtype)
+			allocated += reconstruction.nbytes
+			arrays += 1
+			_back_project_grid(part_sinogram, tile_xs, tile_ys, reconstruction, jit, None, coefficients, mask=mask, interpolation=interpolation)
+			out[part + (Ellipsis, slice(r, r + tile), slice(c, c + tile))] = reconstruction
+			done = done + 1
+			monitor.progress('back_project', done, len(tiles) * len(parts))
+
+	# the coefficients and tiles, but not the temporaries of each tile
+	monitor.count('back_project', allocated, arrays)
+
+	if isinstance(out, np.memmap):
+		out.flush()
+
+	return out
+
+
+def back_project_progressive(sinogram, preview, skip=2, angle_step=4, jit=None, monitor=None, interpolation='cubic', symmetry=True, mask=True):
+
+	"""back_project_progressive coarse-to-fine back-projection
+	reconstruction = back_project_progressive(sinogram, preview) gives the
+	same result as back_project(sinogram), but first reconstructs a low
+	resolution preview and passes it to preview(image) before going on to
+	the full resolution reconstruction.
+
+	The preview is back-projected from every angle_step-th angle of the
+	sinogram, with every skip samples averaged together, onto a grid of
+	(samples/skip x samples/skip) pixels. This takes about 1/(skip^2
+	angle_step) of the time of the full reconstruction, which is 1/16 by
+	default, and averaging the samples keeps the noise in the preview close
+	to that in the full reconstruction.
+
+	The filtered sinogram is shared by both, but the preview pixels are not
+	reused as they come from the averaged samples, so the total time is
+	about 1/16 more than back_project.
+
+	jit, monitor, interpolation, symmetry and mask are used as for back_project, with the preview timed as
+	the stage 'back_project_preview'."""
+
+	monitor = get_monitor(monitor)
+	jit, interpolation = _choose_kernel(sinogram, jit, interpolation, monitor)
+
+	# get input dimensions
+	ns = sinogram.shape[-1]
+	dtype = sinogram.dtype if sinogram.dtype == np.float32 else np.float64
+
+	with monitor.stage('back_project_preview'):
+
+		# average every skip samples, padding with zeros if needed, which
+		# moves the preview by less than a pixel
+		decimated = sinogram[..., ::angle_step, :]
+		padding = (-ns) % skip
+		if padding > 0:
+			decimated = np.concatenate((decimated, np.zeros(decimated.shape[:-1] + (padding,), dtype=decimated.dtype)), axis=-1)
+		decimated = decimated.reshape(decimated.shape[:-1] + (-1, skip)).mean(axis=-1)
+
+		xs, ys = output_grid(decimated.shape[-1])
+		image = np.zeros(sinogram.shape[:-2] + (len(ys), len(xs)), dtype=dtype)
+		_back_project_grid(decimated, xs, ys, image, jit, None, mask=mask, interpolation=interpolation, symmetry=symmetry)
+		preview(image)
+
+	# full reconstruction
+	xs, ys = output_grid(ns)
+	reconstruction = np.zeros(sinogram.shape[:-2] + (len(ys), len(xs)), dtype=dtype)
+	monitor.count('back_project', reconstruction.nbytes)
+	_back_project_grid(sinogram, xs, ys, reconstruction, jit, monitor, mask=mask, interpolation=interpolation, symmetry=symmetry)
+
+	return reconstruction
+
+
+def output_grid(ns, skip=1, centre=None, extent=None, pixel=None, shape=None):
+
+	"""xs, ys = output_grid(ns, skip) returns the x (column) and y (row)
+	coordinates of the pixels reconstructed by back_project from ns samples,
+	in samples relative to the centre of rotation. By default these are
+	every skip samples across the whole image.
 
-	sys.stdout.write("\n")
+	xs, ys = output_grid(ns, skip, centre, extent, pixel, shape) instead
+	returns a region of interest, with:
 
-	return reconstruction
\ No newline at end of file
+		centre - (row, column) in pixels of the full (samples x samples)
+			reconstruction of the pixel (rows // 2, columns // 2) of the
+			region, which is its middle pixel if shape is odd. By default
+			the region is centred on the middle of the image instead
+		pixel - the pixel size, in samples, which defaults to skip and can
+			be less than one to zoom in
+		shape - (rows, columns) of the output, or
+		extent - (height, width) of the region in samples, if shape is not
+			given, which defaults to the whole image
+
+	With pixel equal to one and a whole-numbered centre, the region
+	contains exactly the same pixels as the full reconstruction, from row
+	centre[0] - rows // 2 and column centre[1] - columns // 2, for odd and
+	even shapes alike."""
+
+	if (centre is None) and (extent is None) and (pixel is None) and (shape is None):
+		coordinates = np.arange(0, ns, skip) - (ns/2) + 0.5
+		return coordinates, coordinates
+
+	if pixel is None:
+		pixel = skip
+	if shape is None:
+		if extent is None:
+			extent = (ns, ns)
+		shape = (max(1, int(round(extent[0] / pixel))), max(1, int(round(extent[1] / pixel))))
+
+	# the index within the region of the pixel which lies on centre, or
+	# without a centre the middle of the region, which may be between pixels
+	if centre is None:
+		centre = ((ns - 1) / 2, (ns - 1) / 2)
+		middle = ((shape[0] - 1) / 2, (shape[1] - 1) / 2)
+	else:
+		middle = (shape[0] // 2, shape[1] // 2)
+
+	xs = centre[1] - (ns/2) + 0.5 + (np.arange(shape[1]) - middle[1]) * pixel
+	ys = centre[0] - (ns/2) + 0.5 + (np.arange(shape[0]) - middle[0]) * pixel
+
+	return xs, ys
+
+
+def _choose_kernel(sinogram, jit, interpolation, monitor):
+	"""returns jit and interpolation for back-projecting sinogram, taking jit
+	if it is not given, and interpolation if it is 'tuned', from the
+	settings chosen by autotune for its size, and otherwise using the
+	compiled cubic kernel if possible. The choice is noted in monitor"""
+
+	settings = {}
+	if (jit is None) or (interpolation == 'tuned'):
+		dtype = sinogram.dtype if sinogram.dtype == np.float32 else np.float64
+		settings = tuned(sinogram.shape[-1], sinogram.shape[-2], dtype)
+	if interpolation == 'tuned':
+		interpolation = settings.get('interpolation', 'cubic')
+
+	if interpolation not in ('cubic', 'spline', 'linear', 'nearest'):
+		raise ValueError('interpolation should be cubic, spline, linear, nearest or tuned, got ' + str(interpolation))
+	if interpolation != 'cubic':
+		if jit:
+			raise ValueError('jit can only be used with cubic interpolation')
+		jit = False
+	else:
+		if (jit is None) and (settings.get('jit') is not None):
+			jit = settings['jit'] and HAVE_NUMBA
+		jit = use_jit(jit)
+
+	monitor.note('back_project', jit=bool(jit), interpolation=interpolation)
+	return jit, interpolation
+
+
+def symmetric_angles(total):
+
+	"""groups = symmetric_angles(total) splits the angles 0 to total-1 of a
+	sinogram of total angles in 180 degrees into groups whose rotated pixel
+	coordinates are all the same, up to a transpose or flip of the image,
+	when the image is square and symmetric about the centre of rotation.
+
+	Each group is a list of (angle, view) pairs, where the first angle k has
+	view None and the others are total/2+k ('flip transpose'), total-k
+	('flip') and total/2-k ('transpose'), if they are different angles.
+	When total is a multiple of 4 most groups have four angles, so the
+	coordinates need only be found for about a quarter of them. Odd totals
+	have no such groups, and every angle is on its own."""
+
+	if total % 2 != 0:
+		return [[(angle, None)] for angle in range(total)]
+
+	half = total // 2
+	used = np.zeros(total, dtype=bool)
+	groups = []
+	for k in range(total):
+		if used[k]:
+			continue
+		group = [(k, None)]
+		used[k] = True
+		for angle, view in ((half + k, 'flip transpose'), (total - k, 'flip'), (half - k, 'transpose')):
+			if (0 <= angle < total) and not used[angle]:
+				group.append((angle, view))
+				used[angle] = True
+		groups.append(group)
+
+	return groups
+
+
+def _symmetric_view(reconstruction, view):
+	"""returns the view of reconstruction (... x rows x columns) for an
+	angle of a group from symmetric_angles"""
+
+	if view is None:
+		return reconstruction
+	if view == 'transpose':
+		return reconstruction.swapaxes(-1, -2)
+	if view == 'flip':
+		return reconstruction[..., ::-1, :]
+	return reconstruction[..., ::-1, :].swapaxes(-1, -2)
+
+
+def _spline_weights(x0, order, ns):
+	"""returns the index of the first of the order+1 samples used at each of
+	x0, in a row of ns samples padded with order zeros at each end, and
+	the weight of each of them, for the B-spline of order 0, 1 or 3. This
+	is the same as map_coordinates with mode 'grid-constant', so is zero
+	beyond the reach of the first and last samples"""
+
+	dtype = x0.dtype
+	if order == 0:
+		k = np.floor(x0 + 0.5)
+		weight = ((k >= 0) & (k <= ns - 1)).astype(dtype)
+		return np.clip(k, 0, ns - 1).astype(np.intp), [weight]
+
+	k = np.floor(x0)
+	d = x0 - k
+	if order == 1:
+		weights = [1 - d, d]
+	else:
+		e = 1 - d
+		weights = [e * e * e / 6, ((3 * d - 6) * d * d + 4) / 6, (((3 - 3 * d) * d + 3) * d + 1) / 6, d * d * d / 6]
+
+	outside = (x0 <= -(order + 1) / 2) | (x0 >= ns - 1 + (order + 1) / 2)
+	for w in weights:
+		w[outside] = 0
+
+	# the first sample is k for order 1 and k-1 for order 3, after padding
+	k = np.clip(k, -(order + 1) // 2, ns - 1 + (order - 1) // 2).astype(np.intp)
+	return k + order - (order - 1) // 2, [w.astype(dtype, copy=False) for w in weights]
+
+
+def spline_coefficients(sinogram, dtype=np.float64):
+	"""returns the cubic B-spline coefficients of each row of sinogram
+	(angles x samples), which are interpolated by map_coordinates with
+	order=3, mode='grid-constant' and prefilter=False. The samples beyond
+	each end are taken as zero"""
+
+	return scipy.ndimage.spline_filter1d(sinogram, order=3, axis=-1, output=dtype, mode='grid-constant')
+
+
+def _back_project_grid(sinogram, xs, ys, reconstruction, jit, monitor, coefficients=None, first=0, total=None, mask=True, interpolation='cubic', symmetry=False):
+	"""adds the back-projection of sinogram onto the grid of pixels at xs, ys
+	into reconstruction, and sets any pixels outside the reconstructed circle
+	to -1 if mask is True. coefficients are the spline coefficients for each
+	slice, which are computed here if they are not given. The angles of
+	sinogram are first onwards out of total angles in 180 degrees, which are
+	by default all of the angles. interpolation is as for back_project, and
+	jit is only used for 'cubic', for which coefficients are those from
+	cubic_coefficients. For 'spline', coefficients are instead those from
+	spline_coefficients. If symmetry is True, angles whose
+	rotated coordinates are the same grid transposed or flipped share them,
+	where the grid and angles allow this (see symmetric_angles)."""
+
+	monitor = get_monitor(monitor)
+
+	# get input dimensions
+	ns = sinogram.shape[-1]
+	angles = sinogram.shape[-2]
+	dtype = reconstruction.dtype
+	if total is None:
+		total = angles
+
+	# these have centre in the middle of the image
+	xi, yi = np.meshgrid(xs.astype(dtype), ys.astype(dtype))
+
+	# on a square grid which is symmetric about the centre, with every
+	# angle of the sinogram, angles are back-projected in groups which
+	# share one set of rotated coordinates, each added to a transposed
+	# or flipped view of the output
+	square = np.array_equal(xs, ys) and np.array_equal(xs, -xs[::-1])
+	if symmetry and square and (first == 0) and (angles == total):
+		groups = symmetric_angles(total)
+	else:
+		groups = [[(angle, None)] for angle in range(angles)]
+
+	if jit and (interpolation == 'cubic'):
+
+		# the kernel rotates the coordinates itself, using the same cubic
+		# spline as interp1d for each angle, and shares them within each
+		# group given as the angle of each view, or -1
+		grouped = len(groups) < angles
+		if grouped:
+			views = [None, 'flip transpose', 'flip', 'transpose']
+			group_angles = np.full((len(groups), 4), -1, dtype=np.intp)
+			for g, group in enumerate(groups):
+				for angle, view in group:
+					group_angles[g, views.index(view)] = angle
+		monitor.note('back_project', symmetry=grouped)
+		allocated = 2 * xi.nbytes + grouped * xi.nbytes
+		arrays = 2 + grouped
+		for i, index in enumerate(np.ndindex(sinogram.shape[:-2])):
+			if coefficients is None:
+				slice_coefficients = cubic_coefficients(sinogram[index]).astype(dtype)
+				allocated += slice_coefficients.nbytes
+				arrays += 1
+			else:
+				slice_coefficients = coefficients[i]
+			if grouped:
+				back_project_cubic_symmetric_kernel(slice_coefficients, xi[0], math.pi / total, reconstruction[index], group_angles)
+			else:
+				back_project_cubic_kernel(slice_coefficients, xi[0], yi[:, 0], math.pi / total, reconstruction[index], first, total)
+		monitor.progress('back_project', angles, angles)
+
+		# the coordinates, the cubic coefficients, and the transposed image
+		# when grouped
+		monitor.count('back_project', allocated, arrays)
+
+	else:
+
+		# the B-spline coefficients are found once for all of the angles
+		allocated = 2 * xi.nbytes
+		arrays = 2
+		if (interpolation == 'spline') and (coefficients is None):
+			coefficients = [spline_coefficients(sinogram[index], dtype) for index in np.ndindex(sinogram.shape[:-2])]
+			allocated += sum(c.nbytes for c in coefficients)
+			arrays += len(coefficients)
+		order = {'nearest': 0, 'linear': 1, 'spline': 3}.get(interpolation)
+		monitor.note('back_project', symmetry=len(groups) < angles)
+
+		# back project over each angle (or group of angles) in turn
+		done = 0
+		for group in groups:
+			# Form rotated coordinates for output interpolation
+			# the rotation is about the middle of the image,
+			# but the output coordinates need to be relative to the top left
+			p = math.pi / 2 + (first + group[0][0]) * math.pi / total
+			x0 = xi * math.cos(p) - yi * math.sin(p) + (ns / 2) - 0.5
+			allocated += x0.nbytes
+			arrays += 1
+			
+			# interpolate and add this data to output
+			# remembering to multiply by dtheta as well as sum
+			if (interpolation == 'cubic') and (coefficients is not None):
+				# the piecewise cubic coefficients of every angle have already
+				# been found, so only need evaluating
+				k = np.clip(x0.astype(np.intp), 0, ns - 2)
+				d = x0 - k
+				outside = (x0 < 0) | (x0 > ns - 1)
+				allocated += k.nbytes + d.nbytes + outside.nbytes
+				arrays += 3
+				for i, index in enumerate(np.ndindex(sinogram.shape[:-2])):
+					for angle, view in group:
+						c = coefficients[i][angle]
+						x2 = ((c[k, 0] * d + c[k, 1]) * d + c[k, 2]) * d + c[k, 3]
+						x2[outside] = 0
+						allocated += x2.nbytes
+						arrays += 1
+						output = _symmetric_view(reconstruction[index], view)
+						output += x2 * dtype.type(math.pi / total)
+			elif interpolation != 'cubic':
+				# the B-spline weights depend only on x0, so are found once
+				# for all of the angles in the group
+				first_sample, weights = _spline_weights(x0, order, ns)
+				allocated += first_sample.nbytes + sum(w.nbytes for w in weights)
+				arrays += 1 + len(weights)
+				for i, index in enumerate(np.ndindex(sinogram.shape[:-2])):
+					values = sinogram[index] if coefficients is None else coefficients[i]
+					rows = np.zeros((len(group), ns + 2 * order), dtype=dtype)
+					rows[:, order:order + ns] = values[[angle for angle, view in group]]
+					allocated += rows.nbytes
+					arrays += 1
+					for g, (angle, view) in enumerate(group):
+						x2 = weights[0] * np.take(rows[g], first_sample)
+						for t in range(1, order + 1):
+							x2 += weights[t] * np.take(rows[g], first_sample + t)
+						allocated += x2.nbytes
+						arrays += 1
+						output = _symmetric_view(reconstruction[index], view)
+						output += x2 * dtype.type(math.pi / total)
+			else:
+				# one spline search for all of the angles in the group
+				x2 = scipy.interpolate.interp1d(np.arange(0, ns, 1), sinogram[..., [angle for angle, view in group], :], kind='cubic', copy=False, assume_sorted=True, bounds_error=False, fill_value=0, axis=-1)(x0)
+				allocated += x2.nbytes
+				arrays += 1
+				for g, (angle, view) in enumerate(group):
+					output = _symmetric_view(reconstruction, view)
+					output += x2[..., g, :, :] * (math.pi / total)
+
+			done = done + len(group)
+			monitor.progress('back_project', done, angles)
+
+		# the coordinates of each group and the values interpolated from
+		# them, but not the temporaries within each expression
+		monitor.count('back_project', allocated, arrays)
+
+	# ensure any data outside the reconstructed circle is set to invalid
+	if mask:
+		reconstruction[..., (xi ** 2 + yi ** 2) > (ns/2)**2] = -1
\ No newline at end of file
@@ -0,0 +1,114 @@
+import math
+import numpy as np
+
+# sinogram binning and phantom downsampling, for quick low fidelity runs
+# such as parameter sweeps, where an approximate answer at a fraction of
+# the cost is enough
+
+
+def bin_sinogram(sinogram, scale, samples=1, angles=1):
+
+	""" Bin a sinogram over detector samples and angles
+	binned, binned_scale = bin_sinogram(sinogram, scale, samples, angles)
+	averages every samples adjacent detector samples and every angles
+	adjacent angles of sinogram (angles x samples, or a stack of them), which
+	can be detector counts or calibrated attenuation. The number of samples
+	and angles of sinogram must be multiples of samples and angles.
+
+	The binned detector samples are samples times wider, so binned_scale is
+	scale * samples, and this should be given to ct_calibrate, ramp_filter
+	and hu instead of scale for the binned sinogram. The centre of rotation
+	stays in the middle of the samples.
+
+	Each binned angle is the average of a window of angles centred on every
+	angles-th angle, with half weights at each end if angles is even, so
+	that the binned angles are still evenly spaced from zero as expected by
+	back_project. The window wraps around 180 degrees using the reversed
+	projections at the other end of the sinogram."""
+
+	sinogram = np.asarray(sinogram)
+	n = sinogram.shape[-1]
+	count = sinogram.shape[-2]
+	if (samples < 1) or (n % samples != 0):
+		raise ValueError(str(n) + ' samples cannot be binned in groups of ' + str(samples))
+	if (angles < 1) or (count % angles != 0):
+		raise ValueError(str(count) + ' angles cannot be binned in groups of ' + str(angles))
+
+	# average the samples first, which makes the angles cheaper
+	if samples > 1:
+		sinogram = sinogram.reshape(sinogram.shape[:-1] + (n // samples, samples)).mean(axis=-1)
+
+	if angles > 1:
+		half = angles // 2
+		offsets = np.arange(-half, half + 1)
+		weights = np.ones(len(offsets))
+		if angles % 2 == 0:
+			weights[[0, -1]] = 0.5
+
+		centres = np.arange(0, count, angles)
+		dtype = sinogram.dtype if sinogram.dtype == np.float32 else np.float64
+		binned = np.zeros(sinogram.shape[:-2] + (len(centres), sinogram.shape[-1]), dtype=dtype)
+		for offset, weight in zip(offsets, weights):
+			index = centres + offset
+			rows = sinogram[..., index % count, :]
+
+			# an angle beyond 180 degrees is the reversed projection
+			wrapped = (index < 0) | (index >= count)
+			rows[..., wrapped, :] = rows[..., wrapped, ::-1]
+			binned += weight * rows
+		sinogram = binned / angles
+
+	return sinogram, scale * samples
+
+
+def downsample_phantom(phantom, factor, count=None):
+
+	""" Downsample a phantom, keeping partial volumes
+	fractions = downsample_phantom(phantom, factor) reduces a label phantom
+	from ct_phantom (n x n, or slices x n x n) to n/factor pixels square,
+	where n must be a multiple of factor. Each new pixel covers factor x
+	factor of the old ones, and may contain more than one material, so
+	fractions is the fraction of each pixel made of each material, as
+	(materials x n/factor x n/factor) or (materials x slices x n/factor x
+	n/factor). count is the number of materials, which defaults to
+	phantom.max()+1, and should be len(material.name) for ct_scan.
+
+	fractions can be scanned with ct_scan(..., fractions=True), using
+	scale * factor as the pixel size. Every material is found with one
+	np.bincount over the labels."""
+
+	labels = np.asarray(phantom)
+	n = labels.shape[-1]
+	if (factor < 1) or (n % factor != 0) or (labels.shape[-2] % factor != 0):
+		raise ValueError('phantom of shape ' + str(labels.shape) + ' cannot be downsampled by ' + str(factor))
+	if count is None:
+		count = int(labels.max()) + 1
+
+	# the index of the new pixel which each old pixel lies in
+	rows = np.arange(labels.shape[-2]) // factor
+	columns = np.arange(n) // factor
+	pixels = (rows[:, np.newaxis] * (n // factor) + columns[np.newaxis, :]).ravel()
+	size = (labels.shape[-2] // factor) * (n // factor)
+
+	stack = labels.shape[:-2]
+	slices = int(np.prod(stack))
+	bins = labels.reshape((slices, -1)).astype(np.intp) * (slices * size) + (np.arange(slices)[:, np.newaxis] * size + pixels[np.newaxis, :])
+	fractions = np.bincount(bins.ravel(), minlength=count * slices * size) / (factor * factor)
+
+	return fractions.reshape((count,) + stack + (labels.shape[-2] // factor, n // factor))
+
+
+class ScreeningWarning(UserWarning):
+	"""warning given with the result of a low fidelity screening run, which
+	is coarser than the phantom it is the size of"""
+
+
+def fidelity_factor(fidelity):
+	"""returns the downsampling factor for a run at a fraction fidelity of
+	the cost of the full run, such as 2 for 1/4 and 4 for 1/16, as used by
+	scan_and_reconstruct"""
+
+	factor = int(round(1 / math.sqrt(fidelity))) if fidelity > 0 else 0
+	if (factor < 1) or not math.isclose(fidelity * factor * factor, 1):
+		raise ValueError('fidelity should be 1, 1/4, 1/16 or another 1/k^2, got ' + str(fidelity))
+	return factor
@@ -1,11 +1,13 @@
 import datetime
+import struct
 import pydicom
 from pydicom.dataset import Dataset, FileDataset
 import numpy as np
 import os
+from ct_lib import dicom_pixels
 
 
-def create_dicom(x, filename, sp, sz=None, f=1, study_uid=None, series_uid=None, frame_uid=None, time=datetime.datetime.now(), storage_directory=None):
+def create_dicom(x, filename, sp, sz=None, f=1, study_uid=None, series_uid=None, frame_uid=None, time=datetime.datetime.now(), storage_directory=None, comments=None):
 
 	""" Create DICOM format output file from data
 
@@ -25,6 +27,9 @@ def create_dicom(x, filename, sp, sz=None, f=1, study_uid=None, series_uid=None,
 	using the DICOMUID function. The time can be generated using datetime.datetime.now().
 
 	optional storage_directory parameter can set the file's storage directory path
+
+	optional comments are written as the ImageComments of the file, for
+	example to flag a low fidelity screening run
 	"""
 
 	# check for inputs
@@ -42,9 +47,7 @@ def create_dicom(x, filename, sp, sz=None, f=1, study_uid=None, series_uid=None,
 
 
 	# get data with the appropriate limits
-	x = x + 1024
-	x = np.clip(x, 0, None)
-	x = np.clip(x, None, 4096)
+	x = dicom_pixels(x)
 
 	# Initial write to create DICOM file with default settings
 	full_filename = filename + '_' + str(f).zfill(4) + '.dcm'
@@ -92,6 +95,8 @@ def create_dicom(x, filename, sp, sz=None, f=1, study_uid=None, series_uid=None,
 	ds.GantryDetectorTilt = '0'
 	ds.SliceLocation = str(f * sz)
 	ds.PixelSpacing = [sp, sp]
+	if comments is not None:
+		ds.ImageComments = comments
 
 	## These are the necessary imaging components of the FileDataset object.
 	ds.SamplesPerPixel = 1
@@ -103,11 +108,205 @@ def create_dicom(x, filename, sp, sz=None, f=1, study_uid=None, series_uid=None,
 	ds.Columns = x.shape[1]
 	ds.Rows = x.shape[0]
 
-	if x.dtype != np.uint16:
-		x = x.astype(np.uint16)
-
-	ds.PixelData = x.tostring()
+	ds.PixelData = x.tobytes()
 
 	# write final file with this metadata
 	ds.save_as(full_filename, write_like_original=False)
-	
\ No newline at end of file
+
+
+def create_dicom_volume(x, filename, sp, sz=None, study_uid=None, series_uid=None, frame_uid=None, time=None, storage_directory=None, compress=False, comments=None):
+
+	""" Create a single Enhanced CT multi-frame DICOM file from a volume
+
+	create_dicom_volume(x, filename, sp) creates a new DICOM file with a
+	name `filename.dcm' containing every slice of x (slices x rows x columns)
+	as one frame of an Enhanced CT image. The pixel scale is given by sp
+	which is in mm, and the frame spacing sz defaults to sp.
+
+	The position of each frame is stored in the per-frame functional groups,
+	while the pixel spacing, orientation and rescaling are shared by all
+	frames. The pixel data is written one frame at a time, so x can be a
+	memory-mapped array (or anything with a shape which can be indexed by
+	frame) which is never fully loaded into memory.
+
+	create_dicom_volume(x, filename, sp, sz, compress=True) also applies RLE
+	lossless compression to each frame before writing it.
+
+	The UIDs, time, storage_directory and comments have the same meaning as
+	for create_dicom."""
+
+	# check for inputs
+	if len(x.shape) != 3:
+		raise ValueError('input x should be slices x rows x columns')
+	frames, rows, columns = x.shape
+
+	if sz is None:
+		sz = sp
+
+	if study_uid is None:
+		study_uid = pydicom.uid.generate_uid()
+
+	if series_uid is None:
+		series_uid = pydicom.uid.generate_uid()
+
+	if frame_uid is None:
+		frame_uid = pydicom.uid.generate_uid()
+
+	if time is None:
+		time = datetime.datetime.now()
+
+	if compress:
+		transfer_syntax = pydicom.uid.RLELossless
+	else:
+		transfer_syntax = pydicom.uid.ExplicitVRLittleEndian
+
+	full_filename = filename + '.dcm'
+	full_file = full_filename
+
+	#add storage directory if needed
+	if storage_directory is not None:
+		full_filename = os.path.join(storage_directory, full_filename)
+
+	series_date = time.strftime('%Y%m%d')
+	series_time = time.strftime('%H%M%S')
+
+	file_meta = Dataset()
+	file_meta.MediaStorageSOPClassUID = '1.2.840.10008.5.1.4.1.1.2.1'
+	file_meta.MediaStorageSOPInstanceUID = pydicom.uid.generate_uid()
+	file_meta.TransferSyntaxUID = transfer_syntax
+
+	# necessary tags, as for create_dicom
+	ds = FileDataset(full_file, {}, file_meta=file_meta, preamble=b"\0"*128)
+	ds.Modality = 'CT'
+	ds.StudyInstanceUID =  study_uid
+	ds.SeriesInstanceUID = series_uid
+	ds.SOPClassUID = file_meta.MediaStorageSOPClassUID
+	ds.SOPInstanceUID = file_meta.MediaStorageSOPInstanceUID
+	ds.FrameOfReferenceUID = frame_uid
+	ds.StudyDescription = 'GG2 Study ' + study_uid[56:]
+	ds.SeriesDescription = 'GG2 Series ' + series_uid[56:]
+	ds.StudyID = '1'
+	ds.SeriesNumber = 1
+	ds.InstanceNumber = 1
+	ds.StudyDate = series_date
+	ds.SeriesDate = series_date
+	ds.AcquisitionDateTime = series_date + series_time
+	ds.ContentDate = series_date
+	ds.StudyTime = series_time
+	ds.SeriesTime = series_time
+	ds.ContentTime = series_time
+	ds.PatientName = 'GG2 Patient'
+	ds.ImageType = ['ORIGINAL', 'PRIMARY', 'AXIAL', 'NONE']
+	ds.ContentQualification = 'RESEARCH'
+	ds.NumberOfFrames = frames
+	if comments is not None:
+		ds.ImageComments = comments
+
+	# frames are indexed by their position along the z-axis
+	dimension_uid = pydicom.uid.generate_uid()
+	organisation = Dataset()
+	organisation.DimensionOrganizationUID = dimension_uid
+	ds.DimensionOrganizationSequence = [organisation]
+	dimension = Dataset()
+	dimension.DimensionOrganizationUID = dimension_uid
+	dimension.DimensionIndexPointer = pydicom.tag.Tag('ImagePositionPatient')
+	dimension.FunctionalGroupPointer = pydicom.tag.Tag('PlanePositionSequence')
+	ds.DimensionIndexSequence = [dimension]
+
+	# functional groups which are the same for every frame
+	shared = Dataset()
+	measures = Dataset()
+	measures.PixelSpacing = [sp, sp]
+	measures.SliceThickness = str(sz)
+	measures.SpacingBetweenSlices = str(sz)
+	shared.PixelMeasuresSequence = [measures]
+	orientation = Dataset()
+	orientation.ImageOrientationPatient = [1.000, 0.000, 0.000, 0.000, 1.000, 0.000]
+	shared.PlaneOrientationSequence = [orientation]
+	transformation = Dataset()
+	transformation.RescaleIntercept = '-1024'
+	transformation.RescaleSlope = '1'
+	transformation.RescaleType = 'HU'
+	shared.PixelValueTransformationSequence = [transformation]
+	window = Dataset()
+	window.WindowWidth = '2000'
+	window.WindowCenter = '0'
+	shared.FrameVOILUTSequence = [window]
+	ds.SharedFunctionalGroupsSequence = [shared]
+
+	# functional groups giving the position of each frame, numbered from 1
+	# as for the separate files written by create_dicom
+	per_frame = []
+	for f in range(1, frames + 1):
+		group = Dataset()
+		position = Dataset()
+		position.ImagePositionPatient = [0.000, 0.000, float(f * sz)]
+		group.PlanePositionSequence = [position]
+		content = Dataset()
+		content.StackID = '1'
+		content.InStackPositionNumber = f
+		content.DimensionIndexValues = [f]
+		group.FrameContentSequence = [content]
+		per_frame.append(group)
+	ds.PerFrameFunctionalGroupsSequence = per_frame
+
+	## These are the necessary imaging components of the FileDataset object.
+	ds.SamplesPerPixel = 1
+	ds.PhotometricInterpretation = "MONOCHROME2"
+	ds.PixelRepresentation = 0
+	ds.HighBit = 15
+	ds.BitsStored = 16
+	ds.BitsAllocated = 16
+	ds.Columns = columns
+	ds.Rows = rows
+
+	with open(full_filename, 'wb') as fp:
+
+		# write all of the metadata first, which precedes the pixel data
+		ds.save_as(fp, write_like_original=False)
+
+		# then stream the pixel data element one frame at a time
+		buffer = np.empty((rows, columns), dtype=np.uint16)
+		if compress:
+			encode = _rle_encoder(rows, columns)
+			fp.write(_PIXEL_DATA_TAG + b'OB\0\0' + struct.pack('<I', 0xFFFFFFFF))
+
+			# empty basic offset table
+			fp.write(_ITEM_TAG + struct.pack('<I', 0))
+
+			for f in range(frames):
+				fragment = encode(dicom_pixels(x[f], out=buffer))
+				if len(fragment) % 2:
+					fragment += b'\0'
+				fp.write(_ITEM_TAG + struct.pack('<I', len(fragment)))
+				fp.write(fragment)
+
+			fp.write(_SEQUENCE_DELIMITER_TAG + struct.pack('<I', 0))
+		else:
+			fp.write(_PIXEL_DATA_TAG + b'OW\0\0' + struct.pack('<I', frames * rows * columns * 2))
+
+			for f in range(frames):
+				fp.write(dicom_pixels(x[f], out=buffer).astype('<u2', copy=False).tobytes())
+
+
+# little endian tags needed to write the pixel data element by hand
+_PIXEL_DATA_TAG = struct.pack('<HH', 0x7FE0, 0x0010)
+_ITEM_TAG = struct.pack('<HH', 0xFFFE, 0xE000)
+_SEQUENCE_DELIMITER_TAG = struct.pack('<HH', 0xFFFE, 0xE0DD)
+
+
+def _rle_encoder(rows, columns):
+	"""returns a function which RLE encodes a single uint16 frame"""
+
+	# the encoder moved between pydicom versions
+	try:
+		from pydicom.pixels.encoders import RLELosslessEncoder
+	except ImportError:
+		from pydicom.encoders import RLELosslessEncoder
+
+	def encode(frame):
+		return RLELosslessEncoder.encode(frame, rows=rows, columns=columns, number_of_frames=1,
+			samples_per_pixel=1, bits_allocated=16, bits_stored=16, pixel_representation=0,
+			photometric_interpretation='MONOCHROME2')
+
+	return encode
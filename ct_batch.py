@@ -0,0 +1,242 @@
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import time
+import warnings
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from material import *
+from source import *
+from fake_source import *
+from ct_phantom import *
+from ct_lib import *
+from ct_metrics import *
+from ct_monitor import *
+from scan_and_reconstruct import *
+from create_dicom import *
+
+# settings of each job, and their defaults. angles defaults to n, and
+# source can be the name of a source, or a dict of fake_source arguments
+# such as {'mvp': 0.1, 'filter': 'Aluminium', 'thickness': 2}
+JOB_DEFAULTS = {'name': None, 'phantom': 1, 'n': 256, 'metal': None, 'source': '100kVp, 2mm Al',
+	'scale': 0.1, 'angles': None, 'mas': 10000, 'alpha': 0.001, 'engine': 'back_project',
+	'fidelity': 1, 'seed': None, 'outputs': ['npy', 'metrics']}
+
+# the material and source tables, which are loaded once in each process
+_tables = None
+
+
+def load_jobs(filename):
+
+	""" Load a batch job spec
+	jobs = load_jobs(filename) reads the jobs in a JSON file, or a YAML file
+	if its name ends in .yaml or .yml, which needs PyYAML. The file holds
+	either a list of jobs, or a dictionary with a list of jobs under 'jobs'
+	and optional 'defaults' which apply to every job. Each job is a
+	dictionary of the settings in JOB_DEFAULTS, for example
+
+		defaults:
+		  n: 128
+		  outputs: [npy, dicom, metrics]
+		jobs:
+		  - {name: hip, phantom: 3, mas: 5000}
+		  - {name: pins, phantom: 7, source: {mvp: 0.08, filter: Aluminium, thickness: 2}}
+
+	jobs is the list of jobs with every setting filled in, and each job is
+	named job_1, job_2 and so on if it has no name."""
+
+	if not os.path.exists(filename):
+		raise Exception('File named ' + filename + ' does not exist')
+
+	with open(filename) as f:
+		if filename.endswith(('.yaml', '.yml')):
+			try:
+				import yaml
+			except ImportError:
+				raise ImportError('PyYAML is needed for the job spec ' + filename)
+			spec = yaml.safe_load(f)
+		else:
+			spec = json.load(f)
+
+	if isinstance(spec, list):
+		spec = {'jobs': spec}
+	defaults = spec.get('defaults', {})
+
+	jobs = []
+	for index, settings in enumerate(spec.get('jobs', [])):
+		job = dict(JOB_DEFAULTS)
+		job.update(defaults)
+		job.update(settings)
+		unknown = set(job) - set(JOB_DEFAULTS)
+		if len(unknown) > 0:
+			raise ValueError('unknown job settings ' + str(sorted(unknown)) + ' in ' + filename)
+		if job['name'] is None:
+			job['name'] = 'job_%d' % (index + 1)
+		if job['angles'] is None:
+			job['angles'] = job['n']
+		if isinstance(job['outputs'], str):
+			job['outputs'] = [job['outputs']]
+		jobs.append(job)
+
+	return jobs
+
+
+def run_job(job, storage_directory='results/batch'):
+
+	""" Run one batch job
+	summary = run_job(job, storage_directory) makes the phantom and source
+	given by job (as from load_jobs), reconstructs it with
+	scan_and_reconstruct, and writes its outputs into storage_directory:
+
+		npy - the reconstruction in Hounsfield Units, as name.npy
+		dicom - the reconstruction as name_0001.dcm
+		metrics - name.json, with the mean, standard deviation and number of
+			pixels of the reconstruction in each material of the phantom, the
+			time of each stage, and the job's fidelity
+
+	A job with a fidelity below 1 is a screening run (see
+	scan_and_reconstruct), which is noted in its DICOM ImageComments, so
+	that its outputs are not mistaken for full reconstructions.
+
+	summary is a dictionary of the job's name, fidelity, time and output
+	files, or of its error if it failed. The material and source tables are
+	only loaded the first time a job is run in each process."""
+
+	start = time.perf_counter()
+	summary = {'name': job['name'], 'fidelity': job['fidelity'], 'files': []}
+	try:
+		material, source = _load_tables()
+
+		phantom = ct_phantom(material.name, job['n'], job['phantom'], job['metal'])
+		photons = _photons(job['source'], material, source)
+		rng = None if job['seed'] is None else np.random.default_rng(job['seed'])
+
+		# a screening run is flagged in the outputs rather than warned about
+		monitor = Monitor()
+		with warnings.catch_warnings():
+			warnings.simplefilter('ignore', ScreeningWarning)
+			reconstruction = scan_and_reconstruct(photons, material, phantom, job['scale'], job['angles'], job['mas'], job['alpha'],
+				monitor=monitor, engine=job['engine'], rng=rng, fidelity=job['fidelity'])
+		comments = None
+		if job['fidelity'] < 1:
+			comments = 'screening run at a fidelity of ' + str(job['fidelity'])
+
+		for output in job['outputs']:
+			if output == 'npy':
+				save_numpy_array(reconstruction, storage_directory, job['name'] + '.npy')
+				summary['files'].append(job['name'] + '.npy')
+			elif output == 'dicom':
+				# create storage_directory if needed
+				get_full_path(storage_directory, job['name'])
+				create_dicom(reconstruction, job['name'], job['scale'] * 10, storage_directory=storage_directory, comments=comments)
+				summary['files'].append(job['name'] + '_0001.dcm')
+			elif output == 'metrics':
+				mean, std, pixels = label_statistics(reconstruction, phantom, len(material.name))
+				metrics = {'job': job, 'fidelity': job['fidelity'], 'materials': {material.name[m]: {'mean': mean[m], 'std': std[m], 'pixels': int(pixels[m])}
+					for m in np.flatnonzero(pixels)}, 'stages': monitor.report()}
+				with open(get_full_path(storage_directory, job['name'] + '.json'), 'w') as f:
+					json.dump(metrics, f, indent=1)
+				summary['files'].append(job['name'] + '.json')
+			else:
+				raise ValueError('outputs should be npy, dicom or metrics, got ' + str(output))
+
+	except Exception as e:
+		summary['error'] = repr(e)
+
+	summary['time'] = time.perf_counter() - start
+	return summary
+
+
+def run_batch(jobs, workers=None, storage_directory='results/batch', progress=None):
+
+	""" Run batch jobs across a pool of worker processes
+	summaries = run_batch(jobs, workers, storage_directory) runs every job
+	from load_jobs with run_job, on a pool of workers processes (which
+	defaults to os.cpu_count()), and returns the summary of each in the same
+	order. With one worker the jobs are run in this process.
+
+	The workers are started with the 'spawn' method rather than forked, as
+	forking after numba's parallel threads have been started, for example
+	by an earlier reconstruction, leaves the workers stuck. Each worker
+	loads the material and source tables once when it starts, so there is
+	almost no cost per job. A script which calls run_batch must therefore
+	do so under if __name__ == '__main__', as the workers import it.
+
+	progress is an optional function progress(summary) which is called as
+	each job finishes."""
+
+	if workers is None:
+		workers = os.cpu_count() or 1
+	workers = max(1, min(workers, len(jobs)))
+
+	summaries = []
+	if workers == 1:
+		for job in jobs:
+			summaries.append(run_job(job, storage_directory))
+			if progress is not None:
+				progress(summaries[-1])
+		return summaries
+
+	with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'), initializer=_load_tables) as pool:
+		for summary in pool.map(run_job, jobs, [storage_directory] * len(jobs)):
+			summaries.append(summary)
+			if progress is not None:
+				progress(summary)
+
+	return summaries
+
+
+def _load_tables():
+	"""returns the material and source tables, loading them the first time
+	in each process"""
+
+	global _tables
+	if _tables is None:
+		_tables = (Material(), Source())
+	return _tables
+
+
+def _photons(spec, material, source):
+	"""returns the source photons given by a job's source setting, which is
+	either the name of a source or a dict of fake_source arguments, with
+	the filter given by the name of a material"""
+
+	if isinstance(spec, str):
+		return source.photon(spec)
+
+	coeff = None
+	if spec.get('filter') is not None:
+		coeff = material.coeff(spec['filter'])
+	return fake_source(material.mev, spec['mvp'], coeff, spec.get('thickness', 0), spec.get('method', 'normal'))
+
+
+def _print_summary(summary):
+	if 'error' in summary:
+		print('%s failed after %.2f s: %s' % (summary['name'], summary['time'], summary['error']))
+	else:
+		print('%s done in %.2f s: %s' % (summary['name'], summary['time'], ' '.join(summary['files'])))
+	sys.stdout.flush()
+
+
+if __name__ == '__main__':
+
+	parser = argparse.ArgumentParser(description='Run batches of CT simulation jobs from JSON or YAML job specs')
+	parser.add_argument('specs', nargs='+', help='job spec files')
+	parser.add_argument('--workers', type=int, default=None, help='number of worker processes (default: the number of CPUs)')
+	parser.add_argument('--output', default='results/batch', help='directory for the outputs')
+	args = parser.parse_args()
+
+	jobs = []
+	for spec in args.specs:
+		jobs.extend(load_jobs(spec))
+
+	summaries = run_batch(jobs, args.workers, args.output, _print_summary)
+	with open(get_full_path(args.output, 'batch.json'), 'w') as f:
+		json.dump(summaries, f, indent=1)
+
+	failed = [s['name'] for s in summaries if 'error' in s]
+	if len(failed) > 0:
+		print(str(len(failed)) + ' jobs failed')
+		sys.exit(1)
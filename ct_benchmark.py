@@ -0,0 +1,335 @@
+import argparse
+import copy
+import json
+import os
+import platform
+import sys
+import time
+import tracemalloc
+import numpy as np
+from material import *
+from source import *
+from fake_source import *
+from ct_phantom import *
+from ct_detect import *
+from scan_and_reconstruct import *
+from xtreme import *
+from quantized_sinogram import *
+from ct_tune import *
+
+
+def benchmark(ns=(128, 256, 512, 1024), angles=(None,), bins=(1, None), types=(1, 3), repeats=1, memory=True, xtreme=True, storage_directory='results/benchmark'):
+
+	""" Time each stage of the CT simulation pipeline
+
+	results = benchmark() times ct_phantom, ct_scan, ct_detect, ct_calibrate,
+	ramp_filter, back_project, hu and the end-to-end scan_and_reconstruct for
+	every combination of:
+
+		ns - phantom sizes
+		angles - numbers of angles, where None means the same as n
+		bins - numbers of energy bins in the source, where None means all of
+			the energies in the material table
+		types - ct_phantom types
+
+	as well as Xtreme reading from a synthetic RSQ file of each size. The
+	alternatives to the compiled back_project are also timed on the same
+	sinogram, as back_project_numpy (without the compiled kernel) and
+	fast_back_project, to show the sizes at which each is worth using.
+
+	Each stage is timed repeats times and the fastest kept. If memory is True
+	each stage is then run once more with tracemalloc to find its peak memory,
+	which is kept separate so it does not slow down the timings.
+
+	results is a dict which can be saved with save_benchmark, and contains
+	one entry per stage and case, keyed by a name such as
+	'ct_scan n=256 angles=256 bins=1 type=3'."""
+
+	material = Material()
+	source = Source()
+	results = {}
+
+	for n in ns:
+
+		# keep the phantom the same physical size at every n
+		scale = 0.1 * 256 / n
+
+		for a in angles:
+			if a is None:
+				a = n
+
+			for b in bins:
+				m, photons = _energy_bins(material, source, b)
+				photons = photons * 10000 * pow(scale, 2)
+
+				for t in types:
+					case = {'n': n, 'angles': a, 'bins': len(photons), 'type': t}
+					print('Benchmarking ' + _case_name(case))
+
+					stages = {}
+					stages['ct_phantom'] = lambda: ct_phantom(m.name, n, t)
+					phantom = stages['ct_phantom']()
+					stages['ct_scan'] = lambda: ct_scan(photons, m, phantom, scale, a)
+					scan = stages['ct_scan']()
+					stages['ct_detect'] = lambda: ct_detect(photons, m.coeff('Water'), np.linspace(0, 2 * n * scale, a * n))
+					stages['ct_calibrate'] = lambda: ct_calibrate(photons, m, scan, scale)
+					sinogram = stages['ct_calibrate']()
+					stages['ramp_filter'] = lambda: ramp_filter(sinogram, scale)
+					sinogram = stages['ramp_filter']()
+					stages['back_project'] = lambda: back_project(sinogram)
+					reconstruction = stages['back_project']()
+					stages['back_project_numpy'] = lambda: back_project(sinogram, jit=False)
+					stages['fast_back_project'] = lambda: fast_back_project(sinogram)
+					stages['hu'] = lambda: hu(photons, m, reconstruction.copy(), scale)
+					stages['scan_and_reconstruct'] = lambda: scan_and_reconstruct(photons / (10000 * pow(scale, 2)), m, phantom, scale, a)
+
+					for name, stage in stages.items():
+						results[name + ' ' + _case_name(case)] = _measure(stage, case, name, repeats, memory)
+
+		# Xtreme reading only depends on the number of samples
+		if xtreme:
+			filename = write_rsq(storage_directory, n, n)
+			x = Xtreme(filename)
+			case = {'n': n, 'angles': int(x.recon_angles)}
+			stages = {'xtreme_slice': lambda: x.get_rsq_slice(0), 'xtreme_scan': lambda: x.get_rsq_scan(0)}
+			for name, stage in stages.items():
+				results[name + ' ' + _case_name(case)] = _measure(stage, case, name, repeats, memory)
+			os.remove(filename)
+
+	return results
+
+
+def save_benchmark(results, filename):
+	"""save benchmark results, with details of this machine, as JSON"""
+
+	output = {'machine': {'platform': platform.platform(), 'processor': platform.processor(),
+		'cpus': os.cpu_count(), 'python': platform.python_version(), 'numpy': np.__version__},
+		'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'results': results}
+
+	directory = os.path.dirname(filename)
+	if directory and not os.path.exists(directory):
+		os.makedirs(directory)
+
+	with open(filename, 'w') as f:
+		json.dump(output, f, indent=1)
+
+
+def load_benchmark(filename):
+	"""load benchmark results saved by save_benchmark"""
+
+	if not os.path.exists(filename):
+		raise Exception('File named ' + filename + ' does not exist')
+
+	with open(filename) as f:
+		return json.load(f)['results']
+
+
+def compare_benchmark(results, baseline, threshold=0.1):
+
+	""" Compare benchmark results against a baseline
+
+	regressions = compare_benchmark(results, baseline, threshold) prints the
+	time and peak memory of each stage in results relative to the same stage
+	in baseline, and returns the names of those which are more than a
+	fraction threshold slower or larger. Stages which are only in one of
+	results or baseline are ignored."""
+
+	regressions = []
+	print('%-60s %10s %10s %8s %8s' % ('stage', 'time', 'baseline', 'ratio', 'memory'))
+	for name in sorted(results):
+		if name not in baseline:
+			continue
+		new = results[name]
+		old = baseline[name]
+		ratio = new['time'] / old['time'] if old['time'] > 0 else 1.0
+		memory_ratio = 1.0
+		if (new.get('peak_memory') is not None) and old.get('peak_memory'):
+			memory_ratio = new['peak_memory'] / old['peak_memory']
+
+		flag = ''
+		if (ratio > 1 + threshold) or (memory_ratio > 1 + threshold):
+			regressions.append(name)
+			flag = ' REGRESSION'
+		print('%-60s %10.4f %10.4f %8.2f %8.2f%s' % (name, new['time'], old['time'], ratio, memory_ratio, flag))
+
+	return regressions
+
+
+def autotune(n, angles=None, dtype=np.float64, repeats=3, approximate=False, save=True, filename=None, material=None):
+
+	""" Choose the fastest kernels and chunk sizes for this machine
+	settings = autotune(n, angles, dtype) times the candidates for each
+	tunable setting of the reconstruction of a sinogram of angles x n
+	samples of type dtype, where angles defaults to n, and returns the
+	fastest of each as a dict:
+
+		jit - whether back_project uses the compiled cubic kernel
+		interpolation - the back_project interpolation, which is 'cubic'
+			unless approximate is True, when 'spline' and 'linear' are
+			also tried
+		fft_length - the ramp_filter FFT length, 'pow2' or 'fast'
+		block_size - the ct_calibrate block size for quantized sinograms
+
+	as well as times, the fastest time of every candidate. Each candidate is
+	run once to compile or warm it up, then timed repeats times.
+
+	If save is True the settings are saved with save_tuned, in filename or
+	by default tune_file(), after which back_project and ct_calibrate use
+	jit and block_size automatically whenever they are given a sinogram of
+	the same size and type on this machine. fft_length and interpolation
+	change the result slightly, so are only used by ramp_filter(...,
+	length='tuned') and back_project(..., interpolation='tuned').
+
+	material is used for the calibration, and defaults to Material()."""
+
+	if angles is None:
+		angles = n
+	if material is None:
+		material = Material()
+	dtype = np.float32 if dtype == np.float32 else np.float64
+
+	# a random sinogram, with counts for the calibration
+	rng = np.random.default_rng(0)
+	sinogram = rng.random((angles, n)).astype(dtype)
+	photons = np.zeros(len(material.mev))
+	photons[np.argmin(np.abs(material.mev - 0.07))] = 1e6
+	counts = quantize_sinogram(1e6 * np.exp(-sinogram), storage=np.uint16, dtype=dtype)
+
+	times = {}
+	def fastest(name, stage, candidates):
+		for candidate in candidates:
+			stage(candidate)
+			times[name + '=' + str(candidate)] = _measure(lambda: stage(candidate), {}, name, repeats, False)['time']
+		return min(candidates, key=lambda candidate: times[name + '=' + str(candidate)])
+
+	settings = {}
+	settings['fft_length'] = fastest('fft_length', lambda length: ramp_filter(sinogram, 0.1, length=length), ['pow2', 'fast'])
+
+	# each back_project kernel is an interpolation, and whether it is compiled
+	kernels = {'cubic': ('cubic', False)}
+	if HAVE_NUMBA:
+		kernels['cubic jit'] = ('cubic', True)
+	if approximate:
+		kernels['spline'] = ('spline', False)
+		kernels['linear'] = ('linear', False)
+	filtered = ramp_filter(sinogram, 0.1, length=settings['fft_length'])
+	kernel = fastest('kernel', lambda kernel: back_project(filtered, jit=kernels[kernel][1], interpolation=kernels[kernel][0]), list(kernels))
+	settings['interpolation'], settings['jit'] = kernels[kernel]
+
+	blocks = [1 << 16, 1 << 18, 1 << 20, 1 << 22]
+	settings['block_size'] = fastest('block_size', lambda block_size: ct_calibrate(photons, material, counts, 0.1, block_size=block_size, noise=False), blocks)
+
+	settings['times'] = times
+	if save:
+		save_tuned(n, angles, dtype, settings, filename)
+
+	return settings
+
+
+def _measure(stage, case, name, repeats, memory):
+	"""returns the fastest time and the peak memory of calling stage"""
+
+	times = []
+	for r in range(repeats):
+		start = time.perf_counter()
+		stage()
+		times.append(time.perf_counter() - start)
+
+	peak = None
+	if memory:
+		tracemalloc.start()
+		stage()
+		peak = tracemalloc.get_traced_memory()[1]
+		tracemalloc.stop()
+
+	result = dict(case)
+	result['stage'] = name
+	result['time'] = min(times)
+	result['peak_memory'] = peak
+	return result
+
+
+def _case_name(case):
+	return ' '.join(key + '=' + str(value) for key, value in case.items())
+
+
+def _energy_bins(material, source, bins):
+	"""returns a copy of material and a source spectrum using only the given
+	number of energy bins, spread evenly over the non-zero part of the
+	'100kVp, 2mm Al' spectrum"""
+
+	photons = source.photon('100kVp, 2mm Al')
+	if bins is None:
+		return material, photons
+
+	nonzero = np.flatnonzero(photons)
+	keep = nonzero[np.round(np.linspace(0, len(nonzero) - 1, bins)).astype(int)]
+
+	m = copy.copy(material)
+	m.mev = material.mev[keep]
+	m.coeffs = material.coeffs[:, keep]
+	return m, photons[keep]
+
+
+def write_rsq(storage_directory, samples, recon_angles, scans=4):
+	"""writes a synthetic Xtreme RSQ file with random data, with the given
+	number of samples and angles in 180 degrees, and returns its name"""
+
+	# with these values the resolution factor in Xtreme is one
+	skip_samples = 36 + 17
+	angles = recon_angles + 24 + 138
+	h = np.zeros(124, dtype=np.int32)
+	h[7] = samples + skip_samples
+	h[8] = angles + 2
+	h[9] = scans
+	h[14] = 100
+	h[19] = h[7]
+	h[20] = scans
+	h[123] = 0
+
+	data = np.random.randint(0, 4096, (scans, angles + 2, samples + skip_samples)).astype(np.int16)
+
+	filename = get_full_path(storage_directory, 'benchmark_%d.rsq' % samples)
+	with open(filename, 'wb') as f:
+		f.write(b'CTDATA-HEADER_V1')
+		f.write(h.tobytes())
+		f.seek((h[123] + 1) * 512)
+		f.write(data.tobytes())
+
+	return filename
+
+
+if __name__ == '__main__':
+
+	parser = argparse.ArgumentParser(description='Time each stage of the CT simulation pipeline')
+	parser.add_argument('--n', type=int, nargs='+', default=[128, 256, 512, 1024], help='phantom sizes')
+	parser.add_argument('--angles', type=int, nargs='+', default=None, help='numbers of angles (default: the same as n)')
+	parser.add_argument('--bins', type=int, nargs='+', default=[1, 0], help='numbers of energy bins, 0 for all energies')
+	parser.add_argument('--types', type=int, nargs='+', default=[1, 3], help='ct_phantom types')
+	parser.add_argument('--repeats', type=int, default=1, help='number of timings to take the fastest of')
+	parser.add_argument('--no-memory', action='store_true', help='do not measure peak memory')
+	parser.add_argument('--output', default='results/benchmark/benchmark.json', help='JSON file for the results')
+	parser.add_argument('--baseline', default=None, help='JSON file of results to compare against')
+	parser.add_argument('--threshold', type=float, default=0.1, help='fractional slowdown counted as a regression')
+	parser.add_argument('--tune', action='store_true', help='choose and save the fastest settings for each n and angles instead, for later runs')
+	parser.add_argument('--float32', action='store_true', help='tune for np.float32 rather than np.float64')
+	parser.add_argument('--approximate', action='store_true', help='allow spline and linear back-projection interpolation when tuning')
+	args = parser.parse_args()
+
+	if args.tune:
+		material = Material()
+		for n in args.n:
+			for a in args.angles or [n]:
+				settings = autotune(n, a, np.float32 if args.float32 else np.float64, max(args.repeats, 3), args.approximate, material=material)
+				print('n=%d angles=%d: jit=%s interpolation=%s fft_length=%s block_size=%d' % (n, a, settings['jit'], settings['interpolation'], settings['fft_length'], settings['block_size']))
+		print('saved in ' + tune_file())
+		sys.exit(0)
+
+	results = benchmark(args.n, args.angles or [None], [b or None for b in args.bins], args.types, args.repeats, not args.no_memory)
+	save_benchmark(results, args.output)
+
+	if args.baseline is not None:
+		regressions = compare_benchmark(results, load_benchmark(args.baseline), args.threshold)
+		if len(regressions) > 0:
+			print(str(len(regressions)) + ' stages have regressed')
+			sys.exit(1)
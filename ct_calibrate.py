@@ -2,62 +2,105 @@ import numpy as np
 import scipy
 from scipy import interpolate
 import matplotlib.pyplot as plt
-import sys
 from ct_detect import ct_detect
 from ct_lib import *
+from ct_monitor import *
+from quantized_sinogram import *
+from ct_tune import *
 
-def ct_calibrate(photons, material, sinogram, scale, correct=True):
+@monitored('ct_calibrate')
+def ct_calibrate(photons, material, sinogram, scale, correct=True, monitor=None, block_size=None, noise=True, rng=None, threshold=None):
 
 	""" ct_calibrate convert CT detections to linearised attenuation
 	sinogram = ct_calibrate(photons, material, sinogram, scale) takes the CT detection sinogram
 	in x (angles x samples) and returns a linear attenuation sinogram
 	(angles x samples). photons is the source energy distribution, material is the
 	material structure containing names, linear attenuation coefficients and
-	energies in mev, and scale is the size of each pixel in x, in cm."""
-	# Get dimensions and work out detection for just air of twice the side
-	# length (has to be the same as in ct_scan.py)
+	energies in mev, and scale is the size of each pixel in x, in cm.
 
-	# get sinogram dimensions
-	n = sinogram.shape[1]
-	angles = sinogram.shape[0]
+	sinogram can also be a stack (slices x angles x samples), in which case
+	the same calibration is applied to every slice.
 
-	print('Calibrating')
+	sinogram = ct_calibrate(photons, material, sinogram, scale, correct=False)
+	returns the attenuation -log(sinogram / air) without the beam hardening
+	correction, so that the reconstruction is in cm^-1 rather than relative
+	to water (see hu).
 
-	# initialise calibration sinogram
-	calibration_scan = np.zeros((angles, n))
+	sinogram can also be a QuantizedSinogram of counts or log counts, as from
+	ct_scan with quantize, which is converted in blocks of about block_size
+	values rather than all at once. block_size only changes the speed and
+	memory, not the result, so it defaults to the size chosen by
+	ct_benchmark.autotune for the size of sinogram, if it has been tuned,
+	otherwise 1 << 20. The size used is noted in monitor.
 
+	The scans through air and water used for the calibration are made with
+	ct_detect, given noise, rng and threshold. noise can be False to
+	calibrate against the expected detections rather than noisy ones.
 
-	# initialise depth array to twice the side length and scale
-	depth = np.full(n, float(2*n))
-	depth *= scale
+	The output is np.float32 if sinogram is, otherwise np.float64.
 
-	# run scan through air once and repeat along all angles
-	calibration_scan = np.repeat( ct_detect(photons, material.coeff('Air'), depth)[:, np.newaxis], \
-					angles, axis=1 )
+	monitor is an optional ct_monitor.Monitor which is told about the time
+	and memory used."""
+	# Get dimensions and work out detection for just air of twice the side
+	# length (has to be the same as in ct_scan.py)
 
-	calibration_scan = np.transpose(calibration_scan)
+	# get sinogram dimensions, where sinogram can also be a stack of
+	# sinograms (slices x angles x samples) which all share one calibration
+	n = sinogram.shape[-1]
+	dtype = sinogram.dtype if sinogram.dtype == np.float32 else np.float64
 
-	# perform calibration
-	sinogram = -np.log(sinogram/calibration_scan)
+	# initialise depth array to twice the side length and scale
+	depth = np.full(n, float(2*n))
+	depth *= scale
 
-	
-	
+	# run scan through air once, which applies along all angles
+	calibration_scan = ct_detect(photons, material.coeff('Air'), depth, noise=noise, rng=rng, threshold=threshold).astype(dtype)
 
 	#BEAM HARDENING CORRECTION 
 
 	#create array of water depths and find attenuations at each depth
 	water_depth=np.linspace(0, 2*n, n)*scale
 
-	calibration_air=ct_detect(photons, material.coeff('Air'), depth)
-	water_attenuation=ct_detect(photons, material.coeff('Water'), water_depth)
+	calibration_air=ct_detect(photons, material.coeff('Air'), depth, noise=noise, rng=rng, threshold=threshold)
+	water_attenuation=ct_detect(photons, material.coeff('Water'), water_depth, noise=noise, rng=rng, threshold=threshold)
 	water_calibrated = -np.log(water_attenuation/calibration_air)
 
 	#interpolate to obtain thickness as a function of attenuation only for the linear region
 	f_linear=scipy.interpolate.interp1d(water_calibrated, water_depth, 'linear', fill_value='extrapolate')
 
-	#calibrate with respect to water by substituting attenuation values in original sinogram with corresponding water thickness.
-	#if saturation is reached, substitute with saturation value
-	
-	sinogram=f_linear(sinogram)
+	# without correction the attenuation itself is returned
+	if not correct:
+		f_linear = lambda attenuation: attenuation
+
+	if not isinstance(sinogram, QuantizedSinogram):
+
+		# perform calibration
+		sinogram = -np.log(sinogram/calibration_scan)
+
+		#calibrate with respect to water by substituting attenuation values in original sinogram with corresponding water thickness.
+		#if saturation is reached, substitute with saturation value
+		sinogram=f_linear(sinogram).astype(dtype, copy=False)
+
+	else:
+
+		# a quantized sinogram is converted a block of angles at a time, so
+		# that only the output and one block are ever held as floating point
+		if block_size is None:
+			block_size = tuned(n, sinogram.shape[-2], dtype).get('block_size', 1 << 20)
+		monitor.note('ct_calibrate', block_size=block_size)
+		calibrated = np.empty(sinogram.shape, dtype=dtype)
+		rows = max(1, block_size // n)
+		log_calibration = np.log(calibration_scan)
+		for index in np.ndindex(sinogram.shape[:-2]):
+			for a in range(0, sinogram.shape[-2], rows):
+				block = index + (slice(a, a + rows),)
+				if sinogram.kind == 'log':
+					attenuation = log_calibration - sinogram[block]
+				else:
+					attenuation = -np.log(sinogram[block]/calibration_scan)
+				calibrated[block] = f_linear(attenuation)
+		sinogram = calibrated
+
+	monitor.count('ct_calibrate', 2 * sinogram.nbytes, 2)
 	
 	return sinogram
\ No newline at end of file
@@ -1,7 +1,6 @@
 import numpy as np
-from attenuate import attenuate
 
-def ct_detect(p, coeffs, depth, mas=10000):
+def ct_detect(p, coeffs, depth, mas=10000, noise=True, rng=None, threshold=None):
 
 	"""ct_detect returns detector photons for given material depths.
 	y = ct_detect(p, coeffs, depth, mas) takes a source energy
@@ -10,8 +9,17 @@ def ct_detect(p, coeffs, depth, mas=10000):
 	in depth (materials, samples) and returns the detections at each sample
 	in y (samples).
 
-mas defines the current-time-product which affects the noise distribution
-	for the linear attenuation"""
+mas is the current-time-product, which is accepted for compatibility but
+	not used. The photons p are expected to already include it, as in
+	scan_and_reconstruct, so the noise scales with it through p.
+
+	noise can be False to return the expected detections without any noise,
+	for calibration and reference runs. rng is an optional
+	numpy.random.Generator used for the noise, otherwise the global numpy
+	random state is used, so that np.random.seed still applies. Every
+	count is drawn from the poisson distribution unless threshold is
+	given, in which case counts with a mean above threshold are drawn from
+	the Gaussian approximation, which is much faster (see poisson_noise)."""
 
 	# check p for number of energies
 	if type(p) != np.ndarray:
@@ -35,7 +43,7 @@ mas defines the current-time-product which affects the noise distribution
 	if type(depth) != np.ndarray:
 		depth = np.array([depth]).reshape((1,1))
 	elif depth.ndim == 1:
-		if materials is 1:
+		if materials == 1:
 			depth = depth.reshape(1, len(depth))
 		else:
 			depth = depth.reshape(len(depth), 1)
@@ -46,39 +54,56 @@ mas defines the current-time-product which affects the noise distribution
 	samples = depth.shape[1]
 
 
-	# extend source photon array so it covers all samples
-	detector_photons = np.zeros([energies, samples])
-	for e in range(energies):
-		detector_photons[e] = p[e]
+	# only energies which the source actually produces contribute, and the
+	# attenuation through every material is found with one matrix product
+	# and a single exponential, rather than one material at a time
+	energy = np.flatnonzero(p)
+	detector_photons = p[energy] @ np.exp(-(coeffs[:, energy].T @ depth))
 
-	# calculate array of residual mev x samples for each material in turn
-	for m in range(materials):
-		detector_photons = attenuate(detector_photons, coeffs[m], depth[m])
+	# background radiation follows a poisson distribution with a fixed mean,
+	# and multiple scattering scales with the number of source photons. The
+	# sum of these independent poisson noises is poisson with the sum of
+	# their means, so they are drawn together
+	background = 5e+5 + 0.000001 * np.sum(p)
 
-	
+	if not noise:
+		detector_photons = detector_photons + background
+	else:
+		# find the mean of the poisson distribution to model the estimated
+		# transmitted scatterer distribution, in units of 1e6 photons
+		detector_photons = poisson_noise(detector_photons / 1e6, rng, threshold)
+		detector_photons *= 1e6
 
+		# sum the noise
+		detector_photons += poisson_noise(np.full(samples, background), rng, threshold)
+
+	# minimum detection is one photon
+	detector_photons = np.clip(detector_photons, 1, None)
 
-	# sum this over energies
-	detector_photons = np.sum(detector_photons, axis=0)
+	return detector_photons
 
-	# find the mean of the poisson distribution to model the estimated transmitted
-	# scatterer distribution
-	lam = (detector_photons.astype(np.float64))
-	detector_photons = np.random.poisson(lam/1e6).astype('float64')
-	detector_photons *= 1e6
 
-	# model noise
-	
-	# background radiation follows a poisson distribution with a fixed mean
-	background = np.random.poisson(5e+5, max(depth.shape))
+def poisson_noise(lam, rng=None, threshold=None):
 
-	# model noise as a result of multiple scattering, which scales with the number of source photons
-	scatterer = np.random.poisson((0.000001 * np.sum(p)), max(depth.shape))
+	"""poisson_noise returns poisson distributed counts with means lam
+	y = poisson_noise(lam, rng, threshold) draws every count in lam at once,
+	using the numpy.random.Generator rng or the global numpy random state if
+	rng is None. If threshold is given, such as 1000, counts with a mean
+	above threshold are instead drawn from the Gaussian approximation, with
+	the same mean and variance and rounded to whole counts, which is
+	indistinguishable for large means and much faster."""
 
-	# sum the noise
-	detector_photons += (background + scatterer).astype('float64')
+	random = np.random if rng is None else rng
+	lam = np.asarray(lam, dtype=np.float64)
 
-	# minimum detection is one photon
-	detector_photons = np.clip(detector_photons, 1, None)
+	if threshold is None:
+		return random.poisson(lam).astype(np.float64)
 
-	return detector_photons
\ No newline at end of file
+	# gaussian approximation for the high counts, and poisson for the rest,
+	# each drawn only where it is used
+	counts = np.empty(lam.shape)
+	low = lam <= threshold
+	high = ~low
+	counts[low] = random.poisson(lam[low])
+	counts[high] = np.rint(lam[high] + np.sqrt(lam[high]) * random.standard_normal(np.count_nonzero(high)))
+	return counts
@@ -0,0 +1,289 @@
+import math
+import numpy as np
+
+# numba is optional, and the kernels are only used when it is available.
+# Without it the decorators do nothing, so this module can still be imported
+try:
+	from numba import njit, prange
+	HAVE_NUMBA = True
+except ImportError:
+	HAVE_NUMBA = False
+	prange = range
+	def njit(*args, **kwargs):
+		return lambda f: f
+
+
+def use_jit(jit=None):
+	"""returns whether the compiled kernels should be used, given the jit
+	argument of the calling function (None means use them if possible)"""
+
+	if jit is None:
+		return HAVE_NUMBA
+	if jit and not HAVE_NUMBA:
+		raise ImportError('numba is needed for jit=True')
+	return jit
+
+
+@njit(parallel=True, cache=True)
+def forward_project_kernel(phantom, c, s, depth):
+	"""forward_project_kernel(phantom, c, s, depth) adds up the bilinearly
+	interpolated values of phantom (n x n) along each ray of the projection
+	at the angle with cosine c and sine s, writing the sum for each sample
+	into depth (n). This is the same as ct_scan using map_coordinates, but
+	without forming the rotated coordinates or interpolated image."""
+
+	n = phantom.shape[0]
+	h = n / 2 - 0.5
+	for j in prange(n):
+		x = j - h
+		total = 0.0
+		for i in range(n):
+			y = i - h
+
+			# rotated coordinates, relative to the top left
+			x0 = x * c - y * s + h
+			y0 = x * s + y * c + h
+
+			# constant zero outside the phantom, otherwise bilinear
+			if (x0 < 0) or (y0 < 0) or (x0 > n - 1) or (y0 > n - 1):
+				continue
+			ix = min(int(x0), n - 2)
+			iy = min(int(y0), n - 2)
+			dx = x0 - ix
+			dy = y0 - iy
+			total += (phantom[iy, ix] * (1 - dx) + phantom[iy, ix + 1] * dx) * (1 - dy) \
+				+ (phantom[iy + 1, ix] * (1 - dx) + phantom[iy + 1, ix + 1] * dx) * dy
+		depth[j] = total
+
+
+@njit(parallel=True, cache=True)
+def forward_project_labels_kernel(labels, c, s, depth):
+	"""forward_project_labels_kernel(labels, c, s, depth) adds up the path
+	length through every material at once along each ray of the projection
+	at the angle with cosine c and sine s, for a label phantom (n x n) from
+	ct_phantom. Each bilinear weight is added to the material of the pixel
+	it comes from, so depth (materials x n) is the same as calling
+	forward_project_kernel with a 0/1 phantom for each material in turn."""
+
+	n = labels.shape[0]
+	h = n / 2 - 0.5
+	for j in prange(n):
+		x = j - h
+		for i in range(n):
+			y = i - h
+
+			# rotated coordinates, relative to the top left
+			x0 = x * c - y * s + h
+			y0 = x * s + y * c + h
+
+			# constant zero outside the phantom, otherwise bilinear
+			if (x0 < 0) or (y0 < 0) or (x0 > n - 1) or (y0 > n - 1):
+				continue
+			ix = min(int(x0), n - 2)
+			iy = min(int(y0), n - 2)
+			dx = x0 - ix
+			dy = y0 - iy
+			depth[labels[iy, ix], j] += (1 - dx) * (1 - dy)
+			depth[labels[iy, ix + 1], j] += dx * (1 - dy)
+			depth[labels[iy + 1, ix], j] += (1 - dx) * dy
+			depth[labels[iy + 1, ix + 1], j] += dx * dy
+
+
+@njit(parallel=True, cache=True)
+def back_project_cubic_kernel(coeffs, xs, ys, weight, reconstruction, first=0, total=0):
+	"""back_project_cubic_kernel(coeffs, xs, ys, weight, reconstruction) adds
+	the back-projection of every angle into reconstruction (len(ys) x
+	len(xs)), where xs and ys are the output pixel coordinates relative to
+	the centre of rotation, in samples. coeffs (angles x samples-1 x 4) are
+	the piecewise cubic coefficients of each filtered projection, and each
+	angle is multiplied by weight.
+
+	back_project_cubic_kernel(coeffs, xs, ys, weight, reconstruction, first,
+	total) treats coeffs as the angles first onwards out of total angles in
+	180 degrees, rather than all of them."""
+
+	angles = coeffs.shape[0]
+	if total == 0:
+		total = angles
+	ns = coeffs.shape[1] + 1
+	h = ns / 2 - 0.5
+	for i in prange(len(ys)):
+		for a in range(angles):
+			p = math.pi / 2 + (first + a) * math.pi / total
+			c = math.cos(p)
+			s = math.sin(p)
+			for j in range(len(xs)):
+				x0 = xs[j] * c - ys[i] * s + h
+
+				# zero outside the projection, as for interp1d
+				if (x0 < 0) or (x0 > ns - 1):
+					continue
+				k = min(int(x0), ns - 2)
+				d = x0 - k
+				reconstruction[i, j] += (((coeffs[a, k, 0] * d + coeffs[a, k, 1]) * d + coeffs[a, k, 2]) * d + coeffs[a, k, 3]) * weight
+
+
+@njit(parallel=True, cache=True)
+def back_project_cubic_symmetric_kernel(coeffs, xs, weight, reconstruction, groups):
+	"""back_project_cubic_symmetric_kernel(coeffs, xs, weight, reconstruction,
+	groups) is the same as back_project_cubic_kernel for every angle of
+	coeffs, onto a square grid with coordinates xs along both axes which is
+	symmetric about the centre of rotation. groups (groups x 4) are the
+	angles of each group from back_project.symmetric_angles, in the columns
+	of the views None, 'flip transpose', 'flip' and 'transpose', or -1 if the
+	group has no such angle.
+
+	The rotated coordinate and spline search of the first angle of a group
+	at each pixel are shared by every angle of the group, each of which is
+	added at the flipped or transposed pixel. The transposed views are added
+	up in a second image, which is transposed and added at the end, so that
+	each thread only adds along a pair of mirrored rows of both."""
+
+	total = coeffs.shape[0]
+	ns = coeffs.shape[1] + 1
+	h = ns / 2 - 0.5
+	n = len(xs)
+	c = np.empty(len(groups))
+	s = np.empty(len(groups))
+	for g in range(len(groups)):
+		p = math.pi / 2 + groups[g, 0] * math.pi / total
+		c[g] = math.cos(p)
+		s[g] = math.sin(p)
+
+	transposed = np.zeros((n, n), dtype=reconstruction.dtype)
+	for r in prange((n + 1) // 2):
+		for t in range(2):
+			a = np.int64(r) if t == 0 else n - 1 - np.int64(r)
+			if (t == 1) and (a == r):
+				continue
+			for g in range(len(groups)):
+
+				# a view which the group does not have is added with no weight
+				a0, a1, a2, a3 = max(groups[g, 0], 0), max(groups[g, 1], 0), max(groups[g, 2], 0), max(groups[g, 3], 0)
+				w0 = weight if groups[g, 0] >= 0 else 0.0
+				w1 = weight if groups[g, 1] >= 0 else 0.0
+				w2 = weight if groups[g, 2] >= 0 else 0.0
+				w3 = weight if groups[g, 3] >= 0 else 0.0
+				for b in range(n):
+					x0 = xs[b] * c[g] - xs[a] * s[g] + h
+
+					# zero outside the projection, as for interp1d
+					if (x0 < 0) or (x0 > ns - 1):
+						continue
+					k = min(int(x0), ns - 2)
+					d = x0 - k
+					reconstruction[a, b] += (((coeffs[a0, k, 0] * d + coeffs[a0, k, 1]) * d + coeffs[a0, k, 2]) * d + coeffs[a0, k, 3]) * w0
+					transposed[a, n - 1 - b] += (((coeffs[a1, k, 0] * d + coeffs[a1, k, 1]) * d + coeffs[a1, k, 2]) * d + coeffs[a1, k, 3]) * w1
+					reconstruction[n - 1 - a, b] += (((coeffs[a2, k, 0] * d + coeffs[a2, k, 1]) * d + coeffs[a2, k, 2]) * d + coeffs[a2, k, 3]) * w2
+					transposed[a, b] += (((coeffs[a3, k, 0] * d + coeffs[a3, k, 1]) * d + coeffs[a3, k, 2]) * d + coeffs[a3, k, 3]) * w3
+
+	for i in prange(n):
+		for j in range(n):
+			reconstruction[i, j] += transposed[j, i]
+
+
+@njit(cache=True)
+def _bspline(coefficients, x, pad, length):
+	"""returns the cubic B-spline with coefficients (samples+2*pad), which
+	are of a row padded with pad zeros at each end, at x in samples of the
+	unpadded row, with zero outside the row as for fast_back_project"""
+
+	if (x < 0) or (x > length - 1):
+		return 0.0
+	t = x + pad
+	k = int(t)
+	d = t - k
+	e = 1 - d
+	return (coefficients[k - 1] * e * e * e + coefficients[k] * ((3 * d - 6) * d * d + 4)
+		+ coefficients[k + 1] * (((-3 * d + 3) * d + 3) * d + 1) + coefficients[k + 2] * d * d * d) / 6
+
+
+@njit(parallel=True, cache=True)
+def spline_filter_rows_kernel(g, pad, coefficients):
+	"""spline_filter_rows_kernel(g, pad, coefficients) sets coefficients
+	(angles x samples+2*pad) to the cubic B-spline coefficients of each row
+	of g (angles x samples) padded with pad zeros at each end. This is the
+	same as scipy.ndimage.spline_filter1d(order=3), with its default mirror
+	boundary, to within rounding."""
+
+	z = math.sqrt(3) - 2
+	n = coefficients.shape[1]
+	zn = z ** (n - 1)
+
+	# the start of the causal filter only depends on the first few samples,
+	# as z^36 is below double precision
+	horizon = min(n - 1, 36)
+	for a in prange(g.shape[0]):
+		row = coefficients[a]
+		row[:] = 0
+		for i in range(g.shape[1]):
+			row[pad + i] = 6 * g[a, i]
+
+		# causal filter, starting from the mirrored row
+		zi = z
+		first = row[0] + zn * row[n - 1]
+		for i in range(1, horizon):
+			first += zi * (row[i] + zn * row[n - 1 - i])
+			zi *= z
+		previous = first / (1 - zn * zn)
+		row[0] = previous
+		for i in range(1, n):
+			previous = row[i] + z * previous
+			row[i] = previous
+
+		# anti-causal filter
+		previous = (z * row[n - 2] + row[n - 1]) * z / (z * z - 1)
+		row[n - 1] = previous
+		for i in range(n - 2, -1, -1):
+			previous = z * (previous - row[i])
+			row[i] = previous
+
+
+@njit(parallel=True, cache=True)
+def spline_rows_kernel(coefficients, x, pad, out):
+	"""spline_rows_kernel(coefficients, x, pad, out) sets each row of out
+	(angles x points) to the cubic B-spline with the same row of
+	coefficients (angles x samples+2*pad) at the positions in the same row
+	of x (angles x points), as _bspline. This is the same as
+	map_coordinates(order=3) on the rows, without forming their indices."""
+
+	length = coefficients.shape[1] - 2 * pad
+	for a in prange(x.shape[0]):
+		for j in range(x.shape[1]):
+			out[a, j] = _bspline(coefficients[a], x[a, j], pad, length)
+
+
+@njit(cache=True)
+def fast_back_project_base_kernel(coefficients, pad, c, s, weight, upsample, reconstruction):
+	"""fast_back_project_base_kernel(coefficients, pad, c, s, weight,
+	upsample, reconstruction) adds the back-projection of each row of
+	coefficients (angles x samples+2*pad), the padded cubic B-spline of a
+	projection centred on the middle of reconstruction with upsample samples
+	per pixel, at the angle with cosine c and sine s, multiplied by weight.
+	This is the direct base case of fast_back_project, which is only ever
+	a small sub-image, so it is not split between threads."""
+
+	rows, columns = reconstruction.shape
+	h = (coefficients.shape[1] - 2 * pad - 1) / 2
+	length = coefficients.shape[1] - 2 * pad
+	for i in range(rows):
+		y = i - (rows - 1) / 2
+		for j in range(columns):
+			x = j - (columns - 1) / 2
+			total = 0.0
+			for a in range(len(weight)):
+				total += weight[a] * _bspline(coefficients[a], (x * c[a] - y * s[a]) * upsample + h, pad, length)
+			reconstruction[i, j] += total
+
+
+def cubic_coefficients(sinogram):
+	"""returns the piecewise cubic coefficients (angles x samples-1 x 4) of
+	the not-a-knot cubic spline through each row of sinogram, which is the
+	same spline as used by interp1d(kind='cubic')"""
+
+	import scipy.interpolate
+
+	spline = scipy.interpolate.CubicSpline(np.arange(sinogram.shape[-1]), sinogram, axis=-1)
+
+	# spline.c is (4 x samples-1 x angles)
+	return np.ascontiguousarray(np.transpose(spline.c, (2, 1, 0)))
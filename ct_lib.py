@@ -2,7 +2,9 @@ import matplotlib.pyplot as plt
 import numpy as np
 import numpy.matlib
 import os
+from functools import lru_cache
 from matplotlib.patches import Rectangle
+from ct_metrics import radial_profile
 
 def draw(data, map='gray', caxis=None):
 	"""Draw an image"""
@@ -44,10 +46,38 @@ def save_plot(data, storage_directory, file_name):
 	plt.close()
 
 def convert_phantom(phantom, attenuations):
-	"""Convert phantom from index values to attenuation values"""
-	for i in range(len(attenuations)):
-		phantom[np.where(phantom == i)] = attenuations[i]
-	return phantom
+	"""Convert phantom from index values to attenuation values, or any other
+	per-material values such as those from Material.table, with a single
+	lookup. The phantom itself is left unchanged"""
+	return np.asarray(attenuations)[phantom.astype(np.intp, copy=False)]
+
+@lru_cache(maxsize=16)
+def fov_mask(n):
+	"""returns a boolean mask (n x n) which is True inside the reconstructed
+	circle of an n x n reconstruction, as used by back_project. The mask is
+	cached and read only, so it is only computed once for each size"""
+
+	x = np.arange(n) - (n / 2) + 0.5
+	mask = (x[np.newaxis, :] ** 2 + x[:, np.newaxis] ** 2) <= (n / 2) ** 2
+	mask.flags.writeable = False
+	return mask
+
+def dicom_pixels(x, out=None):
+
+	""" y = dicom_pixels(x) converts the HU values in x into the unsigned
+	16-bit DICOM pixel values stored by create_dicom, which are offset by
+	1024 and limited to the range [0, 4096].
+
+	y = dicom_pixels(x, out) writes them into the existing uint16 array
+	out instead, so that the same buffer can be used for every frame."""
+
+	if out is None:
+		out = np.empty(np.shape(x), dtype=np.uint16)
+
+	# limit first, so that the offset values can go straight into out
+	np.add(np.clip(x, -1024, 3072), 1024, out=out, casting='unsafe')
+
+	return out
 
 def save_numpy_array(data, storage_directory, file_name):
 	"""save a numpy array in .npy format"""
@@ -56,8 +86,11 @@ def save_numpy_array(data, storage_directory, file_name):
 
 	np.save(full_path, data)
 
-def load_numpy_array(storage_directory, file_name):
-	"""load a .npy file into numpy array"""
+def load_numpy_array(storage_directory, file_name, mmap_mode=None):
+	"""load a .npy file into numpy array. If mmap_mode is given, such as 'r'
+	or 'r+', the file is memory-mapped instead, so that only the parts of it
+	which are used are read. For arrays which are too large for this, see
+	ct_store"""
 
 	full_path = os.path.join(storage_directory, file_name)
 
@@ -68,7 +101,7 @@ def load_numpy_array(storage_directory, file_name):
 	if not os.path.exists(full_path):
 		raise Exception('File named ' + full_path + ' does not exist')
 
-	return np.load(full_path)
+	return np.load(full_path, mmap_mode=mmap_mode)
 
 def get_full_path(storage_directory, file_name):
 	#create storage_directory if needed
@@ -147,20 +180,17 @@ def measure_spread(image, location, threshold=0.01):
 	"""given an error image and location of a point, returns radius of circle around that point
 	where error is above a given threshold"""
 
-	# iterate over the pixels surrouding the maximum value and 
-	# calculate the average error at each 'layer' until error is small
-	last_sum = 0
-	for n in range(1,256):
-		# select pixels around the maximum value at distance n
-		layer = (image[(location[0]-n):(location[0]+n+1), (location[1]-n):(location[1]+n+1)])
-		# compute the average error on the outer pixels of that layer
-		avg_error = (np.sum(layer)-last_sum)/ ((np.power((2*n+1), 2)) - np.power((2*n-1), 2))
-		# keep track of current error sum for next iteration
-		last_sum = np.sum(layer)
-
-		# stop when average error drops below threshold
-		if avg_error < threshold:
-			break
+	# average error on each square 'layer' of pixels at distance n around
+	# the maximum value, from one bincount over the distance of each pixel.
+	# the first layer also includes the point itself
+	layers = radial_profile(image, location, 256, metric='chebyshev', statistic='sum')
+	layers[..., 1] += layers[..., 0]
+	n = np.arange(1, 256)
+	avg_error = layers[..., 1:] / (np.power((2*n+1), 2) - np.power((2*n-1), 2))
+
+	# stop at the first layer where the average error drops below threshold
+	below = avg_error < threshold
+	n = np.where(below.any(axis=-1), np.argmax(below, axis=-1) + 1, 255)
 
 	# calculate radius around spreaded area, if n = 0, draws around point attenuator
 	base_radius = np.sqrt(2)/2
@@ -0,0 +1,199 @@
+import numpy as np
+
+# image quality metrics for reconstructions. Every function works on a
+# single image (rows x columns) or on a whole stack of them (... x rows x
+# columns) at once, giving one result per image
+
+
+def distance_map(shape, centre, metric='euclidean'):
+	"""returns the distance of every pixel of an image of the given shape
+	(rows, columns) from centre (row, column). metric can be 'euclidean', or
+	'chebyshev' for square rings as used by measure_spread"""
+
+	rows, columns = np.meshgrid(np.arange(shape[0]) - centre[0], np.arange(shape[1]) - centre[1], indexing='ij')
+	if metric == 'euclidean':
+		return np.sqrt(rows ** 2 + columns ** 2)
+	if metric == 'chebyshev':
+		return np.maximum(np.abs(rows), np.abs(columns))
+	raise ValueError('metric should be euclidean or chebyshev, got ' + str(metric))
+
+
+def radial_profile(image, centre, radii=None, metric='euclidean', statistic='mean'):
+
+	""" Radial profile of an image or stack of images
+	profile = radial_profile(image, centre) returns the mean of image over
+	each ring of pixels one pixel wide around centre (row, column), so that
+	profile[..., r] is the mean of the pixels at distance r to r+1.
+
+	radii limits the profile to that many rings, metric chooses the distance
+	as for distance_map, and statistic can be 'sum' or 'count' instead of
+	'mean'. Rings with no pixels have a mean of zero.
+
+	All of the rings of all of the images are found in one np.bincount over
+	an integer distance map."""
+
+	image = np.asarray(image)
+	rings = distance_map(image.shape[-2:], centre, metric).astype(int)
+	if radii is None:
+		radii = rings.max() + 1
+
+	# pixels beyond the last ring go in an extra bin, which is dropped
+	rings = np.minimum(rings, radii).ravel()
+	count = np.bincount(rings, minlength=radii + 1)[:radii]
+	if statistic == 'count':
+		return np.broadcast_to(count, image.shape[:-2] + (radii,)).copy()
+
+	# give each image its own range of bins
+	stack = image.shape[:-2]
+	images = int(np.prod(stack))
+	bins = (np.arange(images)[:, np.newaxis] * (radii + 1) + rings[np.newaxis, :]).ravel()
+	total = np.bincount(bins, image.reshape((images, -1)).ravel(), images * (radii + 1))
+	total = total.reshape((images, radii + 1))[:, :radii].reshape(stack + (radii,))
+	if statistic == 'sum':
+		return total
+	if statistic == 'mean':
+		return total / np.maximum(count, 1)
+	raise ValueError('statistic should be mean, sum or count, got ' + str(statistic))
+
+
+def masked_rms(image, reference=None, mask=None):
+	"""returns the RMS of image, or of its difference from reference, over
+	the pixels where mask is True (all pixels if mask is None), for each
+	image in a stack"""
+
+	difference = np.asarray(image, dtype=float)
+	if reference is not None:
+		difference = difference - reference
+	if mask is None:
+		return np.sqrt(np.mean(difference ** 2, axis=(-2, -1)))
+	mask = np.broadcast_to(mask, difference.shape)
+	return np.sqrt(np.sum(np.where(mask, difference ** 2, 0), axis=(-2, -1)) / np.sum(mask, axis=(-2, -1)))
+
+
+def label_statistics(image, labels, count=None):
+
+	""" Statistics of the pixels with each label
+	mean, std, pixels = label_statistics(image, labels) returns the mean,
+	standard deviation and number of pixels of image for each value of
+	labels, such as the material indices of a phantom from ct_phantom. The
+	outputs are (... x count), where count defaults to labels.max()+1, and
+	labels can be the same for every image in a stack or one per image.
+
+	All labels of all images are found with np.bincount in one call."""
+
+	image = np.asarray(image, dtype=float)
+	labels = np.broadcast_to(np.asarray(labels).astype(int), image.shape)
+	if count is None:
+		count = int(labels.max()) + 1
+
+	stack = image.shape[:-2]
+	images = int(np.prod(stack))
+	bins = (np.arange(images)[:, np.newaxis] * count + labels.reshape((images, -1))).ravel()
+	values = image.ravel()
+
+	pixels = np.bincount(bins, minlength=images * count)
+	total = np.bincount(bins, values, images * count)
+	squares = np.bincount(bins, values ** 2, images * count)
+
+	mean = total / np.maximum(pixels, 1)
+	std = np.sqrt(np.maximum(squares / np.maximum(pixels, 1) - mean ** 2, 0))
+
+	shape = stack + (count,)
+	return mean.reshape(shape), std.reshape(shape), pixels.reshape(shape)
+
+
+def snr(image, labels, count=None):
+	"""returns the signal to noise ratio (mean / standard deviation) of each
+	labelled region of image, as (... x count), using label_statistics"""
+
+	mean, std, pixels = label_statistics(image, labels, count)
+	return mean / np.where(std > 0, std, np.nan)
+
+
+def cnr(image, labels, label, background, count=None):
+	"""returns the contrast to noise ratio between the regions of image
+	labelled label and background, which is the difference between their
+	means over the standard deviation of background, for each image in a
+	stack. label can also be an array of labels, giving (... x labels)"""
+
+	mean, std, pixels = label_statistics(image, labels, count)
+	if np.ndim(label) > 0:
+		background_mean = mean[..., background, np.newaxis]
+		background_std = std[..., background, np.newaxis]
+	else:
+		background_mean = mean[..., background]
+		background_std = std[..., background]
+	return np.abs(np.take(mean, label, axis=-1) - background_mean) / np.where(background_std > 0, background_std, np.nan)
+
+
+def mtf(image, location, size=32, scale=1):
+
+	""" Modulation transfer function from a point attenuator
+	frequencies, m = mtf(image, location) finds the MTF of a reconstruction
+	of a point phantom (ct_phantom type 2), with the point at location (row,
+	column). A window size pixels square around the point, less the median
+	of its edge as background, is the point spread function, and the MTF is
+	the radial profile of the magnitude of its 2D FFT, normalised to one at
+	zero frequency.
+
+	frequencies are in cycles per cm if scale, the pixel size in cm, is
+	given, otherwise in cycles per pixel, up to the Nyquist frequency. For
+	a stack of images m is (... x frequencies)."""
+
+	image = np.asarray(image, dtype=float)
+	half = size // 2
+	window = image[..., location[0] - half:location[0] - half + size, location[1] - half:location[1] - half + size]
+	if window.shape[-2:] != (size, size):
+		raise ValueError('window of ' + str(size) + ' pixels around ' + str(location) + ' is outside the image')
+
+	# remove the background, taken from the edge of the window
+	edge = np.concatenate((window[..., 0, :], window[..., -1, :], window[..., 1:-1, 0], window[..., 1:-1, -1]), axis=-1)
+	psf = window - np.median(edge, axis=-1)[..., np.newaxis, np.newaxis]
+
+	spectrum = np.abs(np.fft.fftshift(np.fft.fft2(psf), axes=(-2, -1)))
+	profile = radial_profile(spectrum, (half, half), half + 1)
+	m = profile / profile[..., :1]
+
+	frequencies = np.arange(half + 1) / (size * scale)
+	return frequencies, m
+
+
+def nps(image, mask=None, size=32, scale=1):
+
+	""" Noise power spectrum from a uniform region
+	frequencies, power, spectrum = nps(image, mask) finds the noise power
+	spectrum of a reconstruction of a uniform phantom (such as ct_phantom
+	type 1), from every square region size pixels wide, on a regular grid,
+	which lies entirely within mask (rows x columns, shared by every image
+	in a stack, or the whole image if mask is None).
+
+	The mean of each region is removed, and the squared magnitude of its 2D
+	FFT times the pixel area over the number of pixels is averaged over the
+	regions to give spectrum (... x size x size), with zero frequency in
+	the middle. power is its radial profile at frequencies, which are in
+	cycles per cm if scale is the pixel size in cm, otherwise in cycles per
+	pixel. The integral of spectrum over frequency is the variance."""
+
+	image = np.asarray(image, dtype=float)
+	rows = image.shape[-2] // size
+	columns = image.shape[-1] // size
+
+	# split into regions (... x rows x columns x size x size)
+	regions = image[..., :rows * size, :columns * size].reshape(image.shape[:-2] + (rows, size, columns, size))
+	regions = np.moveaxis(regions, -3, -2)
+	if mask is None:
+		inside = np.ones((rows, columns), dtype=bool)
+	else:
+		mask = np.asarray(mask)[:rows * size, :columns * size]
+		inside = mask.reshape((rows, size, columns, size)).all(axis=(1, 3))
+	if not inside.any():
+		raise ValueError('no regions of ' + str(size) + ' pixels lie within the mask')
+
+	regions = regions[..., inside, :, :]
+	regions = regions - regions.mean(axis=(-2, -1), keepdims=True)
+	spectrum = np.abs(np.fft.fftshift(np.fft.fft2(regions), axes=(-2, -1))) ** 2
+	spectrum = spectrum.mean(axis=-3) * pow(scale, 2) / (size * size)
+
+	power = radial_profile(spectrum, (size // 2, size // 2), size // 2 + 1)
+	frequencies = np.arange(size // 2 + 1) / (size * scale)
+	return frequencies, power, spectrum
@@ -0,0 +1,170 @@
+import contextlib
+import functools
+import json
+import sys
+import time
+import tracemalloc
+
+
+class Monitor(object):
+	def __init__(self, progress=None, memory=False, report=None):
+		"""Monitor collects progress, timing and memory information from the
+		stages of the CT pipeline, such as ct_scan and back_project, which
+		accept it through their monitor argument.
+
+		progress is an optional function progress(stage, done, total) which
+		is called as each stage works through its angles, for instance
+		print_progress. If memory is True, tracemalloc is used to find the
+		peak memory of each stage, and is stopped again afterwards unless it
+		was already tracing, for instance for the caller. report is an optional function which is
+		given the report dictionary whenever emit() is called, for example to
+		send it to a monitoring system."""
+
+		self.progress_callback = progress
+		self.memory = memory
+		self.report_callback = report
+		self.stages = {}
+		self._stack = []
+		self._started = False
+
+	def progress(self, stage, done, total):
+		"""reports that stage has completed done out of total steps"""
+
+		if self.progress_callback is not None:
+			self.progress_callback(stage, done, total)
+
+	def count(self, stage, nbytes=0, allocations=1):
+		"""records that stage estimates it has allocated nbytes over a number
+		of arrays. These are worked out by each stage from the sizes of its
+		arrays rather than measured, so they are reported as estimated_bytes
+		and estimated_allocations, unlike peak_memory which is measured"""
+
+		record = self._record(stage)
+		record['estimated_bytes'] += int(nbytes)
+		record['estimated_allocations'] += allocations
+
+	def note(self, stage, **settings):
+		"""records the settings which stage used, such as the interpolation
+		of back_project, under 'settings' in its record"""
+
+		self._record(stage).setdefault('settings', {}).update(settings)
+
+	@contextlib.contextmanager
+	def stage(self, name):
+		"""context manager which times the code within it as stage name"""
+
+		record = self._record(name)
+
+		if self.memory:
+			if not tracemalloc.is_tracing():
+				tracemalloc.start()
+				self._started = True
+			current, peak = tracemalloc.get_traced_memory()
+
+			# keep the peak seen so far by any enclosing stage before resetting
+			if len(self._stack) > 0:
+				self._stack[-1][1] = max(self._stack[-1][1], peak)
+			tracemalloc.reset_peak()
+			self._stack.append([current, current])
+
+		start = time.perf_counter()
+		try:
+			yield record
+		finally:
+			record['time'] += time.perf_counter() - start
+			record['calls'] += 1
+
+			if self.memory:
+				start_memory, peak = self._stack.pop()
+				peak = max(peak, tracemalloc.get_traced_memory()[1])
+				record['peak_memory'] = max(record['peak_memory'] or 0, peak - start_memory)
+				if len(self._stack) > 0:
+					self._stack[-1][1] = max(self._stack[-1][1], peak)
+				elif self._started:
+					tracemalloc.stop()
+					self._started = False
+
+	def report(self):
+		"""returns a dictionary of the time, calls, estimated bytes and
+		allocations, and measured peak memory recorded for each stage.
+		estimated_bytes and estimated_allocations are only the sizes and
+		number of the main arrays each stage allocates, as counted by the
+		stage itself, not including the temporaries within expressions or
+		libraries, so peak_memory (with memory=True) is the one to use for
+		the actual memory"""
+
+		return {name: dict(record) for name, record in self.stages.items()}
+
+	def emit(self):
+		"""passes the report to the report function, if there is one"""
+
+		if self.report_callback is not None:
+			self.report_callback(self.report())
+
+	def save(self, filename):
+		"""saves the report as JSON"""
+
+		with open(filename, 'w') as f:
+			json.dump(self.report(), f, indent=1)
+
+	def _record(self, name):
+		if name not in self.stages:
+			self.stages[name] = {'time': 0.0, 'calls': 0, 'estimated_bytes': 0, 'estimated_allocations': 0, 'peak_memory': None}
+		return self.stages[name]
+
+
+class NullMonitor(object):
+	"""NullMonitor is the default monitor, which does nothing"""
+
+	def progress(self, stage, done, total):
+		pass
+
+	def count(self, stage, nbytes=0, allocations=1):
+		pass
+
+	def note(self, stage, **settings):
+		pass
+
+	def stage(self, name):
+		return contextlib.nullcontext()
+
+	def report(self):
+		return {}
+
+	def emit(self):
+		pass
+
+
+NULL_MONITOR = NullMonitor()
+
+
+def get_monitor(monitor=None):
+	"""returns monitor, or the NullMonitor if monitor is None"""
+
+	if monitor is None:
+		return NULL_MONITOR
+	return monitor
+
+
+def print_progress(stage, done, total):
+	"""progress function which writes the same progress lines as the pipeline
+	used to, such as 'ct_scan: 10/256'"""
+
+	sys.stdout.write("%s: %d/%d   \r" % (stage, done, total))
+	if done == total:
+		sys.stdout.write("\n")
+
+
+def monitored(name):
+	"""decorator for pipeline functions with a monitor argument, which times
+	each call as stage name and passes on a monitor which is never None"""
+
+	def decorator(f):
+		@functools.wraps(f)
+		def wrapper(*args, monitor=None, **kwargs):
+			monitor = get_monitor(monitor)
+			with monitor.stage(name):
+				return f(*args, monitor=monitor, **kwargs)
+		return wrapper
+
+	return decorator
@@ -30,9 +30,7 @@ def phantom(ellipses, n):
 		sinp = math.sin(phi)
 		values = (((x_center * cosp + y_center * sinp) ** 2) / asq + ((y_center *cosp - x_center * sinp) ** 2) / bsq)
 
-		for index, element in np.ndenumerate(values):
-				if element <= 1:
-					phantom_instance[index] = phantom_instance[index] + a
+		phantom_instance[values <= 1] += a
 
 	return phantom_instance
 	
@@ -58,10 +56,15 @@ def ct_phantom(names, n, type, metal=None):
 		For types 3-8, the metal implants are of type 'metal', which defaults
 		to 'Titanium' if not given.
 
-		The output x has data values which correspond to indices in the names
-		array, which must also contain 'Air', 'Adipose', 'Soft Tissue' and 'Bone'.
+		The output x is a uint8 label map, whose values are indices into the
+		names array, which must also contain 'Air', 'Adipose', 'Soft Tissue'
+		and 'Bone'. It can be converted to attenuation or HU with a single
+		lookup, using Material.table and convert_phantom.
 	"""  
 
+	if len(names) > 256:
+		raise ValueError('a uint8 phantom can only index 256 materials, got ' + str(len(names)))
+
 	# Get material locations
 	air = names.index('Air')
 	adipose =  names.index('Adipose')
@@ -84,9 +87,7 @@ def ct_phantom(names, n, type, metal=None):
 		t = [1, 0.8, 0.8, 0.0, 0.0, 0]
 		x = phantom(t, n)
 
-		for index, value in np.ndenumerate(x):
-			if value >= 1:
-				x[index] = tissue
+		x[x >= 1] = tissue
 
 	elif type == 2:
 		
@@ -102,9 +103,7 @@ def ct_phantom(names, n, type, metal=None):
 		t = [1, 0.8, 0.8, 0.0, 0.0, 0]
 		x = phantom(t, n)
 
-		for index, value in np.ndenumerate(x):
-			if value >= 1:
-				x[index] = tissue
+		x[x >= 1] = tissue
 
 		for r in np.arange(n * 0.04, n * 0.4, n * 0.04):
 			angles = np.cumsum(np.arange(0, 2*math.pi, n * 0.002 / r))
@@ -120,18 +119,14 @@ def ct_phantom(names, n, type, metal=None):
 				[1, 0.52, 0.45, 0, -0.08, 0]]
 		x = phantom(t, n)
 
-		for index, value in np.ndenumerate(x):
-			if value >= 1:
-				x[index] = tissue
+		x[x >= 1] = tissue
 
 		a = [[1, 0.55, 0.5, -0.35, 0.1, 0],
 			[1, 0.55, 0.5, 0.35, 0.1, 0],
 			[1, 0.5, 0.43, 0, -0.08, 0]]
 		x = x + phantom(a, n)
 
-		for index, value in np.ndenumerate(x):
-			if value > tissue:
-				x[index] = adipose
+		x[x > tissue] = adipose
 
 		t =  [[1, 0.37, 0.35, -0.42, 0.03, 0],
 			[1, 0.37, 0.35, 0.42, 0.03, 0],
@@ -140,9 +135,7 @@ def ct_phantom(names, n, type, metal=None):
 			[1, 0.4, 0.2, 0, -0.15, 0]]
 		x = x + phantom(t, n)
 
-		for index, value in np.ndenumerate(x):
-			if value > adipose:
-				x[index] = tissue
+		x[x > adipose] = tissue
 
 		b = [[1, 0.16, 0.12, -0.54, -0.01, 0],
 			[-1, 0.11, 0.10, -0.53, -0.01, 0],
@@ -158,9 +151,7 @@ def ct_phantom(names, n, type, metal=None):
 			[-1, 0.14, 0.03, 0.05, -0.15, -100]]
 		x = x + phantom(b, n)
 
-		for index, value in np.ndenumerate(x):
-			if value > tissue:
-				x[index] = bone
+		x[x > tissue] = bone
 		
 		# this adds a metal implant
 		if nmetal > tissue:
@@ -191,15 +182,43 @@ def ct_phantom(names, n, type, metal=None):
 			
 			x = x + phantom(m, n)
 
-			for index, value in np.ndenumerate(x):
-				if value > bone:
-					x[index] = nmetal
+			x[x > bone] = nmetal
 
 	# make sure the remainder is set to air
-	for index, value in np.ndenumerate(x):
-		if value == 0:
-			x[index] = air
+	x[x == 0] = air
 
 	x = np.flipud(x)
 	
-	return x
\ No newline at end of file
+	return x.astype(np.uint8)
+
+def ct_phantom_volume(names, n, slices, type, metal=None):
+
+	""" ct_phantom_volume create a multi-slice phantom for CT scanning
+		x = ct_phantom_volume(names, n, slices, type, metal) creates a CT
+		phantom volume in x of size (slices X n X n), in which each slice is
+		created by ct_phantom with the given type and metal.
+
+		type and metal can either be single values used for every slice,
+		or sequences with one value per slice so that the implants vary
+		through the volume. Each different slice is only created once.
+
+		The output x is a uint8 array of indices into the names array.
+	"""
+
+	# expand type and metal to one value per slice
+	if np.ndim(type) == 0:
+		type = [type] * slices
+	if (metal is None) or isinstance(metal, str):
+		metal = [metal] * slices
+	if (len(type) != slices) or (len(metal) != slices):
+		raise ValueError('type and metal must have one value for each of the ' + str(slices) + ' slices')
+
+	x = np.zeros((slices, n, n), dtype=np.uint8)
+	created = {}
+	for z in range(slices):
+		key = (type[z], metal[z])
+		if key not in created:
+			created[key] = ct_phantom(names, n, type[z], metal[z])
+		x[z] = created[key]
+
+	return x
@@ -3,53 +3,179 @@ import scipy
 from scipy import ndimage
 from ct_detect import ct_detect
 import math
-import sys
+from ct_kernels import *
+from ct_monitor import *
+from fourier_reconstruct import fourier_project
+from quantized_sinogram import *
 
-def ct_scan(photons, material, phantom, scale, angles, mas=10000):
+@monitored('ct_scan')
+def ct_scan(photons, material, phantom, scale, angles, mas=10000, jit=None, monitor=None, dtype=np.float64, projector='interpolate', quantize=None, noise=True, rng=None, fractions=False, threshold=None):
 
 	"""simulate CT scanning of an object
 	scan = ct_scan(photons, material, phantom, scale, angles, mas) takes a phantom
 	which contains indices relating to the attenuation coefficients given in
 	material.coeffs, and scans it using source energy photons, with given angles and
-	current-time product mas.
+	current-time product mas, which as for ct_detect is already included in
+	photons.
 
 	scale is the pixel size of the input array phantom, in cm per pixel.
+
+	phantom can also be a volume (slices x n x n), in which case every slice
+	is scanned with the same rotated coordinates and the output scan is
+	(slices x angles x n).
+
+	scan = ct_scan(photons, material, phantom, scale, angles, mas, jit) chooses
+	whether to use the compiled kernel from ct_kernels, which by default is
+	used whenever numba is available. This gives the same path lengths, but
+	without forming rotated coordinates or interpolated images.
+
+	monitor is an optional ct_monitor.Monitor which is told about the
+	progress, time and memory used.
+
+	dtype sets the floating point type of the coordinates and output scan,
+	which can be np.float32 to halve the memory used. The phantom is used as
+	a uint8 label map, as from ct_phantom, and the path lengths through
+	every material are found together from the labels, without a separate
+	image for each material.
+
+	projector chooses how the path lengths through each material are found:
+		'interpolate' - bilinear interpolation of the rotated material
+			phantoms at each angle in turn (the default)
+		'fourier' - fourier_project, which finds every angle at once from a
+			single 2D FFT of each material phantom, in O(n^2 log n) rather
+			than O(n^2 angles) time. This treats the phantom as band-limited
+			rather than bilinear, so the path lengths differ slightly at the
+			edges of each material.
+
+	quantize can be 'counts' or 'log', in which case the scan is returned as
+	a QuantizedSinogram holding the counts as np.uint32, or the log of the
+	counts as np.int16, rather than as dtype. Each angle is quantized as it
+	is detected, so the floating point scan is never held in memory, and
+	ct_calibrate accepts the result directly. The steps are far smaller than
+	the photon noise, and evenly cover the counts from none up to twice the
+	photons of the source.
+
+	noise, rng and threshold are passed to ct_detect, so noise can be False
+	for a scan without noise, rng can be a numpy.random.Generator, and
+	threshold can be given to draw high counts from the Gaussian
+	approximation.
+
+	If fractions is True, phantom is instead the fraction of each pixel
+	made of each material, (materials x n x n) or (materials x slices x n x
+	n), as from downsample_phantom, and the path length through each
+	material is the projection of its fractions.
 	"""
 
+	if projector not in ('interpolate', 'fourier'):
+		raise ValueError('projector should be interpolate or fourier, got ' + str(projector))
+
+	jit = use_jit(jit) and (projector == 'interpolate')
+	if quantize not in (None, 'counts', 'log'):
+		raise ValueError('quantize should be None, counts or log, got ' + str(quantize))
+
+	count = len(material.coeffs)
+	if fractions:
+		if len(phantom) != count:
+			raise ValueError('fractions are given for ' + str(len(phantom)) + ' materials, expected ' + str(count))
+
+		# with the materials moved to the second axis, fractions are
+		# treated in the same way as the labels of a volume
+		volume = phantom.ndim == 4
+		phantom = np.moveaxis(phantom if volume else phantom[:, np.newaxis], 0, 1)
+	else:
+		# treat a single phantom as a volume with one slice
+		volume = phantom.ndim == 3
+		if not volume:
+			phantom = phantom[np.newaxis]
+	slices = phantom.shape[0]
+
+	# the phantom is used as a uint8 label map throughout, and every
+	# material is projected from it at once rather than from a separate
+	# image for each material
+	if not fractions:
+		labels = phantom.astype(np.uint8, copy=False)
+
 	# find the coefficients for air
 	air = material.name.index('Air')
 
 	# get input image dimensions, and create a coordinate structure
-	n = max(phantom.shape)
-	xi, yi = np.meshgrid(np.arange(n) - (n/2) + 0.5, np.arange(n) - (n/2) + 0.5)
-
-	# check which materials phantom actually contains, and create single
-	# material phantoms for each of these, except for air
-	materials = []
-	material_phantom = []
-	for m in range(0,len(material.coeffs)):
-		z0 = (phantom == m).astype(float)
-		if (m != air) & (z0.sum()>0):
-			materials.append(m)
-			material_phantom.append(z0)
+	n = max(phantom.shape[-2:])
+	xi, yi = np.meshgrid((np.arange(n) - (n/2) + 0.5).astype(dtype), (np.arange(n) - (n/2) + 0.5).astype(dtype))
+	rays = np.tile(np.arange(n), n)
+
+	# check which materials phantom actually contains, except for air, and
+	# which slices contain anything other than air, from one bincount of the
+	# labels of each slice
+	if fractions:
+		present = phantom.reshape((slices, count, -1)).any(axis=2)
+	else:
+		present = np.array([np.bincount(labels[z].ravel(), minlength=count) for z in range(slices)]) > 0
+	materials = [m for m in range(count) if (m != air) and present[:, m].any()]
+	material_slices = np.flatnonzero(present[:, materials].any(axis=1))
+
+	# find the path lengths for every angle of each material at once
+	if projector == 'fourier':
+		p = -math.pi / 2 - np.arange(angles) * math.pi / angles
+		if fractions:
+			material_depth = [fourier_project(phantom[:, m].astype(dtype), p, monitor=monitor) for m in materials]
+		else:
+			material_depth = [fourier_project((labels == m).astype(dtype), p, monitor=monitor) for m in materials]
 
 	# scan one angle at a time
-	scan = np.zeros((angles, n))
+	if quantize is None:
+		scan = np.zeros((slices, angles, n), dtype=dtype)
+	else:
+		upper = 2 * np.sum(photons) + 1e7
+		if quantize == 'log':
+			scan = empty_sinogram((slices, angles, n), 'log', 0, math.log(upper), dtype=dtype)
+		else:
+			scan = empty_sinogram((slices, angles, n), 'counts', 0, upper, dtype=dtype)
 	for angle in range(angles):
 
-		sys.stdout.write("Scanning angle: %d   \r" % (angle + 1) )
-
 		# Get rotated coordinates for interpolation
 		p = -math.pi / 2 - angle * math.pi / angles
-		x0 = xi * math.cos(p) - yi * math.sin(p) + (n/2) - 0.5
-		y0 = xi * math.sin(p) + yi * math.cos(p) + (n/2) - 0.5
+		if (not jit) and (projector == 'interpolate'):
+			x0 = (xi * math.cos(p) - yi * math.sin(p) + (n/2) - 0.5).ravel()
+			y0 = (xi * math.sin(p) + yi * math.cos(p) + (n/2) - 0.5).ravel()
+
+			# the four pixels around each point inside the phantom, and their
+			# bilinear weights, which are the same for every slice
+			inside = (x0 >= 0) & (y0 >= 0) & (x0 <= n - 1) & (y0 <= n - 1)
+			x0 = x0[inside]
+			y0 = y0[inside]
+			ix = np.minimum(x0.astype(int), n - 2)
+			iy = np.minimum(y0.astype(int), n - 2)
+			dx = x0 - ix
+			dy = y0 - iy
+			corners = np.concatenate((iy * n + ix, iy * n + ix + 1, (iy + 1) * n + ix, (iy + 1) * n + ix + 1))
+			weights = np.concatenate(((1 - dx) * (1 - dy), dx * (1 - dy), (1 - dx) * dy, dx * dy))
+			corner_rays = np.tile(rays[inside], 4)
 
 		# For each material, add up how many pixels contain this on each ray
-		depth = np.zeros((len(material.coeffs), n))
+		depth = np.zeros((count, slices, n))
 
-		for index, m in enumerate(materials):
-			interpolated = scipy.ndimage.map_coordinates(material_phantom[index], [y0, x0], order=1, mode='constant', cval=0, prefilter=False)
-			depth[m] = np.sum(interpolated, axis=0)
+		if projector == 'fourier':
+			for index, m in enumerate(materials):
+				depth[m] = material_depth[index][:, angle]
+		else:
+			for z in material_slices:
+				if fractions:
+					# each material is projected from its own fractions
+					for m in materials:
+						if jit:
+							forward_project_kernel(phantom[z, m], math.cos(p), math.sin(p), depth[m, z])
+						else:
+							depth[m, z] = np.bincount(corner_rays, weights * phantom[z, m].ravel()[corners], n)
+				elif jit:
+					forward_project_labels_kernel(labels[z], math.cos(p), math.sin(p), depth[:, z])
+				else:
+					# each weight goes to the material of its pixel and the
+					# ray it lies on, so one bincount finds every material
+					bins = labels[z].ravel()[corners].astype(np.intp) * n + corner_rays
+					depth[:, z] = np.bincount(bins, weights, count * n).reshape((count, n))
+
+			# the path length through air is found from the other materials
+			depth[air] = 0
 
 		# only necessary for more complex forms of interpolation above
 		depth = np.clip(depth, 0, None)
@@ -60,11 +186,19 @@ def ct_scan(photons, material, phantom, scale, angles, mas=10000):
 		depth[air] = 2 * n - np.sum(depth, axis=0)
 
 		# scale the depth appropriately and calculate detections for this set of
-		# materials
+		# materials, for all slices at once
 		depth*= scale
 	
-		scan[angle] = ct_detect(photons, material.coeffs, depth, mas)
-	
-	sys.stdout.write("\n")
+		detections = ct_detect(photons, material.coeffs, depth.reshape((len(material.coeffs), slices * n)), noise=noise, rng=rng, threshold=threshold).reshape((slices, n))
+		if quantize == 'log':
+			detections = np.log(detections)
+		scan[:, angle] = detections
+
+		monitor.progress('ct_scan', angle + 1, angles)
+
+	monitor.count('ct_scan', scan.nbytes + phantom.nbytes, 2)
+
+	if not volume:
+		scan = scan[0] if quantize is None else scan.subset(0)
 
 	return scan
\ No newline at end of file
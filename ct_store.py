@@ -0,0 +1,306 @@
+import hashlib
+import itertools
+import json
+import os
+import zlib
+import numpy as np
+
+# a chunked array store for sinograms and reconstructions which are too
+# large to load at once. Each store is a directory containing store.json,
+# which holds the shape, type, chunk layout and metadata, and one file for
+# each chunk which has been written. Uncompressed chunks are .npy files
+# which are memory-mapped when read, and compressed chunks are the
+# byte-shuffled data compressed with zlib, which is lossless
+
+
+class ArrayStore(object):
+	def __init__(self, directory, mode='r'):
+		"""ArrayStore is an array on disk, split into chunks which are read
+		and written separately, so that only the parts of the array which are
+		needed are ever in memory. Stores are made with create_store and
+		opened with open_store rather than directly.
+
+		store[index] reads the part of the array given by index, which is
+		made of integers and slices as for a numpy array, reading only the
+		chunks which it overlaps. store[index] = value writes it in the same
+		way, and store.append(data) extends the array along its first axis.
+		Chunks which have never been written read as zero.
+
+		store.metadata is a dictionary which is saved with the array, for
+		instance the geometry, scale, mas and spectrum_hash of a scan, and
+		is written by flush() or whenever the shape changes."""
+
+		self.directory = directory
+		self.mode = mode
+
+		filename = os.path.join(directory, 'store.json')
+		if not os.path.exists(filename):
+			raise Exception('Store named ' + directory + ' does not exist')
+		with open(filename) as f:
+			header = json.load(f)
+
+		self.shape = tuple(header['shape'])
+		self.dtype = np.dtype(header['dtype'])
+		self.chunks = tuple(header['chunks'])
+		self.compression = header['compression']
+		self.level = header['level']
+		self.metadata = header['metadata']
+
+	@property
+	def ndim(self):
+		return len(self.shape)
+
+	@property
+	def grid(self):
+		"""number of chunks along each axis"""
+		return tuple(-(-s // c) for s, c in zip(self.shape, self.chunks))
+
+	def __len__(self):
+		return self.shape[0]
+
+	def __array__(self, dtype=None, copy=None):
+		data = self[...]
+		return data if dtype is None else data.astype(dtype)
+
+	def flush(self):
+		"""writes the shape and metadata of the store"""
+
+		self._check_writable()
+		header = {'shape': list(self.shape), 'dtype': self.dtype.str, 'chunks': list(self.chunks),
+			'compression': self.compression, 'level': self.level, 'metadata': self.metadata}
+		with open(os.path.join(self.directory, 'store.json'), 'w') as f:
+			json.dump(_json(header), f, indent=1)
+
+	def chunk_shape(self, index):
+		"""returns the shape of the chunk at index (one value per axis), which
+		is smaller than chunks at the end of each axis"""
+
+		return tuple(min(c, s - i * c) for i, s, c in zip(index, self.shape, self.chunks))
+
+	def read_chunk(self, index):
+		"""returns the chunk at index (one value per axis). Uncompressed chunks
+		are returned as read-only memory maps, so only the parts which are
+		used are read from disk"""
+
+		shape = self.chunk_shape(index)
+		filename = self._filename(index)
+		if not os.path.exists(filename):
+			return np.zeros(shape, dtype=self.dtype)
+
+		if self.compression is None:
+			return np.load(filename, mmap_mode='r')
+
+		with open(filename, 'rb') as f:
+			data = np.frombuffer(zlib.decompress(f.read()), dtype=np.uint8)
+
+		# undo the byte shuffle, which groups the same byte of every value
+		data = data.reshape((self.dtype.itemsize, -1)).T.copy()
+		return data.view(self.dtype).reshape(shape)
+
+	def write_chunk(self, index, data):
+		"""writes the whole chunk at index (one value per axis)"""
+
+		self._check_writable()
+		shape = self.chunk_shape(index)
+		data = np.ascontiguousarray(data, dtype=self.dtype)
+		if data.shape != shape:
+			raise ValueError('chunk ' + str(index) + ' has shape ' + str(shape) + ', got ' + str(data.shape))
+
+		filename = self._filename(index)
+		if self.compression is None:
+			np.save(filename, data)
+			return
+
+		# shuffle the bytes so that the similar high bytes of neighbouring
+		# values are next to each other, which compresses much better
+		data = data.view(np.uint8).reshape((-1, self.dtype.itemsize)).T
+		with open(filename, 'wb') as f:
+			f.write(zlib.compress(np.ascontiguousarray(data).tobytes(), self.level))
+
+	def __getitem__(self, key):
+		selection, squeeze = self._selection(key)
+		out = np.zeros(tuple(len(s) for s in selection), dtype=self.dtype)
+
+		for index, positions, local in self._overlaps(selection):
+			chunk = self.read_chunk(index)
+			out[np.ix_(*positions)] = chunk[np.ix_(*local)]
+
+		return out.reshape(tuple(n for n, s in zip(out.shape, squeeze) if not s))
+
+	def __setitem__(self, key, value):
+		self._check_writable()
+		selection, squeeze = self._selection(key)
+		shape = tuple(len(s) for s in selection)
+		value = np.broadcast_to(np.asarray(value, dtype=self.dtype), tuple(n for n, s in zip(shape, squeeze) if not s)).reshape(shape)
+
+		for index, positions, local in self._overlaps(selection):
+			shape = self.chunk_shape(index)
+
+			# chunks which are completely replaced are not read first
+			if all((len(l) == s) and (l[0] == 0) and np.all(np.diff(l) == 1) for l, s in zip(local, shape)):
+				chunk = value[np.ix_(*positions)]
+			else:
+				chunk = np.array(self.read_chunk(index))
+				chunk[np.ix_(*local)] = value[np.ix_(*positions)]
+			self.write_chunk(index, chunk)
+
+	def append(self, data):
+		"""adds data to the end of the first axis of the store, for example a
+		block of angles of a sinogram as they are measured. data has the same
+		shape as the store except along the first axis"""
+
+		self._check_writable()
+		data = np.asarray(data, dtype=self.dtype)
+		if data.shape[1:] != self.shape[1:]:
+			raise ValueError('data of shape ' + str(data.shape) + ' cannot be appended to a store of shape ' + str(self.shape))
+
+		# the last chunks along the first axis may be partly filled, in which
+		# case they are rewritten with the new data
+		old = self.shape[0]
+		start = old - (old % self.chunks[0])
+		if start < old:
+			data = np.concatenate((self[start:old], data))
+
+		self.shape = (old + len(data) - (old - start),) + self.shape[1:]
+		self.flush()
+		self[start:] = data
+
+	def chunk_slices(self, axis=0):
+		"""returns the slices of the first axis (or axis) covered by each
+		chunk, so that a pipeline stage can work through the store one chunk
+		at a time with store[s] for s in store.chunk_slices()"""
+
+		return [slice(i, min(i + self.chunks[axis], self.shape[axis])) for i in range(0, self.shape[axis], self.chunks[axis])]
+
+	def _filename(self, index):
+		extension = '.npy' if self.compression is None else '.zlib'
+		return os.path.join(self.directory, 'c.' + '.'.join(str(i) for i in index) + extension)
+
+	def _check_writable(self):
+		if self.mode == 'r':
+			raise Exception('Store named ' + self.directory + ' is read only')
+
+	def _selection(self, key):
+		"""returns the indices selected along each axis by key, and whether
+		each axis was selected by an integer and so is removed"""
+
+		if not isinstance(key, tuple):
+			key = (key,)
+		if Ellipsis in key:
+			i = key.index(Ellipsis)
+			key = key[:i] + (slice(None),) * (self.ndim - len(key) + 1) + key[i + 1:]
+		if len(key) > self.ndim:
+			raise IndexError('too many indices for a store with ' + str(self.ndim) + ' dimensions')
+		key = key + (slice(None),) * (self.ndim - len(key))
+
+		selection = []
+		squeeze = []
+		for k, n in zip(key, self.shape):
+			if isinstance(k, slice):
+				selection.append(np.arange(*k.indices(n)))
+				squeeze.append(False)
+			elif isinstance(k, (int, np.integer)):
+				if (k < -n) or (k >= n):
+					raise IndexError('index ' + str(k) + ' is out of bounds for size ' + str(n))
+				selection.append(np.array([k % n]))
+				squeeze.append(True)
+			else:
+				raise IndexError('stores can only be indexed by integers and slices, got ' + str(k))
+
+		return selection, squeeze
+
+	def _overlaps(self, selection):
+		"""yields the index of each chunk which the selection overlaps, with
+		the positions in the selection and in the chunk along each axis"""
+
+		axes = []
+		for s, c in zip(selection, self.chunks):
+			blocks = s // c
+			axes.append([(b, np.flatnonzero(blocks == b), s[blocks == b] - b * c) for b in np.unique(blocks)])
+
+		for parts in itertools.product(*axes):
+			yield tuple(int(p[0]) for p in parts), [p[1] for p in parts], [p[2] for p in parts]
+
+
+def create_store(directory, shape, dtype=np.float64, chunks=None, compression=None, level=1, metadata=None):
+
+	""" Create a chunked array store
+	store = create_store(directory, shape) creates an empty ArrayStore of the
+	given shape in directory, which must not already contain a store, and
+	returns it open for writing.
+
+	chunks gives the size of each chunk along each axis, which defaults to
+	one along the first axis and the whole of every other axis, so that a
+	stack of sinograms or reconstructed slices has one chunk per slice. For
+	sinograms which are read a block of angles at a time, chunks can instead
+	be for example (1, 32, samples).
+
+	compression can be None, where chunks are memory-mapped .npy files, or
+	'zlib', which is lossless with the given level (1 to 9). shape can start
+	with zero, and the store can then be filled with append.
+
+	metadata is an optional dictionary saved with the store, which can be
+	given for instance the output of scan_metadata."""
+
+	if os.path.exists(os.path.join(directory, 'store.json')):
+		raise Exception('Store named ' + directory + ' already exists')
+	if compression not in (None, 'zlib'):
+		raise ValueError('compression should be None or zlib, got ' + str(compression))
+
+	shape = tuple(int(s) for s in shape)
+	if chunks is None:
+		chunks = (1,) + shape[1:]
+	chunks = tuple(int(c) for c in chunks)
+	if (len(chunks) != len(shape)) or (min(chunks) < 1):
+		raise ValueError('chunks ' + str(chunks) + ' do not match shape ' + str(shape))
+
+	if not os.path.exists(directory):
+		os.makedirs(directory)
+
+	header = {'shape': list(shape), 'dtype': np.dtype(dtype).str, 'chunks': list(chunks),
+		'compression': compression, 'level': level, 'metadata': metadata or {}}
+	with open(os.path.join(directory, 'store.json'), 'w') as f:
+		json.dump(_json(header), f, indent=1)
+
+	return ArrayStore(directory, 'r+')
+
+
+def open_store(directory, mode='r'):
+	"""opens the ArrayStore in directory, read only if mode is 'r' or for
+	reading and writing if mode is 'r+'"""
+
+	if mode not in ('r', 'r+'):
+		raise ValueError('mode should be r or r+, got ' + str(mode))
+	return ArrayStore(directory, mode)
+
+
+def spectrum_hash(photons):
+	"""returns a short hash of a source spectrum, so that stores made with
+	the same source can be recognised without saving the whole spectrum"""
+
+	return hashlib.sha1(np.ascontiguousarray(photons, dtype=np.float64).tobytes()).hexdigest()[:16]
+
+
+def scan_metadata(photons, scale, angles, mas, **geometry):
+	"""returns a metadata dictionary for a store of sinograms or
+	reconstructions made with source photons, pixel size scale in cm,
+	angles in 180 degrees and current-time product mas. Any other details of
+	the geometry can be given as keyword arguments"""
+
+	metadata = {'scale': scale, 'angles': angles, 'mas': mas, 'spectrum_hash': spectrum_hash(photons)}
+	metadata.update(geometry)
+	return metadata
+
+
+def _json(value):
+	"""converts numpy values within value to the equivalent python values"""
+
+	if isinstance(value, dict):
+		return {k: _json(v) for k, v in value.items()}
+	if isinstance(value, (list, tuple)):
+		return [_json(v) for v in value]
+	if isinstance(value, np.ndarray):
+		return value.tolist()
+	if isinstance(value, np.generic):
+		return value.item()
+	return value
@@ -8,7 +8,29 @@ from ct_phantom import *
 from ct_lib import *
 from scan_and_reconstruct import *
 from create_dicom import *
+from read_dicom import *
+from ct_kernels import *
+from ct_monitor import *
+from fast_back_project import *
+from fourier_reconstruct import *
+from incremental_reconstruction import *
+from ct_metrics import *
+from ct_store import *
+from quantized_sinogram import *
+from binning import *
+from ct_batch import *
+from ct_tune import *
+from ct_benchmark import *
+from ct_benchmark import write_rsq
 import matplotlib.pyplot as plt
+import time
+import os
+import shutil
+import json
+import tracemalloc
+import copy
+import warnings
+import pydicom
 
 # create object instances
 material = Material()
@@ -236,13 +258,1436 @@ def test_6():
 	plt.savefig(full_path)
 	plt.close()
 
+def test_7():
+	'''
+	Test for compiled kernels:
+
+	scan and reconstruct a hip implant phantom both with and without the
+	numba kernels in ct_kernels, check that the sinograms and reconstructions
+	match those from the NumPy implementation
+	'''
+
+	if not HAVE_NUMBA:
+		print('numba is not available, skipping test 7')
+		return
+
+	# INITIAL CONDITIONS
+
+	# hip implant phantom and ideal source
+	p = ct_phantom(material.name, 128, 3)
+	s = fake_source(material.mev, 0.1, method='ideal') * 10000 * pow(0.1, 2)
+
+	# SETUP
+
+	# scan with the same noise for both implementations
+	np.random.seed(7)
+	scan_numpy = ct_scan(s, material, p, 0.1, 128, jit=False)
+	np.random.seed(7)
+	scan_jit = ct_scan(s, material, p, 0.1, 128, jit=True)
+
+	# reconstruct the same filtered sinogram with both implementations
+	sinogram = ramp_filter(ct_calibrate(s, material, scan_numpy, 0.1), 0.1)
+	reconstruction_numpy = back_project(sinogram, jit=False)
+	reconstruction_jit = back_project(sinogram, jit=True)
+
+	scan_error = np.max(np.abs(scan_jit - scan_numpy) / scan_numpy)
+	reconstruction_error = np.max(np.abs(reconstruction_jit - reconstruction_numpy))
+
+	# TESTS
+
+	# save the differences between the two implementations
+	full_path = get_full_path('results/test_7', 'test_7_output.txt')
+	f = open(full_path, mode='w')
+	f.write(f"Maximum relative scan difference is {scan_error} \n")
+	f.write(f"Maximum reconstruction difference is {reconstruction_error} \n")
+	f.close()
+
+	# expect both implementations to agree to within rounding error
+	assert scan_error < 1e-9, f"Scans do not match, got relative difference {scan_error}"
+	assert reconstruction_error < 1e-9, f"Reconstructions do not match, got difference {reconstruction_error}"
+
+def test_8():
+	'''
+	Test for single precision:
+
+	reconstruct the pelvic fixation pins phantom in both float64 and
+	float32, check that the difference between the two is far below the
+	errors allowed by the other tests
+	'''
+
+	# INITIAL CONDITIONS
+
+	# pelvic fixation pins phantom and ideal source, as for test 3
+	p = ct_phantom(material.name, 256, 7)
+	source_energy = 0.14
+	s = fake_source(source.mev, source_energy, method='ideal') * 10000 * pow(0.1, 2)
+
+	# SETUP
+
+	# reconstruct the same scan in both precisions
+	scan = ct_scan(s, material, p, 0.1, 256)
+	np.random.seed(8)
+	reconstruction_64 = back_project(ramp_filter(ct_calibrate(s, material, scan, 0.1), 0.1))
+	np.random.seed(8)
+	reconstruction_32 = back_project(ramp_filter(ct_calibrate(s, material, scan.astype(np.float32), 0.1), 0.1))
+
+	# scan and reconstruct entirely in each precision
+	np.random.seed(8)
+	full_64 = back_project(ramp_filter(ct_calibrate(s, material, ct_scan(s, material, p, 0.1, 256), 0.1), 0.1))
+	np.random.seed(8)
+	full_32 = back_project(ramp_filter(ct_calibrate(s, material, ct_scan(s, material, p, 0.1, 256, dtype=np.float32), 0.1), 0.1))
+
+	# find RMS errors against the phantom, ignoring pixels outside of scanning circle
+	material_attenuations = material.coeffs[:, np.where(material.mev == round(0.7*source_energy,3))[0][0]]
+	p = convert_phantom(p, material_attenuations)
+	inside = np.where(full_64 > -1)
+	rms_64 = np.sqrt(np.mean((full_64 - p)[inside]**2))
+	rms_32 = np.sqrt(np.mean((full_32 - p)[inside]**2))
+
+	reconstruction_error = np.max(np.abs(reconstruction_32 - reconstruction_64))
+
+	# TESTS
+
+	# save the differences between the two precisions
+	full_path = get_full_path('results/test_8', 'test_8_output.txt')
+	f = open(full_path, mode='w')
+	f.write(f"Output types are {full_32.dtype} and {full_64.dtype} \n")
+	f.write(f"Maximum difference reconstructing the same scan is {reconstruction_error} \n")
+	f.write(f"RMS reconstruction error is {rms_32} in float32 and {rms_64} in float64 \n")
+	f.close()
+
+	# expect single precision to be kept throughout
+	assert full_32.dtype == np.float32, f"Reconstruction should be float32, got {full_32.dtype}"
+	# expect the differences to be 1% of the RMS error allowed in test 3
+	assert reconstruction_error < 0.0006, f"float32 reconstruction differs by {reconstruction_error}"
+	assert abs(rms_32 - rms_64) < 0.0006, f"float32 RMS error differs by {abs(rms_32 - rms_64)}"
+
+def test_9():
+	'''
+	Test for hierarchical back-projection:
+
+	reconstruct each type of phantom with both back_project and
+	fast_back_project, check that the fast method stays close to the direct
+	one, and gets closer as its accuracy is increased, and that its compiled
+	kernels and float32 give the same result
+	'''
+
+	# INITIAL CONDITIONS
+
+	# ideal source, as for test 7
+	s = fake_source(material.mev, 0.1, method='ideal') * 10000 * pow(0.1, 2)
+
+	# compare inside a slightly smaller circle, since the two interpolate
+	# differently at the edge of each projection
+	xi, yi = np.meshgrid(np.arange(128) - 63.5, np.arange(128) - 63.5)
+	inner = (xi ** 2 + yi ** 2) < (0.45 * 128) ** 2
+
+	errors = []
+	for t in range(1, 9):
+
+		# SETUP
+
+		p = ct_phantom(material.name, 128, t)
+		np.random.seed(9)
+		sinogram = ramp_filter(ct_calibrate(s, material, ct_scan(s, material, p, 0.1, 128), 0.1), 0.1)
+		direct = back_project(sinogram)
+		peak = np.max(np.abs(direct[inner]))
+
+		# RMS difference relative to the largest value in the direct reconstruction
+		error = [np.sqrt(np.mean((fast_back_project(sinogram, oversample)[inner] - direct[inner]) ** 2)) / peak for oversample in (1, 2, 4)]
+		errors.append(error)
+
+	fast = fast_back_project(sinogram)
+	uncompiled = fast_back_project(sinogram, jit=False)
+	single = fast_back_project(sinogram.astype(np.float32))
+
+	# TESTS
+
+	# save the differences for each phantom and accuracy
+	full_path = get_full_path('results/test_9', 'test_9_output.txt')
+	f = open(full_path, mode='w')
+	for t, error in enumerate(errors):
+		f.write(f"Phantom type {t + 1} relative RMS difference is {error[0]}, {error[1]}, {error[2]} with oversample 1, 2, 4 \n")
+	f.close()
+
+	# expect the default accuracy to be within 3% and the difference to fall with oversample
+	for t, error in enumerate(errors):
+		assert error[1] < 0.03, f"Phantom type {t + 1} differs by {error[1]}"
+		assert error[2] < error[1] < error[0], f"Phantom type {t + 1} does not improve with oversample, got {error}"
+
+	# expect the compiled kernels to match, and float32 to be kept
+	assert np.allclose(fast, uncompiled, rtol=0, atol=1e-9 * np.max(np.abs(fast))), "Compiled kernels differ"
+	assert single.dtype == np.float32, f"float32 input gave {single.dtype}"
+	assert np.allclose(single, fast, rtol=0, atol=1e-5 * np.max(np.abs(fast))), "float32 reconstruction differs"
+
+def test_10():
+	'''
+	Test for direct Fourier reconstruction:
+
+	reconstruct each type of phantom with both filtered back-projection and
+	fourier_reconstruct from the same sinogram, check that the error in the
+	Fourier reconstruction is close to that of filtered back-projection
+	'''
+
+	# INITIAL CONDITIONS
+
+	# ideal source, and its attenuation coefficients relative to water,
+	# which are the units of the reconstruction
+	source_energy = 0.10
+	s = fake_source(material.mev, source_energy, method='ideal') * 10000 * pow(0.1, 2)
+	material_attenuations = material.coeffs[:, np.where(material.mev == round(0.7*source_energy,3))[0][0]]
+	material_attenuations = material_attenuations / material_attenuations[material.name.index('Water')]
+
+	# compare inside a slightly smaller circle, away from the edge of the scan
+	xi, yi = np.meshgrid(np.arange(256) - 127.5, np.arange(256) - 127.5)
+	inner = (xi ** 2 + yi ** 2) < (0.45 * 256) ** 2
+
+	errors = []
+	for t in range(1, 9):
+
+		# SETUP
+
+		p = ct_phantom(material.name, 256, t)
+		np.random.seed(10)
+		sinogram = ct_calibrate(s, material, ct_scan(s, material, p, 0.1, 256), 0.1)
+		fbp = back_project(ramp_filter(sinogram, 0.1))
+		fourier = fourier_reconstruct(sinogram, 0.1)
+
+		# RMS error of each against the true attenuation
+		truth = material_attenuations[p.astype(int)]
+		errors.append([np.sqrt(np.mean((x[inner] - truth[inner]) ** 2)) for x in (fbp, fourier)])
+
+	# TESTS
+
+	# save the errors for each phantom
+	full_path = get_full_path('results/test_10', 'test_10_output.txt')
+	f = open(full_path, mode='w')
+	for t, error in enumerate(errors):
+		f.write(f"Phantom type {t + 1} RMS error is {error[0]} with back_project and {error[1]} with fourier_reconstruct \n")
+	f.close()
+
+	# expect the Fourier reconstruction to be within 10% of the error of back-projection
+	for t, error in enumerate(errors):
+		assert error[1] < 1.1 * error[0], f"Phantom type {t + 1} RMS error is {error[1]}, against {error[0]} for back_project"
+
+def test_11():
+	'''
+	Test for the Fourier forward projector:
+
+	scan the anatomical phantoms with both the interpolating and the Fourier
+	projectors in ct_scan, check that the calibrated sinograms agree and
+	that the reconstructions from the Fourier projector are as accurate
+	'''
+
+	# INITIAL CONDITIONS
+
+	# ideal source, and its attenuation coefficients relative to water, as for test 10
+	source_energy = 0.10
+	s = fake_source(material.mev, source_energy, method='ideal') * 10000 * pow(0.1, 2)
+	material_attenuations = material.coeffs[:, np.where(material.mev == round(0.7*source_energy,3))[0][0]]
+	material_attenuations = material_attenuations / material_attenuations[material.name.index('Water')]
+
+	xi, yi = np.meshgrid(np.arange(256) - 127.5, np.arange(256) - 127.5)
+	inner = (xi ** 2 + yi ** 2) < (0.45 * 256) ** 2
+
+	results = []
+	for t in (3, 5, 6, 7):
+
+		# SETUP
+
+		p = ct_phantom(material.name, 256, t)
+		truth = material_attenuations[p.astype(int)]
+
+		# scan with the same noise for both projectors, from separate
+		# generators for the scan and the calibration
+		sinograms = []
+		for projector in ('interpolate', 'fourier'):
+			scan = ct_scan(s, material, p, 0.1, 256, projector=projector, rng=np.random.default_rng(11))
+			sinograms.append(ct_calibrate(s, material, scan, 0.1, rng=np.random.default_rng(12)))
+
+		# RMS difference between the sinograms relative to their largest value,
+		# and RMS error of the reconstruction from each against the true attenuation
+		difference = np.sqrt(np.mean((sinograms[1] - sinograms[0]) ** 2)) / np.max(np.abs(sinograms[0]))
+		errors = [np.sqrt(np.mean((back_project(ramp_filter(x, 0.1))[inner] - truth[inner]) ** 2)) for x in sinograms]
+		results.append((t, difference, errors))
+
+	# TESTS
+
+	# save the differences for each phantom
+	full_path = get_full_path('results/test_11', 'test_11_output.txt')
+	f = open(full_path, mode='w')
+	for t, difference, errors in results:
+		f.write(f"Phantom type {t} sinograms differ by {difference}, RMS error is {errors[0]} interpolating and {errors[1]} with fourier_project \n")
+	f.close()
+
+	# expect the sinograms to agree to within 1% and the reconstructions to be as accurate
+	for t, difference, errors in results:
+		assert difference < 0.01, f"Phantom type {t} sinograms differ by {difference}"
+		assert errors[1] < 1.1 * errors[0], f"Phantom type {t} RMS error is {errors[1]}, against {errors[0]} interpolating"
+
+def test_12():
+	'''
+	Test for incremental reconstruction:
+
+	add the projections of a hip implant phantom to an
+	IncrementalReconstruction one at a time, every other angle first, check
+	that the partial image is already close after half of the angles and
+	that the final image matches filtered back-projection of the whole
+	sinogram, as it does when the angles are added in blocks
+	'''
+
+	# INITIAL CONDITIONS
+
+	# hip implant phantom and ideal source, as for test 7
+	p = ct_phantom(material.name, 128, 3)
+	s = fake_source(material.mev, 0.1, method='ideal') * 10000 * pow(0.1, 2)
+
+	np.random.seed(12)
+	sinogram = ct_calibrate(s, material, ct_scan(s, material, p, 0.1, 128), 0.1)
+	full = back_project(ramp_filter(sinogram, 0.1))
+
+	# SETUP
+
+	# add the even angles in a random order, taking a copy of the image once
+	# they are all in, then the odd angles
+	r = IncrementalReconstruction(128, 128, 0.1)
+	for angle in np.random.permutation(np.arange(0, 128, 2)):
+		r.add(sinogram[angle], angle)
+	half = r.image()
+	for angle in range(1, 128, 2):
+		r.add(sinogram[angle], angle)
+
+	# add blocks of 32 angles, last first
+	blocks = IncrementalReconstruction(128, 128, 0.1)
+	for angle in (96, 64, 32, 0):
+		blocks.add(sinogram[angle:angle + 32], angle)
+
+	half_error = np.sqrt(np.mean((half - full) ** 2)) / np.sqrt(np.mean(full ** 2))
+	final_error = max(np.max(np.abs(r.image() - full)), np.max(np.abs(blocks.image() - full)))
+
+	# TESTS
+
+	# save the differences from the full reconstruction
+	full_path = get_full_path('results/test_12', 'test_12_output.txt')
+	f = open(full_path, mode='w')
+	f.write(f"Relative RMS difference with half of the angles is {half_error} \n")
+	f.write(f"Maximum difference with all angles is {final_error} \n")
+	f.close()
+
+	# expect a useful image at half way and the same image at the end
+	assert r.complete() and blocks.complete(), "Not all angles were added"
+	assert half_error < 0.2, f"Partial image differs by {half_error}"
+	assert final_error < 1e-9, f"Final image differs by {final_error}"
+
+def test_13():
+	'''
+	Test for progressive reconstruction:
+
+	reconstruct a hip implant phantom with a preview, check that the preview
+	arrives at a fraction of the cost, is about as close to the full
+	reconstruction as every other pixel of the full reconstruction itself,
+	and that the final reconstruction is unchanged
+	'''
+
+	# INITIAL CONDITIONS
+
+	# hip implant phantom and ideal source
+	p = ct_phantom(material.name, 256, 3)
+	s = fake_source(material.mev, 0.1, method='ideal')
+
+	# SETUP
+
+	# keep the preview and the time at which it arrives
+	previews = []
+	def preview(image):
+		previews.append((time.perf_counter(), image))
+
+	np.random.seed(13)
+	full = scan_and_reconstruct(s, material, p, 0.1, 256)
+	np.random.seed(13)
+	monitor = Monitor()
+	progressive = scan_and_reconstruct(s, material, p, 0.1, 256, monitor=monitor, preview=preview)
+
+	report = monitor.report()
+	fraction = report['back_project_preview']['time'] / report['back_project']['time']
+	image = previews[0][1]
+
+	# compare with the full reconstruction averaged down to the same
+	# resolution, inside the circle and away from the implant
+	average = full.reshape((128, 2, 128, 2)).mean(axis=(1, 3))
+	inside = (image != -1024) & (average > -1024) & (p[::2, ::2] != 7)
+	preview_error = np.sqrt(np.mean((image[inside] - average[inside]) ** 2))
+	full_error = np.sqrt(np.mean((full[::2, ::2][inside] - average[inside]) ** 2))
+
+	# TESTS
+
+	# save the cost and error of the preview
+	full_path = get_full_path('results/test_13', 'test_13_output.txt')
+	f = open(full_path, mode='w')
+	f.write(f"Preview took {fraction} of the back-projection time \n")
+	f.write(f"RMS difference from the averaged full reconstruction is {preview_error} HU for the preview and {full_error} HU for every other pixel \n")
+	f.write(f"Maximum difference from the non-progressive reconstruction is {np.max(np.abs(progressive - full))} HU \n")
+	f.close()
+
+	# expect one half resolution preview, well within the full time, which
+	# is about as close to the full reconstruction as its own pixels, and
+	# the same final result
+	assert len(previews) == 1, f"Expected one preview, got {len(previews)}"
+	assert image.shape == (128, 128), f"Preview should be 128 x 128, got {image.shape}"
+	assert fraction < 0.25, f"Preview took {fraction} of the back-projection time"
+	assert preview_error < 1.5 * full_error, f"Preview differs by {preview_error} HU, against {full_error} HU"
+	assert np.max(np.abs(progressive - full)) < 1e-6, "Progressive reconstruction differs"
+
+def test_14():
+	'''
+	Test for image quality metrics:
+
+	measure the resolution of a point phantom and the noise of a uniform
+	phantom at two doses, all of the reconstructions of each in one call,
+	and check that the metrics respond to the filter and the dose
+	'''
+
+	# INITIAL CONDITIONS
+
+	# titanium point and water disc phantoms, with an ideal source
+	point = ct_phantom(material.name, 256, 2, 'Titanium')
+	disc = ct_phantom(material.name, 256, 1)
+	s = fake_source(material.mev, 0.1, method='ideal')
+
+	# SETUP
+
+	# point reconstructed without noise with a sharp and a smooth filter,
+	# and the disc at two doses
+	np.random.seed(14)
+	sinogram = ct_calibrate(s, material, ct_scan(s, material, point, 0.1, 256, noise=False), 0.1, noise=False)
+	sharp = np.stack([back_project(ramp_filter(sinogram, 0.1, alpha)) for alpha in (0.001, 5)])
+	noisy = np.stack([scan_and_reconstruct(s, material, disc, 0.1, 256, mas=mas) for mas in (1000, 10000)])
+
+	mtf_frequencies, m = mtf(sharp, (63, 192), scale=0.1)
+	inside = distance_map((256, 256), (128, 128)) < 80
+	frequencies, power, spectrum = nps(noisy, inside, scale=0.1)
+	contrast = cnr(noisy, disc, material.name.index('Soft Tissue'), material.name.index('Air'))
+
+	# TESTS
+
+	# save the metrics
+	full_path = get_full_path('results/test_14', 'test_14_output.txt')
+	f = open(full_path, mode='w')
+	f.write(f"MTF at {frequencies[-1]} cycles per cm is {m[:, -1]} for alpha 0.001 and 5 \n")
+	f.write(f"Noise variance is {spectrum.sum(axis=(-2, -1)) / (3.2 ** 2)} for 1000 and 10000 mas \n")
+	f.write(f"CNR of soft tissue is {contrast} for 1000 and 10000 mas \n")
+	f.close()
+
+	# expect the smoother filter to lose more above half the Nyquist
+	# frequency, and the higher dose to have less noise and more contrast to
+	# noise
+	high = mtf_frequencies > mtf_frequencies[-1] / 2
+	assert np.allclose(m[:, 0], 1), "MTF should be one at zero frequency"
+	assert np.all(m[1, high] < m[0, high]), "Smoothing should reduce the high frequency MTF"
+	assert np.all(power[1, 1:] < power[0, 1:]), "Higher dose should reduce the noise power"
+	assert contrast[1] > contrast[0], "Higher dose should increase the CNR"
+
+def test_15():
+	'''
+	Test for label phantoms:
+
+	check that phantoms are compact uint8 label maps, that converting them
+	with a material table is a lookup which leaves the labels unchanged,
+	that scanning the labels gives the same result as scanning them as
+	floating point values, and that both match scanning a separate floating
+	point image of each material, as ct_scan did before label phantoms
+	'''
+
+	# INITIAL CONDITIONS
+
+	# hip implant phantom and ideal source
+	p = ct_phantom(material.name, 256, 3)
+	s = fake_source(material.mev, 0.1, method='ideal')
+
+	# SETUP
+
+	labels = p.copy()
+	attenuation = convert_phantom(p, material.table(0.07))
+	units = convert_phantom(p, material.table(0.07, 'hu'))
+
+	# with the same noise, so that the scans can be compared exactly
+	np.random.seed(15)
+	compact = ct_scan(s, material, p, 0.1, 64)
+	np.random.seed(15)
+	full = ct_scan(s, material, p.astype(np.float64), 0.1, 64)
+
+	# the same scan without noise from the labels, with and without the
+	# compiled kernel, and from a 0/1 image of each material interpolated
+	# at the rotated coordinates of each angle
+	labelled = [ct_scan(s, material, p, 0.1, 64, jit=jit, noise=False) for jit in (False, HAVE_NUMBA)]
+	air = material.name.index('Air')
+	xi, yi = np.meshgrid(np.arange(256) - 127.5, np.arange(256) - 127.5)
+	reference = np.zeros((64, 256))
+	for angle in range(64):
+		a = -math.pi / 2 - angle * math.pi / 64
+		x0 = xi * math.cos(a) - yi * math.sin(a) + 127.5
+		y0 = xi * math.sin(a) + yi * math.cos(a) + 127.5
+		depth = np.zeros((len(material.coeffs), 256))
+		for m in np.unique(p):
+			if m != air:
+				depth[m] = scipy.ndimage.map_coordinates((p == m).astype(np.float64), [y0, x0], order=1, mode='constant', cval=0, prefilter=False).sum(axis=0)
+		depth[air] = 2 * 256 - depth.sum(axis=0)
+		reference[angle] = ct_detect(s, material.coeffs, depth * 0.1, noise=False)
+
+	# TESTS
+
+	# save the memory used and the scan difference
+	full_path = get_full_path('results/test_15', 'test_15_output.txt')
+	f = open(full_path, mode='w')
+	f.write(f"Label phantom uses {p.nbytes} bytes, against {attenuation.nbytes} for attenuation \n")
+	f.write(f"Maximum difference between uint8 and float64 label scans is {np.max(np.abs(compact - full))} \n")
+	f.write(f"Largest relative difference from the scan of each material image is {[np.max(np.abs(scan / reference - 1)) for scan in labelled]} \n")
+	f.close()
+
+	# expect uint8 labels which are not changed by conversion, a table which
+	# gives the HU of water and air, and the same scan either way, to within
+	# rounding of the per-material scan
+	assert p.dtype == np.uint8, f"Phantom should be uint8, got {p.dtype}"
+	assert np.array_equal(p, labels), "Conversion should not change the phantom"
+	assert np.array_equal(attenuation, material.table(0.07)[p]), "Conversion should be a lookup"
+	assert np.all(units[p == material.name.index('Air')] < -990), "Air should be about -1000 HU"
+	assert material.table(0.07, 'hu')[material.name.index('Water')] == 0, "Water should be 0 HU"
+	assert np.array_equal(compact, full), "Scans of uint8 and float64 labels differ"
+	for scan in labelled:
+		assert np.allclose(scan, reference, rtol=1e-9, atol=0), "Label scan differs from the scan of each material image"
+
+def test_16():
+	'''
+	Test for chunked array stores:
+
+	reconstruct a small volume straight into a compressed store, append the
+	sinograms to another store a block of angles at a time, and check that
+	partial reads match the arrays held in memory
+	'''
+
+	# INITIAL CONDITIONS
+
+	# three slice volume with different implants, and an ideal source
+	p = ct_phantom_volume(material.name, 64, 3, [1, 3, 7])
+	s = fake_source(material.mev, 0.1, method='ideal')
+
+	# SETUP
+
+	# empty results directory for the stores
+	directory = get_full_path('results/test_16', '')
+	for name in ('volume', 'sinogram'):
+		shutil.rmtree(os.path.join(directory, name), ignore_errors=True)
+
+	np.random.seed(16)
+	expected = scan_and_reconstruct_volume(s, material, p, 0.1, 64)
+	np.random.seed(16)
+	volume = create_store(os.path.join(directory, 'volume'), p.shape, compression='zlib', metadata=scan_metadata(s, 0.1, 64, 10000))
+	scan_and_reconstruct_volume(s, material, p, 0.1, 64, store=volume)
+
+	# sinograms stored in blocks of 16 angles, and appended as they arrive
+	sinogram = ct_calibrate(s, material, ct_scan(s, material, p, 0.1, 64), 0.1)
+	angles = create_store(os.path.join(directory, 'sinogram'), (0, 3, 64), chunks=(16, 1, 64))
+	for a in range(0, 64, 16):
+		angles.append(np.moveaxis(sinogram[:, a:a + 16], 1, 0))
+
+	volume = open_store(os.path.join(directory, 'volume'))
+	angles = open_store(os.path.join(directory, 'sinogram'))
+
+	# TESTS
+
+	# save the size of the compressed reconstruction
+	size = sum(os.path.getsize(os.path.join(directory, 'volume', f)) for f in os.listdir(os.path.join(directory, 'volume')))
+	full_path = get_full_path('results/test_16', 'test_16_output.txt')
+	f = open(full_path, mode='w')
+	f.write(f"Compressed volume uses {size} bytes, against {expected.nbytes} uncompressed \n")
+	f.close()
+
+	# expect the stored volume and sinogram to match those in memory, when
+	# read whole or in parts, along with the metadata
+	assert np.array_equal(volume[...], expected), "Stored volume differs"
+	assert np.array_equal(volume[1, 10:20, ::2], expected[1, 10:20, ::2]), "Partial read of volume differs"
+	assert np.array_equal(angles[20:40, 2], sinogram[2, 20:40]), "Partial read of sinogram differs"
+	assert volume.metadata['spectrum_hash'] == spectrum_hash(s), "Metadata differs"
+	assert size < expected.nbytes, "Compressed volume is no smaller"
+
+def test_17():
+	'''
+	Test for quantized sinograms:
+
+	scan a hip implant phantom keeping the counts as uint32 and the log of
+	the counts as int16, and check that the sinograms are smaller and that
+	the reconstructions differ by far less than the photon noise
+	'''
+
+	# INITIAL CONDITIONS
+
+	# hip implant phantom and ideal source
+	p = ct_phantom(material.name, 128, 3)
+	s = fake_source(material.mev, 0.1, method='ideal')
+
+	# SETUP
+
+	# the same noise for each, and different noise for comparison
+	reconstructions = {}
+	for quantize in (None, 'counts', 'log'):
+		np.random.seed(17)
+		reconstructions[quantize] = scan_and_reconstruct(s, material, p, 0.1, 128, quantize=quantize)
+	np.random.seed(18)
+	noise = np.sqrt(np.mean((scan_and_reconstruct(s, material, p, 0.1, 128) - reconstructions[None]) ** 2))
+	errors = {q: np.sqrt(np.mean((reconstructions[q] - reconstructions[None]) ** 2)) for q in ('counts', 'log')}
+
+	# calibration in small blocks is the same as all at once
+	photons = s * 10000 * pow(0.1, 2)
+	scan = ct_scan(photons, material, p, 0.1, 128, quantize='log')
+	np.random.seed(19)
+	blocks = ct_calibrate(photons, material, scan, 0.1, block_size=1000)
+	np.random.seed(19)
+	whole = ct_calibrate(photons, material, np.exp(scan[...]), 0.1)
+
+	# TESTS
+
+	# save the sizes and errors
+	full_path = get_full_path('results/test_17', 'test_17_output.txt')
+	f = open(full_path, mode='w')
+	f.write(f"log int16 sinogram uses {scan.nbytes} bytes, against {128 * 128 * 8} for float64 \n")
+	f.write(f"RMS differences are {errors['counts']} HU for counts and {errors['log']} HU for log counts, against {noise} HU for noise \n")
+	f.close()
+
+	# expect a quarter of the memory for the log sinogram, errors well
+	# below the noise, and the same calibration in blocks
+	assert scan.nbytes * 4 == 128 * 128 * 8, f"log sinogram uses {scan.nbytes} bytes"
+	assert errors['counts'] < 0.01 * noise, f"counts differ by {errors['counts']} HU"
+	assert errors['log'] < 0.05 * noise, f"log counts differ by {errors['log']} HU"
+	assert np.allclose(blocks, whole, rtol=0, atol=1e-9), "Calibration in blocks differs"
+
+def test_18():
+	'''
+	Test for the noise engine:
+
+	detect photons through a range of water depths many times, with exact
+	poisson noise and with the Gaussian approximation, check that both have
+	the expected mean and spread, that the noiseless detections are the
+	mean, that a generator makes the noise repeatable, and that the
+	approximation is only used when it is asked for
+	'''
+
+	# INITIAL CONDITIONS
+
+	# polychromatic source and a range of water depths, with titanium in some
+	s = source.photon('100kVp, 2mm Al') * 10000 * pow(0.1, 2)
+	depth = np.zeros((len(material.name), 64))
+	depth[material.name.index('Water')] = np.linspace(0, 40, 64)
+	depth[material.name.index('Titanium'), -8:] = 3
+
+	# SETUP
+
+	rng = np.random.default_rng(18)
+	expected = ct_detect(s, material.coeffs, depth, noise=False)
+	gaussian = np.array([ct_detect(s, material.coeffs, depth, rng=rng, threshold=1000) for i in range(2000)])
+	poisson = np.array([ct_detect(s, material.coeffs, depth, rng=rng, threshold=None) for i in range(2000)])
+	repeat = [ct_detect(s, material.coeffs, depth, rng=np.random.default_rng(1), threshold=1000) for i in range(2)]
+	default = [ct_detect(s, material.coeffs, depth, rng=np.random.default_rng(1), threshold=t) for t in (None, 1e100)]
+
+	# TESTS
+
+	# save the relative differences of the means and spreads
+	mean_difference = np.max(np.abs(gaussian.mean(axis=0) - poisson.mean(axis=0)) / expected)
+	# the spreads are compared where the Gaussian approximation is used,
+	# above 1000 counts of 1e6 photons
+	high = expected > 1000 * 1e6
+	spread_ratio = gaussian.std(axis=0)[high] / poisson.std(axis=0)[high]
+	full_path = get_full_path('results/test_18', 'test_18_output.txt')
+	f = open(full_path, mode='w')
+	f.write(f"Largest relative difference between the means is {mean_difference} \n")
+	f.write(f"Ratio of the spreads is between {spread_ratio.min()} and {spread_ratio.max()} \n")
+	f.close()
+
+	# expect both kinds of noise to have the noiseless mean and the same
+	# spread, to within the sampling error, and the same noise from the
+	# same generator
+	assert np.all(np.abs(poisson.mean(axis=0) - expected) < 5 * poisson.std(axis=0) / np.sqrt(2000)), "Poisson mean differs from noiseless"
+	assert np.all(np.abs(gaussian.mean(axis=0) - expected) < 5 * gaussian.std(axis=0) / np.sqrt(2000)), "Gaussian mean differs from noiseless"
+	assert np.all(np.abs(spread_ratio - 1) < 0.1), f"Spreads differ by up to {np.max(np.abs(spread_ratio - 1))}"
+	assert np.array_equal(repeat[0], repeat[1]), "Noise from the same generator differs"
+	assert np.array_equal(default[0], ct_detect(s, material.coeffs, depth, rng=np.random.default_rng(1))), "Default noise is not exact poisson"
+	assert np.array_equal(default[0], default[1]), "Poisson counts depend on the threshold"
+
+def test_19():
+	'''
+	Test for fused post-processing:
+
+	convert a reconstructed volume to Hounsfield Units and DICOM pixels in
+	one pass, in place, and check that this matches the separate steps, and
+	that water is close to 0 HU without the beam hardening correction when
+	the effective water coefficient of the spectrum is used. Also check that
+	masking the field of view in hu gives the same as masking it in
+	back_project
+	'''
+
+	# INITIAL CONDITIONS
+
+	# water disc and hip implant slices, and a real source spectrum
+	p = np.stack([ct_phantom(material.name, 128, 1, 'Water'), ct_phantom(material.name, 128, 3)])
+	s = source.photon('100kVp, 2mm Al') * 10000 * pow(0.1, 2)
+
+	# SETUP
+
+	np.random.seed(19)
+	scan = ct_scan(s, material, p, 0.1, 128)
+	reconstruction = back_project(ramp_filter(ct_calibrate(s, material, scan, 0.1, rng=np.random.default_rng(19)), 0.1))
+	attenuation = back_project(ramp_filter(ct_calibrate(s, material, scan, 0.1, correct=False, rng=np.random.default_rng(19)), 0.1))
+
+	# separate steps, as before
+	expected = (reconstruction - 1) * 1000
+	expected[expected < -1024] = -1024
+	expected_pixels = np.clip(expected + 1024, 0, 4096).astype(np.uint16)
+
+	# fused, in place
+	pixels = np.zeros(p.shape, dtype=np.uint16)
+	fused = reconstruction.copy()
+	result = hu(s, material, fused, 0.1, out=fused, pixels=pixels, fov=True)
+	uncorrected = hu(s, material, attenuation, 0.1, calibrated=False)
+
+	# unmasked back-projection, with the field of view set by hu
+	unmasked = back_project(ramp_filter(ct_calibrate(s, material, scan, 0.1, rng=np.random.default_rng(19)), 0.1), mask=False)
+	unmasked = hu(s, material, unmasked, 0.1, out=unmasked, fov=True)
+
+	centre = (slice(54, 74), slice(54, 74))
+	water = np.mean(uncorrected[0][centre])
+
+	# TESTS
+
+	# save the water value
+	full_path = get_full_path('results/test_19', 'test_19_output.txt')
+	f = open(full_path, mode='w')
+	f.write(f"Water is {np.mean(result[0][centre])} HU corrected and {water} HU uncorrected, with a water coefficient of {water_coefficient(s, material)} cm^-1 \n")
+	f.close()
+
+	# expect the same values in place, the same DICOM pixels, and water
+	# within the cupping of beam hardening of 0 HU
+	assert result is fused, "Output should be in place"
+	assert np.array_equal(fused, expected), "Fused HU conversion differs"
+	assert np.array_equal(pixels, expected_pixels), "Fused DICOM pixels differ"
+	assert np.array_equal(pixels[0], dicom_pixels(expected[0])), "DICOM pixels differ from dicom_pixels"
+	assert abs(water) < 100, f"Uncorrected water is {water} HU"
+	assert np.array_equal(unmasked, expected), "Field of view from hu differs from back_project"
+
+def test_20():
+	'''
+	Test for the autotuner:
+
+	tune a small reconstruction, check that the settings are saved for this
+	machine, that back_project and ct_calibrate then use the jit and block
+	size without being told to, and that the FFT length and interpolation,
+	which change the result, are only used when asked for
+	'''
+
+	# INITIAL CONDITIONS
+
+	# a separate settings file, so the tests do not change the real one
+	filename = 'results/test_20/ct_tune.json'
+	if os.path.exists(filename):
+		os.remove(filename)
+	previous = os.environ.get('CT_TUNE_FILE')
+	os.environ['CT_TUNE_FILE'] = filename
+
+	# 100 samples, for which 'fast' is a shorter FFT than 'pow2'
+	sinogram = np.random.default_rng(20).random((90, 100))
+
+	# SETUP
+
+	try:
+		untuned = back_project(ramp_filter(sinogram, 0.1))
+		settings = autotune(100, 90, repeats=1, approximate=True, material=material)
+		saved = tuned(100, 90, np.float64)
+
+		# force the slowest choices, to see that they are picked up
+		save_tuned(100, 90, np.float64, {'fft_length': 'fast', 'interpolation': 'linear', 'jit': False, 'block_size': 1000})
+		monitor = Monitor()
+		filtered = ramp_filter(sinogram, 0.1, monitor=monitor)
+		image = back_project(filtered, monitor=monitor)
+		default_settings = monitor.report()
+		monitor = Monitor()
+		tuned_filtered = ramp_filter(sinogram, 0.1, length='tuned', monitor=monitor)
+		tuned_image = back_project(filtered, interpolation='tuned', monitor=monitor)
+		counts = quantize_sinogram(1e6 * np.exp(-sinogram), storage=np.uint16)
+		ct_calibrate(source.photon('100kVp, 2mm Al'), material, counts, 0.1, noise=False, monitor=monitor)
+		opted_settings = monitor.report()
+		other_size = back_project(ramp_filter(sinogram[:, :98], 0.1, length='tuned'), interpolation='tuned')
+	finally:
+		if previous is None:
+			del os.environ['CT_TUNE_FILE']
+		else:
+			os.environ['CT_TUNE_FILE'] = previous
+
+	# TESTS
+
+	# save the settings
+	full_path = get_full_path('results/test_20', 'test_20_output.txt')
+	f = open(full_path, mode='w')
+	f.write(f"Tuned settings for {tune_key(100, 90, np.float64)} are {settings} \n")
+	f.close()
+
+	# expect the settings to be saved under this machine, the jit and block
+	# size to be used by default for this size only, and the FFT length and
+	# interpolation only when asked for, with every choice in the report
+	assert saved['interpolation'] == settings['interpolation'] and saved['fft_length'] == settings['fft_length'], "Settings were not saved"
+	assert np.allclose(untuned, image), "Default reconstruction changed after tuning"
+	assert np.array_equal(filtered, ramp_filter(sinogram, 0.1, length='pow2')), "Tuned FFT length was used by default"
+	assert default_settings['back_project']['settings'] == {'jit': False, 'interpolation': 'cubic', 'symmetry': True}, "Tuned jit was not used"
+	assert np.array_equal(image, back_project(filtered, jit=False)), "Default reconstruction differs from the tuned kernel"
+	assert np.array_equal(tuned_filtered, ramp_filter(sinogram, 0.1, length='fast')), "Tuned FFT length was not used"
+	assert not np.array_equal(tuned_filtered, filtered), "FFT lengths should differ"
+	assert np.array_equal(tuned_image, back_project(filtered, interpolation='linear')), "Tuned interpolation was not used"
+	assert opted_settings['ramp_filter']['settings'] == {'fft_length': 'fast'}, "FFT length was not noted"
+	assert opted_settings['back_project']['settings'] == {'jit': False, 'interpolation': 'linear', 'symmetry': True}, "Interpolation was not noted"
+	assert opted_settings['ct_calibrate']['settings'] == {'block_size': 1000}, "Tuned block size was not used"
+	assert np.allclose(other_size, back_project(ramp_filter(sinogram[:, :98], 0.1, length='pow2'), interpolation='cubic')), "Settings were used for another size"
+
+def test_21():
+	'''
+	Test for the back-projection interpolation modes:
+
+	reconstruct the hip implant with each interpolation, and check that the
+	prefiltered B-spline is much closer to the cubic spline than linear
+	interpolation, which is closer than the nearest sample
+	'''
+
+	# INITIAL CONDITIONS
+
+	# hip implant and a real source spectrum
+	p = ct_phantom(material.name, 128, 3)
+	s = source.photon('100kVp, 2mm Al') * 10000 * pow(0.1, 2)
+
+	# SETUP
+
+	np.random.seed(21)
+	filtered = ramp_filter(ct_calibrate(s, material, ct_scan(s, material, p, 0.1, 128), 0.1), 0.1)
+	reference = back_project(filtered, jit=False, interpolation='cubic')
+	inside = fov_mask(128)
+
+	errors = {}
+	times = {}
+	for interpolation in ['spline', 'linear', 'nearest']:
+		start = time.perf_counter()
+		image = back_project(filtered, interpolation=interpolation)
+		times[interpolation] = time.perf_counter() - start
+		errors[interpolation] = masked_rms(image, reference, inside)
+
+	# the coefficients are shared by every tile and slice
+	stack = np.stack([filtered, filtered])
+	tiled = back_project_tiled(stack, 1e5, interpolation='spline')
+
+	# TESTS
+
+	# save the errors and times
+	full_path = get_full_path('results/test_21', 'test_21_output.txt')
+	f = open(full_path, mode='w')
+	for interpolation in errors:
+		f.write(f"{interpolation} has RMS difference {errors[interpolation]} from cubic in {times[interpolation]} s \n")
+	f.close()
+
+	# expect spline to match cubic closely, and the error to grow as the
+	# order of the interpolation falls
+	assert errors['spline'] < 0.1 * errors['linear'], f"Spline error {errors['spline']} is too large"
+	assert errors['linear'] < errors['nearest'], "Linear should be more accurate than nearest"
+	assert np.allclose(tiled[1], back_project(filtered, interpolation='spline')), "Tiled spline back-projection differs"
+
+def test_22():
+	'''
+	Test for symmetric back-projection:
+
+	check that grouping the angles by symmetry covers every angle once, and
+	that the reconstruction is the same as back-projecting each angle on
+	its own, for a number of angles which is a multiple of 4 and one which
+	is only even. If numba is available, also check that the compiled
+	kernel groups the angles, and gives the same reconstruction
+	'''
+
+	# INITIAL CONDITIONS
+
+	# hip implant and a real source spectrum
+	p = ct_phantom(material.name, 128, 3)
+	s = source.photon('100kVp, 2mm Al') * 10000 * pow(0.1, 2)
+
+	# SETUP
+
+	np.random.seed(22)
+	results = {}
+	for angles in [128, 90]:
+		filtered = ramp_filter(ct_calibrate(s, material, ct_scan(s, material, p, 0.1, angles), 0.1), 0.1)
+		groups = symmetric_angles(angles)
+
+		start = time.perf_counter()
+		separate = back_project(filtered, jit=False, symmetry=False)
+		separate_time = time.perf_counter() - start
+
+		start = time.perf_counter()
+		grouped = back_project(filtered, jit=False)
+		grouped_time = time.perf_counter() - start
+
+		# the compiled kernel, which notes whether the angles were grouped
+		compiled = None
+		if HAVE_NUMBA:
+			monitor = Monitor()
+			compiled = (back_project(filtered, jit=True, monitor=monitor), monitor.report()['back_project']['settings'])
+
+		results[angles] = (groups, separate, grouped, separate_time, grouped_time, compiled)
+
+	# TESTS
+
+	# save the times
+	full_path = get_full_path('results/test_22', 'test_22_output.txt')
+	f = open(full_path, mode='w')
+	for angles in results:
+		groups, separate, grouped, separate_time, grouped_time, compiled = results[angles]
+		f.write(f"{angles} angles in {len(groups)} groups took {grouped_time} s rather than {separate_time} s \n")
+	f.close()
+
+	# expect every angle in exactly one group, about a quarter as many groups
+	# as angles, and the same reconstruction
+	for angles in results:
+		groups, separate, grouped, separate_time, grouped_time, compiled = results[angles]
+		assert sorted(angle for group in groups for angle, view in group) == list(range(angles)), "Groups do not cover every angle once"
+		assert len(groups) <= angles // 4 + 2, f"{len(groups)} groups for {angles} angles"
+		assert np.allclose(grouped, separate, atol=1e-10), "Symmetric back-projection differs"
+		if compiled is not None:
+			assert compiled[1]['jit'] and compiled[1]['symmetry'], f"Compiled back-projection was not grouped: {compiled[1]}"
+			assert np.allclose(compiled[0], separate, atol=1e-10), "Symmetric compiled back-projection differs"
+
+def test_23():
+	'''
+	Test for low fidelity runs:
+
+	check that downsampling a phantom keeps the amount of each material,
+	that binning a sinogram over samples and angles matches scanning with
+	larger pixels and fewer angles, and that a run at 1/4 fidelity is
+	flagged, with a warning and in the monitor report, and gives nearly the
+	same mean values in each material
+	'''
+
+	# INITIAL CONDITIONS
+
+	# hip implant and a real source spectrum
+	p = ct_phantom(material.name, 256, 3)
+	s = source.photon('100kVp, 2mm Al') * 10000 * pow(0.1, 2)
+	count = len(material.name)
+
+	# SETUP
+
+	fractions = downsample_phantom(p, 2, count)
+
+	# noise free scans of the full phantom, binned, and of the downsampled
+	# phantom with twice the pixel size and half the angles
+	full = ct_calibrate(s, material, ct_scan(s, material, p, 0.1, 128, noise=False), 0.1, noise=False)
+	binned, binned_scale = bin_sinogram(full, 0.1, 2, 2)
+	coarse = ct_calibrate(s * 4, material, ct_scan(s * 4, material, fractions, 0.2, 64, noise=False, fractions=True), 0.2, noise=False)
+
+	# full and quarter fidelity reconstructions, without noise, as the water
+	# calibration of a noisy scan is extrapolated from its noisiest depths
+	monitor = Monitor()
+	reconstruction = scan_and_reconstruct(source.photon('100kVp, 2mm Al'), material, p, 0.1, 256, noise=False)
+	with warnings.catch_warnings(record=True) as caught:
+		warnings.simplefilter('always')
+		screening = scan_and_reconstruct(source.photon('100kVp, 2mm Al'), material, p, 0.1, 256, noise=False, fidelity=1/4, monitor=monitor)
+	mean, std, pixels = label_statistics(reconstruction, p, count)
+	screening_mean, screening_std, pixels = label_statistics(screening, p, count)
+	large = pixels > 2000
+	large[material.name.index('Air')] = False
+
+	# TESTS
+
+	# save the mean values, other than air
+	full_path = get_full_path('results/test_23', 'test_23_output.txt')
+	f = open(full_path, mode='w')
+	f.write(f"Mean HU of each material is {mean[large]} at full fidelity and {screening_mean[large]} at 1/4 \n")
+	f.close()
+
+	# expect the same amount of each material, the same scan to within the
+	# partial volumes at the edges, and close values at 1/4 fidelity
+	assert np.allclose(fractions.sum(axis=(1, 2)) * 4, np.bincount(p.ravel(), minlength=count)), "Downsampling changed the materials"
+	assert binned.shape == coarse.shape and binned_scale == 0.2, "Binned sinogram has the wrong shape or scale"
+	assert np.median(np.abs(binned - coarse)) < 0.05, f"Binned sinogram differs by {np.median(np.abs(binned - coarse))}"
+	assert screening.shape == p.shape, "Screening run should be the size of the phantom"
+	assert monitor.report()['scan_and_reconstruct']['fidelity'] == 1/4, "Screening run was not flagged"
+	assert any(issubclass(w.category, ScreeningWarning) for w in caught), "Screening run gave no warning"
+	assert np.all(np.abs(screening_mean - mean)[large] < 50), "Screening values differ too much"
+
+def test_24():
+	'''
+	Test for batch jobs:
+
+	run a JSON job spec on a pool of two workers, after a reconstruction in
+	this process, and check that every output is written, that the
+	reconstructions are the same as running scan_and_reconstruct directly
+	with the same seed, and that a failed job is reported without stopping
+	the others, and that a screening job is flagged in its metrics and DICOM
+	output
+	'''
+
+	# INITIAL CONDITIONS
+
+	storage_directory = 'results/test_24'
+	if os.path.exists(storage_directory):
+		shutil.rmtree(storage_directory)
+	spec = {'defaults': {'n': 64, 'seed': 24, 'outputs': ['npy', 'dicom', 'metrics']},
+		'jobs': [{'name': 'disc', 'phantom': 1}, {'name': 'hip', 'phantom': 3, 'mas': 5000},
+		{'name': 'ideal', 'phantom': 2, 'source': {'mvp': 0.1, 'method': 'ideal'}}, {'phantom': 3, 'engine': 'none'},
+		{'name': 'screen', 'phantom': 1, 'fidelity': 0.25}]}
+	with open(get_full_path(storage_directory, 'jobs.json'), 'w') as f:
+		json.dump(spec, f)
+
+	# SETUP
+
+	# reconstruct here first, which starts numba's threads in this process
+	# before the workers are started
+	p = ct_phantom(material.name, 64, 3)
+	expected = scan_and_reconstruct(source.photon('100kVp, 2mm Al'), material, p, 0.1, 64, 5000, rng=np.random.default_rng(24))
+
+	jobs = load_jobs(os.path.join(storage_directory, 'jobs.json'))
+	summaries = run_batch(jobs, 2, storage_directory)
+	hip = load_numpy_array(storage_directory, 'hip.npy')
+	with open(os.path.join(storage_directory, 'hip.json')) as f:
+		metrics = json.load(f)
+	with open(os.path.join(storage_directory, 'screen.json')) as f:
+		screen = json.load(f)
+	screen_dicom = pydicom.dcmread(os.path.join(storage_directory, 'screen_0001.dcm'))
+
+	# TESTS
+
+	# save the summaries
+	full_path = get_full_path(storage_directory, 'test_24_output.txt')
+	f = open(full_path, mode='w')
+	for summary in summaries:
+		f.write(f"{summary} \n")
+	f.close()
+
+	# expect the outputs of each job, in order, and the failed job reported
+	assert [summary['name'] for summary in summaries] == ['disc', 'hip', 'ideal', 'job_4', 'screen'], "Jobs are out of order"
+	for summary in summaries[:3] + summaries[4:]:
+		assert 'error' not in summary, f"Job {summary['name']} failed with {summary.get('error')}"
+		for name in summary['files']:
+			assert os.path.exists(os.path.join(storage_directory, name)), f"{name} was not written"
+	assert 'error' in summaries[3], "Job with an unknown engine should fail"
+	assert np.array_equal(hip, expected), "Batch reconstruction differs"
+	assert metrics['materials']['Titanium']['pixels'] == np.sum(p == material.name.index('Titanium')), "Metrics are wrong"
+	assert metrics['fidelity'] == 1 and screen['fidelity'] == 0.25, "Fidelity is missing from the metrics"
+	assert 'screening' in screen_dicom.ImageComments, "Screening run is not flagged in its DICOM file"
+
+def test_25():
+	'''
+	Test for tiled back-projection:
+
+	reconstruct a stack of slices in tiles within a range of memory budgets,
+	with and without the compiled kernel, and check that this matches the
+	whole reconstruction from back_project, that the peak memory stays
+	within the budget, and that falling back to the 'spline' interpolation
+	when the 'cubic' coefficients do not fit is reported
+	'''
+
+	# INITIAL CONDITIONS
+
+	# three slices of hip implant, so that the coefficients of the whole
+	# stack, one slice, or neither fit within the budgets
+	s = source.photon('100kVp, 2mm Al') * 10000 * pow(0.1, 2)
+	p = np.stack([ct_phantom(material.name, 128, 3), ct_phantom(material.name, 128, 1), ct_phantom(material.name, 128, 5)])
+	np.random.seed(25)
+	sinogram = ramp_filter(ct_calibrate(s, material, ct_scan(s, material, p, 0.1, 128), 0.1), 0.1)
+	budgets = (3e5, 2e6, 1e7)
+
+	# SETUP
+
+	reports = {}
+	differences = {}
+	for jit in (False, HAVE_NUMBA):
+		expected = back_project(sinogram, jit=jit)
+		spline = back_project(sinogram, interpolation='spline')
+
+		# once first, so that compiling the kernel is not counted
+		back_project_tiled(sinogram, 1e7, jit=jit)
+		for memory in budgets:
+			monitor = Monitor(memory=True)
+			out = np.zeros(expected.shape)
+			tiled = back_project_tiled(sinogram, memory, out=out, jit=jit, monitor=monitor)
+			report = monitor.report()['back_project']
+			reports[(jit, memory)] = report
+			reference = spline if report['settings'].get('fallback') else expected
+			differences[(jit, memory)] = np.max(np.abs(tiled - reference))
+
+	# TESTS
+
+	# save the peak memory of each budget
+	full_path = get_full_path('results/test_25', 'test_25_output.txt')
+	f = open(full_path, mode='w')
+	for (jit, memory), report in reports.items():
+		f.write(f"jit={jit} memory={memory:g} peak memory {report['peak_memory']} settings {report['settings']} difference {differences[(jit, memory)]} \n")
+	f.close()
+
+	# expect the whole reconstruction in every case, within the budget, with
+	# the fallback only for the smallest budget
+	for (jit, memory), report in reports.items():
+		assert differences[(jit, memory)] < 1e-10, f"Tiled reconstruction differs by {differences[(jit, memory)]} with jit={jit} and memory={memory:g}"
+		assert report['peak_memory'] <= memory, f"Peak memory {report['peak_memory']} exceeds {memory:g}"
+		assert report['settings'].get('fallback', False) == (memory == budgets[0]), f"Unexpected fallback with memory={memory:g}"
+
+def test_26():
+	'''
+	Test for reading DICOM series:
+
+	write a volume as an enhanced multi-frame file, as a series of single
+	slices, and as an older style multi-frame file with a single slice
+	between its frames, and check that read_dicom reads each back in the
+	right order with the values written
+	'''
+
+	# INITIAL CONDITIONS
+
+	storage_directory = 'results/test_26'
+	if os.path.exists(storage_directory):
+		shutil.rmtree(storage_directory)
+	for name in ('series', 'mixed'):
+		get_full_path(os.path.join(storage_directory, name), name)
+
+	# random HU values, which are stored to the nearest integer
+	x = np.random.default_rng(26).uniform(-1024, 2000, (4, 32, 40))
+	expected = dicom_pixels(x).astype(np.float32) - 1024
+
+	# SETUP
+
+	create_dicom_volume(x, 'volume', 0.5, 2, storage_directory=storage_directory)
+	for f in range(4):
+		create_dicom(x[f], 'slice', 0.5, 2, f + 1, storage_directory=os.path.join(storage_directory, 'series'))
+
+	# three frames 2 mm apart from z = 0, and one slice at z = 3, which
+	# belongs between the second and third frames
+	mixed = os.path.join(storage_directory, 'mixed')
+	create_dicom(x[0], 'frames', 0.5, 2, 0, storage_directory=mixed)
+	ds = pydicom.dcmread(os.path.join(mixed, 'frames_0000.dcm'))
+	ds.NumberOfFrames = 3
+	ds.PixelData = dicom_pixels(x[[0, 1, 3]]).tobytes()
+	ds.save_as(os.path.join(mixed, 'frames_0000.dcm'))
+	create_dicom(x[2], 'slice', 0.5, 1, 3, storage_directory=mixed)
+
+	volume = read_dicom(os.path.join(storage_directory, 'volume.dcm'))
+	series = read_dicom(os.path.join(storage_directory, 'series'), threads=2)
+	frames = read_dicom(mixed)
+
+	# TESTS
+
+	# save the differences
+	full_path = get_full_path(storage_directory, 'test_26_output.txt')
+	f = open(full_path, mode='w')
+	f.write(f"Largest differences are {np.max(np.abs(volume - expected))} for the volume, {np.max(np.abs(series - expected))} for the series and {np.max(np.abs(frames - expected))} for the multi-frame file \n")
+	f.close()
+
+	# expect the values written, in order
+	assert np.array_equal(volume, expected), "Enhanced multi-frame volume differs"
+	assert np.array_equal(series, expected), "Series of slices differs"
+	assert np.array_equal(frames, expected), "Multi-frame file with a slice between its frames is out of order"
+
+def test_27():
+	'''
+	Test for regions of interest:
+
+	reconstruct regions of odd and even shapes around whole-numbered
+	centres, with and without the compiled kernel, and check that each is
+	exactly the matching crop of the full reconstruction, and that a region
+	without a centre is placed in the middle of the image
+	'''
+
+	# INITIAL CONDITIONS
+
+	# hip implant, so that the regions are not uniform
+	s = fake_source(material.mev, 0.1, method='ideal') * 10000 * pow(0.1, 2)
+	p = ct_phantom(material.name, 128, 3)
+	np.random.seed(27)
+	sinogram = ramp_filter(ct_calibrate(s, material, ct_scan(s, material, p, 0.1, 128), 0.1), 0.1)
+	regions = [((64, 64), (16, 16)), ((40, 90), (15, 20)), ((70, 33), (9, 8)), ((64, 64), (128, 128))]
+
+	# SETUP
+
+	differences = []
+	for jit in (False, HAVE_NUMBA):
+		full = back_project(sinogram, jit=jit)
+		for centre, shape in regions:
+			roi = back_project(sinogram, jit=jit, centre=centre, shape=shape)
+			crop = full[centre[0] - shape[0] // 2:centre[0] - shape[0] // 2 + shape[0], centre[1] - shape[1] // 2:centre[1] - shape[1] // 2 + shape[1]]
+			differences.append(np.max(np.abs(roi - crop)))
+	xs, ys = output_grid(128, shape=(10, 10))
+
+	# TESTS
+
+	# save the differences
+	full_path = get_full_path('results/test_27', 'test_27_output.txt')
+	f = open(full_path, mode='w')
+	f.write(f"Largest differences from the crops are {differences} \n")
+	f.close()
+
+	# expect the same pixels, and a default region symmetric about the middle
+	assert max(differences) < 1e-10, f"Regions differ from the full reconstruction by up to {max(differences)}"
+	assert np.allclose(xs, -xs[::-1]) and np.allclose(ys, -ys[::-1]), "Default region is not centred"
+
+def test_28():
+	'''
+	Test for enhanced multi-frame DICOM volumes:
+
+	write a reconstructed volume with create_dicom_volume, with and without
+	RLE compression, and check that pydicom reads back the same pixels,
+	frame positions and rescaling as the separate files from create_dicom,
+	and that the compressed file is smaller
+	'''
+
+	# INITIAL CONDITIONS
+
+	storage_directory = 'results/test_28'
+	if os.path.exists(storage_directory):
+		shutil.rmtree(storage_directory)
+	get_full_path(storage_directory, 'volume')
+
+	# HU values beyond the DICOM range at both ends, and flat air outside
+	# the field of view which compresses well
+	x = np.full((3, 48, 40), -1024.0)
+	x[:, 8:40, 4:36] = np.random.default_rng(28).uniform(-1500, 3500, (3, 32, 32))
+
+	# SETUP
+
+	create_dicom_volume(x, 'plain', 0.5, 2, storage_directory=storage_directory)
+	create_dicom_volume(x, 'compressed', 0.5, 2, storage_directory=storage_directory, compress=True)
+	create_dicom(x[1], 'slice', 0.5, 2, 2, storage_directory=storage_directory)
+
+	plain = pydicom.dcmread(os.path.join(storage_directory, 'plain.dcm'))
+	compressed = pydicom.dcmread(os.path.join(storage_directory, 'compressed.dcm'))
+	single = pydicom.dcmread(os.path.join(storage_directory, 'slice_0002.dcm'))
+	sizes = [os.path.getsize(os.path.join(storage_directory, name + '.dcm')) for name in ('plain', 'compressed')]
+
+	# TESTS
+
+	# save the file sizes
+	full_path = get_full_path(storage_directory, 'test_28_output.txt')
+	f = open(full_path, mode='w')
+	f.write(f"Volume is {sizes[0]} bytes uncompressed and {sizes[1]} bytes compressed \n")
+	f.close()
+
+	# expect the same pixels and geometry as create_dicom, either way
+	for ds in (plain, compressed):
+		assert int(ds.NumberOfFrames) == 3, f"Expected 3 frames, got {ds.NumberOfFrames}"
+		assert np.array_equal(ds.pixel_array, dicom_pixels(x)), f"Pixels differ for {ds.file_meta.TransferSyntaxUID.name}"
+		assert np.array_equal(ds.pixel_array[1], single.pixel_array), "Frame differs from create_dicom"
+		positions = [float(group.PlanePositionSequence[0].ImagePositionPatient[2]) for group in ds.PerFrameFunctionalGroupsSequence]
+		assert positions == [2.0, 4.0, 6.0], f"Frame positions are {positions}"
+		assert positions[1] == float(single.ImagePositionPatient[2]), "Frame position differs from create_dicom"
+		transformation = ds.SharedFunctionalGroupsSequence[0].PixelValueTransformationSequence[0]
+		assert float(transformation.RescaleIntercept) == float(single.RescaleIntercept), "Rescaling differs from create_dicom"
+	assert compressed.file_meta.TransferSyntaxUID == pydicom.uid.RLELossless, "Volume was not compressed"
+	assert sizes[1] < sizes[0], f"Compressed volume is {sizes[1]} bytes, uncompressed {sizes[0]}"
+
+def test_29():
+	'''
+	Test for multi-slice volumes:
+
+	build a phantom volume whose implants vary between slices, reconstruct
+	it as one volume, and check that each slice matches ct_phantom and
+	scan_and_reconstruct of the same slice on its own
+	'''
+
+	# INITIAL CONDITIONS
+
+	# noiseless, so that the volume and the slices can be compared exactly
+	s = source.photon('100kVp, 2mm Al')
+	types = [3, 3, 1, 5]
+	metals = ['Titanium', 'Stainless Steel', None, None]
+	p = ct_phantom_volume(material.name, 64, 4, types, metals)
+
+	# SETUP
+
+	updates = []
+	monitor = Monitor(progress=lambda stage, done, total: updates.append(done) if stage == 'back_project' else None)
+	volume = scan_and_reconstruct_volume(s, material, p, 0.1, 64, workers=2, noise=False, monitor=monitor)
+	slices = [scan_and_reconstruct(s, material, p[z], 0.1, 64, noise=False) for z in range(4)]
+	difference = max(np.max(np.abs(volume[z] - slices[z])) for z in range(4))
+
+	# TESTS
+
+	# save the difference
+	full_path = get_full_path('results/test_29', 'test_29_output.txt')
+	f = open(full_path, mode='w')
+	f.write(f"Largest difference between the volume and the separate slices is {difference} HU \n")
+	f.close()
+
+	# expect each slice of the phantom and the reconstruction to match
+	assert p.shape == (4, 64, 64) and p.dtype == np.uint8, f"Phantom volume is {p.shape} {p.dtype}"
+	for z in range(4):
+		assert np.array_equal(p[z], ct_phantom(material.name, 64, types[z], metals[z])), f"Phantom slice {z} differs"
+	assert volume.shape == p.shape, f"Reconstruction is {volume.shape}"
+	assert difference < 1e-6, f"Volume differs from the separate slices by {difference} HU"
+	assert updates == sorted(updates) and updates[-1] == 4, f"Back-projection progress is out of order: {updates}"
+
+def test_30():
+	'''
+	Test for the benchmark:
+
+	benchmark one small case, including reading a synthetic Xtreme RSQ file,
+	save and reload the results, and check that compare_benchmark flags a
+	stage which has become slower than the baseline but not the others
+	'''
+
+	# INITIAL CONDITIONS
+
+	storage_directory = 'results/test_30'
+	if os.path.exists(storage_directory):
+		shutil.rmtree(storage_directory)
+
+	# SETUP
+
+	results = benchmark(ns=(32,), bins=(1,), types=(1,), storage_directory=storage_directory)
+	filename = os.path.join(storage_directory, 'benchmark.json')
+	save_benchmark(results, filename)
+	baseline = load_benchmark(filename)
+
+	# the same results again, and the same with back_project twice as slow
+	unchanged = compare_benchmark(results, baseline)
+	name = 'back_project n=32 angles=32 bins=1 type=1'
+	slower = copy.deepcopy(results)
+	slower[name]['time'] = 2 * baseline[name]['time']
+	regressions = compare_benchmark(slower, baseline)
+
+	# the synthetic RSQ file, as read by Xtreme
+	x = Xtreme(write_rsq(storage_directory, 32, 32))
+	sinogram = x.get_rsq_slice(0)[0]
+
+	# TESTS
+
+	# expect every stage to be timed, with its memory, and only the slower
+	# stage to be flagged
+	stages = ['ct_phantom', 'ct_scan', 'ct_detect', 'ct_calibrate', 'ramp_filter', 'back_project', 'back_project_numpy', 'fast_back_project', 'hu', 'scan_and_reconstruct']
+	for stage in stages:
+		result = results[stage + ' n=32 angles=32 bins=1 type=1']
+		assert result['time'] > 0 and result['peak_memory'] > 0, f"{stage} was not measured: {result}"
+	assert ('xtreme_slice n=32 angles=32' in results) and ('xtreme_scan n=32 angles=32' in results), "Xtreme was not benchmarked"
+	assert baseline == results, "Saved results differ"
+	assert unchanged == [], f"Unchanged results flagged {unchanged}"
+	assert regressions == [name], f"Expected only {name} to be flagged, got {regressions}"
+	assert (int(x.recon_angles) == 32) and (sinogram.shape[-1] == 32), f"RSQ file has {x.recon_angles} angles of {sinogram.shape[-1]} samples"
+
+def test_31():
+	'''
+	Test for the monitor:
+
+	scan and reconstruct with progress and report functions, and check that
+	the progress of ct_scan and back_project arrives in order up to the
+	total, that emit and save pass on the report, that the estimated bytes
+	include the reconstruction, and that tracing memory only stops
+	tracemalloc if the monitor started it
+	'''
+
+	# INITIAL CONDITIONS
+
+	storage_directory = 'results/test_31'
+	p = ct_phantom(material.name, 64, 3)
+	s = fake_source(material.mev, 0.1, method='ideal')
+
+	# SETUP
+
+	updates = []
+	reports = []
+	monitor = Monitor(progress=lambda stage, done, total: updates.append((stage, done, total)), report=reports.append)
+	sinogram = ct_scan(s, material, p, 0.1, 64, monitor=monitor, noise=False)
+	reconstruction = back_project(ramp_filter(ct_calibrate(s, material, sinogram, 0.1, noise=False), 0.1), jit=False, monitor=monitor)
+	monitor.emit()
+	monitor.save(get_full_path(storage_directory, 'report.json'))
+	with open(os.path.join(storage_directory, 'report.json')) as f:
+		saved = json.load(f)
+
+	# tracing started by the caller, and by the monitor itself
+	tracemalloc.start()
+	with Monitor(memory=True).stage('traced'):
+		np.zeros(1000)
+	caller_tracing = tracemalloc.is_tracing()
+	tracemalloc.stop()
+	with Monitor(memory=True).stage('traced'):
+		np.zeros(1000)
+	monitor_tracing = tracemalloc.is_tracing()
+
+	# TESTS
+
+	# save the progress
+	full_path = get_full_path(storage_directory, 'test_31_output.txt')
+	f = open(full_path, mode='w')
+	f.write(f"{len(updates)} progress updates, last {updates[-1]} \n")
+	f.write(f"back_project estimated {monitor.report()['back_project']['estimated_bytes']} bytes \n")
+	f.close()
+
+	# expect each stage's progress to rise to its total, one report from
+	# emit which is also saved, and the caller's tracing left running
+	for stage, total in (('ct_scan', 64), ('back_project', 64)):
+		done = [d for name, d, t in updates if name == stage]
+		assert len(done) > 0 and all(t == total for name, d, t in updates if name == stage), f"{stage} progress has the wrong total"
+		assert done == sorted(done) and done[-1] == total, f"{stage} progress is out of order: {done}"
+	assert reports == [monitor.report()], "emit did not pass on the report"
+	assert saved == monitor.report(), "Saved report differs"
+	assert monitor.report()['back_project']['estimated_bytes'] >= reconstruction.nbytes, "Estimated bytes do not include the reconstruction"
+	assert caller_tracing, "Monitor stopped the caller's tracemalloc"
+	assert not monitor_tracing, "Monitor did not stop its own tracemalloc"
+
 # Run the various tests
-# print('Test 1')
-# test_1()
-# print('Test 2')
-# test_2()
-# print('Test 3')
-# test_3()
-print('Test 3')
-test_3()
-# test_6()
+# (under __main__, as run_batch starts workers which import this file)
+if __name__ == '__main__':
+	# print('Test 1')
+	# test_1()
+	# print('Test 2')
+	# test_2()
+	# print('Test 3')
+	# test_3()
+	print('Test 3')
+	test_3()
+	# test_6()
+	# print('Test 7')
+	# test_7()
+	# print('Test 8')
+	# test_8()
+	# print('Test 9')
+	# test_9()
+	# print('Test 10')
+	# test_10()
+	# print('Test 11')
+	# test_11()
+	# print('Test 12')
+	# test_12()
+	# print('Test 13')
+	# test_13()
+	# print('Test 14')
+	# test_14()
+	# print('Test 15')
+	# test_15()
+	# print('Test 16')
+	# test_16()
+	# print('Test 17')
+	# test_17()
+	# print('Test 18')
+	# test_18()
+	# print('Test 19')
+	# test_19()
+	# print('Test 20')
+	# test_20()
+	# print('Test 21')
+	# test_21()
+	# print('Test 22')
+	# test_22()
+	# print('Test 23')
+	# test_23()
+	# print('Test 24')
+	# test_24()
+	# print('Test 25')
+	# test_25()
+	# print('Test 26')
+	# test_26()
+	# print('Test 27')
+	# test_27()
+	# print('Test 28')
+	# test_28()
+	# print('Test 29')
+	# test_29()
+	# print('Test 30')
+	# test_30()
+	# print('Test 31')
+	# test_31()
\ No newline at end of file
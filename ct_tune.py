@@ -0,0 +1,81 @@
+import json
+import os
+import platform
+import numpy as np
+
+# settings chosen by ct_benchmark.autotune for each problem size on this
+# machine. They are kept in a JSON file keyed by tune_key. The settings which
+# only change the speed, the back_project jit and the ct_calibrate
+# block_size, are looked up with tuned whenever they are not given, so that
+# once a size has been tuned every later run uses them without being told
+# to. The FFT length and interpolation also change the result slightly, so
+# they are only used when asked for with length='tuned' or
+# interpolation='tuned'
+
+_cache = {}
+
+
+def tune_file():
+	"""returns the name of the settings file, which is the environment
+	variable CT_TUNE_FILE if it is set, otherwise .ct_tune.json in the home
+	directory. If CT_TUNE_FILE is set but empty, tuning is turned off"""
+
+	filename = os.environ.get('CT_TUNE_FILE')
+	if filename is None:
+		filename = os.path.join(os.path.expanduser('~'), '.ct_tune.json')
+	return filename
+
+
+def tune_key(n, angles, dtype):
+	"""returns the key of the settings for a sinogram of angles x n samples
+	of type dtype on this machine, such as
+	'n=256 angles=256 dtype=float64 cpu=x86_64 cpus=8'"""
+
+	cpu = platform.processor() or platform.machine()
+	return 'n=%d angles=%d dtype=%s cpu=%s cpus=%d' % (n, angles, np.dtype(dtype).name, cpu, os.cpu_count() or 1)
+
+
+def load_tuning(filename=None):
+	"""returns all of the settings in filename (by default tune_file()) as a
+	dict keyed by tune_key, or an empty dict if there are none. The file is
+	only read again when it has changed"""
+
+	if filename is None:
+		filename = tune_file()
+	if not filename or not os.path.exists(filename):
+		return {}
+
+	modified = os.path.getmtime(filename)
+	if (filename not in _cache) or (_cache[filename][0] != modified):
+		with open(filename) as f:
+			_cache[filename] = (modified, json.load(f))
+	return _cache[filename][1]
+
+
+def tuned(n, angles, dtype, filename=None):
+	"""returns the settings saved for a sinogram of angles x n samples of
+	type dtype on this machine, or an empty dict if it has not been tuned"""
+
+	return load_tuning(filename).get(tune_key(n, angles, dtype), {})
+
+
+def save_tuned(n, angles, dtype, settings, filename=None):
+	"""saves settings, a dict such as that from ct_benchmark.autotune, for a
+	sinogram of angles x n samples of type dtype on this machine, keeping
+	the settings for any other sizes already in filename"""
+
+	if filename is None:
+		filename = tune_file()
+	if not filename:
+		raise ValueError('tuning is turned off as CT_TUNE_FILE is empty')
+
+	tuning = dict(load_tuning(filename))
+	tuning[tune_key(n, angles, dtype)] = settings
+
+	directory = os.path.dirname(filename)
+	if directory and not os.path.exists(directory):
+		os.makedirs(directory)
+
+	with open(filename, 'w') as f:
+		json.dump(tuning, f, indent=1)
+	_cache.pop(filename, None)
@@ -0,0 +1,184 @@
+import numpy as np
+import math
+import scipy
+from scipy import ndimage
+from scipy import interpolate
+from ct_monitor import *
+from ct_kernels import *
+
+@monitored('fast_back_project')
+def fast_back_project(sinogram, oversample=2, base=16, upsample=2, monitor=None, jit=None):
+
+	"""fast_back_project hierarchical back-projection to reconstruct CT data
+	reconstruction = fast_back_project(sinogram) back-projects the filtered
+	sinogram (angles x samples) to create the reconstructed data (samples x
+	samples), in the same way as back_project but in O(N^2 log N) rather
+	than O(N^2 angles) time.
+
+	The image is recursively split into four sub-images. The projections
+	are re-centred on each sub-image and cut down to its width, and since a
+	smaller sub-image needs fewer angles, neighbouring angles are then
+	combined in pairs. Once sub-images are base pixels wide they are
+	back-projected directly.
+
+	reconstruction = fast_back_project(sinogram, oversample, base, upsample)
+	trades accuracy for speed. Angles are only combined while there are more
+	than oversample angles for each pixel across the sub-image, and the
+	projections are resampled with upsample samples per pixel before the
+	recursion starts. Larger values are more accurate and slower: with the
+	defaults the RMS difference from back_project is at most around 2% of
+	the largest value, and with oversample=4 it is a half to a quarter of
+	that (see test_9 in ct_test_example).
+
+	fast_back_project(sinogram, jit=jit) chooses whether to use the compiled
+	kernels from ct_kernels for the interpolation and the direct
+	back-projection, which by default are used whenever numba is available.
+	Only these are compiled, and the result is the same either way to
+	within rounding. The compiled back_project is still faster up to at
+	least 1024 samples, as its cost per pixel and angle is so small. This
+	is faster than back_project without its compiled kernel, or with
+	interpolation 'spline', by a margin which grows with the size as the
+	time is O(N^2 log N): about 2x at 256 samples with numba, and from 512
+	samples without it. ct_benchmark times both, as the stages
+	fast_back_project and back_project_numpy.
+
+	sinogram can also be a stack (slices x angles x samples), in which case
+	each slice is reconstructed in turn.
+
+	The output is np.float32 if sinogram is, with the interpolation also
+	done in single precision, otherwise np.float64."""
+
+	dtype = sinogram.dtype if sinogram.dtype == np.float32 else np.float64
+	jit = use_jit(jit)
+
+	# reconstruct stacks one slice at a time
+	if sinogram.ndim > 2:
+		reconstruction = np.zeros(sinogram.shape[:-1] + (sinogram.shape[-1],), dtype=dtype)
+		for index in np.ndindex(sinogram.shape[:-2]):
+			reconstruction[index] = fast_back_project(sinogram[index], oversample, base, upsample, monitor=monitor, jit=jit)
+		return reconstruction
+
+	# get input dimensions
+	ns = sinogram.shape[1]
+	angles = sinogram.shape[0]
+
+	# angles, and weights of dtheta, as used by back_project
+	p = math.pi / 2 + np.arange(angles) * math.pi / angles
+	w = np.full(angles, math.pi / angles)
+
+	# resample each projection more finely, so that the repeated re-centring
+	# does not smooth away the high frequencies of the filtered projections
+	t = np.arange((ns - 1) * upsample + 1, dtype=dtype) / upsample
+	g = scipy.interpolate.interp1d(np.arange(0, ns, 1), sinogram.astype(dtype, copy=False), kind='cubic', assume_sorted=True, axis=-1)(t).astype(dtype, copy=False)
+
+	reconstruction = np.zeros((ns, ns), dtype=dtype)
+	_fast_back_project(g, p, w, reconstruction, oversample, base, upsample, monitor, [0, ns * ns], jit)
+
+	# ensure any data outside the reconstructed circle is set to invalid
+	xi, yi = np.meshgrid(np.arange(ns) - (ns/2) + 0.5, np.arange(ns) - (ns/2) + 0.5)
+	reconstruction[(xi ** 2 + yi ** 2) > (ns/2)**2] = -1
+
+	return reconstruction
+
+
+def _fast_back_project(g, p, w, reconstruction, oversample, base, upsample, monitor, done, jit=False):
+	"""adds the back-projection of g (angles x samples), with angles p and
+	weights w, into reconstruction, which is a view of a sub-image of the
+	whole reconstruction. The projections in g are centred on the middle of
+	the sub-image, with upsample samples per pixel. done is [pixels done,
+	total pixels] for reporting progress, and jit chooses the compiled
+	kernels."""
+
+	rows = reconstruction.shape[0]
+	columns = reconstruction.shape[1]
+	length = g.shape[1]
+
+	# the spline of the projections is found once, and shared by the
+	# quadrants
+	coefficients = _spline_rows(g, jit)
+
+	if max(rows, columns) <= base:
+
+		# back-project directly, with all angles at once
+		if jit:
+			fast_back_project_base_kernel(coefficients, _PAD, np.cos(p), np.sin(p), w, upsample, reconstruction)
+		else:
+			yi, xi = np.meshgrid(np.arange(rows) - (rows - 1) / 2, np.arange(columns) - (columns - 1) / 2, indexing='ij')
+			x0 = (xi[np.newaxis] * np.cos(p)[:, np.newaxis, np.newaxis] - yi[np.newaxis] * np.sin(p)[:, np.newaxis, np.newaxis]) * upsample + (length - 1) / 2
+			values = _interpolate_rows(coefficients, x0.reshape((len(p), -1)).astype(g.dtype, copy=False)).reshape(x0.shape)
+			reconstruction += np.tensordot(w, values, axes=1).astype(g.dtype, copy=False)
+		done[0] += rows * columns
+		monitor.progress('fast_back_project', done[0], done[1])
+		return
+
+	# split into quadrants
+	for rs, re in ((0, rows // 2), (rows // 2, rows)):
+		for cs, ce in ((0, columns // 2), (columns // 2, columns)):
+			quadrant = reconstruction[rs:re, cs:ce]
+			size = max(re - rs, ce - cs)
+
+			# re-centre each projection on the middle of the quadrant, and cut
+			# it down to the quadrant's width with a small margin
+			qy = (rs + re - 1) / 2 - (rows - 1) / 2
+			qx = (cs + ce - 1) / 2 - (columns - 1) / 2
+			shift = (qx * np.cos(p) - qy * np.sin(p)) * upsample
+			quadrant_length = int(math.ceil(size * math.sqrt(2) * upsample)) + 16
+			t = np.arange(quadrant_length) - (quadrant_length - 1) / 2
+			gq = _interpolate_rows(coefficients, (shift[:, np.newaxis] + t[np.newaxis] + (length - 1) / 2).astype(g.dtype, copy=False), jit)
+			pq = p
+			wq = w
+
+			# combine neighbouring angles while there are more than needed
+			if len(pq) > 2 * oversample * size:
+				pairs = len(pq) // 2
+				wsum = wq[0:2*pairs:2] + wq[1:2*pairs:2]
+				gsum = ((gq[0:2*pairs:2] * wq[0:2*pairs:2, np.newaxis] + gq[1:2*pairs:2] * wq[1:2*pairs:2, np.newaxis]) / wsum[:, np.newaxis]).astype(gq.dtype, copy=False)
+				psum = (pq[0:2*pairs:2] * wq[0:2*pairs:2] + pq[1:2*pairs:2] * wq[1:2*pairs:2]) / wsum
+				if len(pq) % 2:
+					wsum = np.append(wsum, wq[-1])
+					gsum = np.concatenate((gsum, gq[-1:]))
+					psum = np.append(psum, pq[-1])
+				gq, pq, wq = gsum, psum, wsum
+
+			_fast_back_project(gq, pq, wq, quadrant, oversample, base, upsample, monitor, done, jit)
+
+
+# zeros padded onto each end of the projections before finding their spline
+_PAD = 3
+
+
+def _spline_rows(g, jit=False):
+	"""returns the cubic B-spline coefficients of each row of g (angles x
+	samples), padded with _PAD zeros at each end so that the rows can be
+	treated as one long signal without interpolating between them"""
+
+	angles, length = g.shape
+	if jit:
+		coefficients = np.empty((angles, length + 2 * _PAD), dtype=g.dtype)
+		spline_filter_rows_kernel(g, _PAD, coefficients)
+		return coefficients
+
+	padded = np.zeros((angles, length + 2 * _PAD), dtype=g.dtype)
+	padded[:, _PAD:_PAD + length] = g
+	return scipy.ndimage.spline_filter1d(padded, order=3, axis=1, output=g.dtype)
+
+
+def _interpolate_rows(coefficients, x, jit=False):
+	"""returns the cubic spline interpolation of each row of the
+	projections whose coefficients are from _spline_rows, at the positions
+	in the same row of x (angles x points), in samples, with zero outside
+	each row"""
+
+	angles = coefficients.shape[0]
+	length = coefficients.shape[1] - 2 * _PAD
+
+	if jit:
+		values = np.empty(x.shape, dtype=coefficients.dtype)
+		spline_rows_kernel(coefficients, x, _PAD, values)
+		return values
+
+	positions = x + _PAD + (np.arange(angles) * (length + 2 * _PAD))[:, np.newaxis]
+	values = scipy.ndimage.map_coordinates(coefficients.ravel(), [positions.ravel()], order=3, mode='nearest', prefilter=False, output=coefficients.dtype).reshape(x.shape)
+	values[(x < 0) | (x > length - 1)] = 0
+
+	return values
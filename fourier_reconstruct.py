@@ -0,0 +1,216 @@
+import math
+import numpy as np
+import scipy.fft
+from ct_monitor import *
+
+@monitored('fourier_reconstruct')
+def fourier_reconstruct(sinogram, scale, alpha=0.001, oversample=2, width=6, monitor=None):
+
+	""" Direct Fourier reconstruction of CT data
+	reconstruction = fourier_reconstruct(sinogram, scale) reconstructs the
+	calibrated (not ramp filtered) sinogram (angles x samples) to create the
+	reconstructed data (samples x samples), in the same units as
+	back_project(ramp_filter(sinogram, scale)).
+
+	By the Fourier slice theorem the 1D FFT of each projection is a line
+	through the middle of the 2D FFT of the image. The FFTs of all of the
+	projections are taken in one batched call, weighted for the density of
+	the polar samples (which is the same as the Ram-Lak filter, with the
+	raised-cosine power alpha) and gridded onto a Cartesian frequency grid
+	oversample times the image size using a Kaiser-Bessel kernel width grid
+	points wide. A single inverse 2D FFT, divided by the transform of the
+	kernel, then gives the image in O(N^2 log N) time.
+
+	Larger oversample and width are more accurate and slower.
+
+	sinogram can also be a stack (slices x angles x samples), in which case
+	each slice is reconstructed in turn. If sinogram is np.float32 the FFTs
+	are done in single precision and the output is np.float32.
+
+	monitor is an optional ct_monitor.Monitor which is told about the
+	progress, time and memory used."""
+
+	# get input dimensions
+	ns = sinogram.shape[-1]
+	angles = sinogram.shape[-2]
+	dtype = sinogram.dtype if sinogram.dtype == np.float32 else np.float64
+	complex_dtype = np.complex64 if dtype == np.float32 else np.complex128
+
+	# pad projections to at least twice their length, as for ramp_filter
+	m = int(2 ** np.ceil(np.log(2*ns-1) / np.log(2)))
+
+	# radial frequencies (cycles per pixel) and angles of each polar sample,
+	# using the same angles as back_project
+	rho = np.fft.fftfreq(m)
+	p = math.pi / 2 + np.arange(angles) * math.pi / angles
+
+	# density compensation, which is |rho| drho dtheta with the same digital
+	# correction and raised-cosine as ramp_filter, and also converts the
+	# path lengths in the sinogram from cm to pixels
+	weight = np.abs(rho)
+	weight[0] = weight[1] / 6
+	weight = weight * np.power(np.cos(np.pi * rho), alpha) * (math.pi / angles) / (m * scale)
+
+	# the projections are sampled at t = j - ns/2 + 0.5, so shift the phase
+	# of each FFT to have t = 0 at the centre of rotation
+	weight = weight * np.exp(2j * np.pi * rho * ((ns / 2) - 0.5))
+
+	# 1D FFT of every projection in one call
+	projections = scipy.fft.fft(sinogram.astype(dtype, copy=False), m, axis=-1) * weight.astype(complex_dtype)
+
+	# Cartesian grid positions of the polar samples, in grid points
+	grid = oversample * ns
+	kx = (np.cos(p)[:, np.newaxis] * rho[np.newaxis, :] * grid).ravel()
+	ky = (-np.sin(p)[:, np.newaxis] * rho[np.newaxis, :] * grid).ravel()
+
+	beta = _beta(oversample, width)
+
+	# grid indices and kernel weights of each sample along each axis
+	xindex, xkernel = _kernel(kx, grid, width, beta)
+	yindex, ykernel = _kernel(ky, grid, width, beta)
+
+	# transform of the kernel, for the output pixels x = c - ns/2 + 0.5
+	x = np.arange(ns) - (ns / 2) + 0.5
+	deapodize = _kernel_transform(x, grid, width, beta)
+	deapodize = 1 / (deapodize[:, np.newaxis] * deapodize[np.newaxis, :])
+
+	# offset of the output pixels from the nearest grid points, which is
+	# applied as a phase shift before the inverse FFT
+	shift = x[0] - math.floor(x[0])
+	u = np.fft.fftfreq(grid) * grid
+	phase = np.exp(2j * np.pi * u * shift / grid)
+	phase = phase[:, np.newaxis] * phase[np.newaxis, :]
+	pixels = np.arange(ns) + math.floor(x[0])
+
+	reconstruction = np.zeros(sinogram.shape[:-2] + (ns, ns), dtype=dtype)
+	slices = list(np.ndindex(sinogram.shape[:-2]))
+	for i, index in enumerate(slices):
+
+		# spread each sample onto the grid, one kernel offset at a time
+		samples = projections[index].ravel()
+		spectrum = np.zeros(grid * grid, dtype=np.complex128)
+		for dy in range(width):
+			for dx in range(width):
+				position = yindex[dy] * grid + xindex[dx]
+				values = samples * (ykernel[dy] * xkernel[dx])
+				spectrum.real += np.bincount(position, values.real, grid * grid)
+				spectrum.imag += np.bincount(position, values.imag, grid * grid)
+
+		# inverse 2D FFT, keeping the output pixels
+		image = scipy.fft.ifft2((spectrum.reshape((grid, grid)) * phase).astype(complex_dtype)) * (grid * grid)
+		reconstruction[index] = np.real(image[np.ix_(pixels % grid, pixels % grid)]) * deapodize
+
+		monitor.progress('fourier_reconstruct', i + 1, len(slices))
+
+	monitor.count('fourier_reconstruct', projections.nbytes + 3 * 16 * grid * grid + reconstruction.nbytes, 5)
+
+	# ensure any data outside the reconstructed circle is set to invalid
+	xi, yi = np.meshgrid(x, x)
+	reconstruction[..., (xi ** 2 + yi ** 2) > (ns/2)**2] = -1
+
+	return reconstruction
+
+
+@monitored('fourier_project')
+def fourier_project(image, p, oversample=2, width=6, monitor=None):
+
+	""" Forward projection using the Fourier slice theorem
+	depth = fourier_project(image, p) returns the sum of image (n x n) along
+	the rays at each of the angles in p, giving depth (angles x n). The rays
+	are the same as those of ct_scan, so that depth[a, j] is the sum along
+	the line x cos(p[a]) + y sin(p[a]) = j - n/2 + 0.5, where x and y are the
+	column and row relative to the middle of the image.
+
+	By the Fourier slice theorem the 1D FFT of each projection is a line
+	through the middle of the 2D FFT of the image. A single 2D FFT of the
+	image, oversample times its size and divided by the transform of the
+	kernel, is interpolated at the polar samples of every angle at once
+	using a Kaiser-Bessel kernel width grid points wide, and batched inverse
+	1D FFTs then give the projections in O(N^2 log N) time rather than
+	O(N^2 angles) for ct_scan.
+
+	image can also be a stack (slices x n x n), in which case depth is
+	(slices x angles x n) and all slices are transformed together. If image
+	is np.float32 the FFTs are done in single precision and depth is
+	np.float32."""
+
+	# get input dimensions
+	n = image.shape[-1]
+	p = np.asarray(p, dtype=float)
+	dtype = image.dtype if image.dtype == np.float32 else np.float64
+	complex_dtype = np.complex64 if dtype == np.float32 else np.complex128
+
+	# radial frequencies (cycles per pixel), enough for the projections of
+	# the whole image not to wrap around
+	m = int(2 ** np.ceil(np.log(2*n-1) / np.log(2)))
+	rho = np.fft.fftfreq(m)
+
+	grid = oversample * n
+	beta = _beta(oversample, width)
+
+	# pixel positions relative to the middle of the image, and the grid
+	# points and phase shift which place them on the oversampled grid
+	x = np.arange(n) - (n / 2) + 0.5
+	shift = x[0] - math.floor(x[0])
+	pixels = (np.arange(n) + math.floor(x[0])) % grid
+	u = np.fft.fftfreq(grid) * grid
+	phase = np.exp(-2j * np.pi * u * shift / grid)
+
+	# divide by the transform of the kernel, and take one 2D FFT per slice
+	deapodize = _kernel_transform(x, grid, width, beta)
+	padded = np.zeros(image.shape[:-2] + (grid, grid), dtype=dtype)
+	padded[..., pixels[:, np.newaxis], pixels[np.newaxis, :]] = image / (deapodize[:, np.newaxis] * deapodize[np.newaxis, :])
+	spectrum = scipy.fft.fft2(padded) * (phase[:, np.newaxis] * phase[np.newaxis, :]).astype(complex_dtype)
+	spectrum = spectrum.reshape(image.shape[:-2] + (grid * grid,))
+
+	# Cartesian grid positions of the polar samples, in grid points
+	kx = (np.cos(p)[:, np.newaxis] * rho[np.newaxis, :] * grid).ravel()
+	ky = (np.sin(p)[:, np.newaxis] * rho[np.newaxis, :] * grid).ravel()
+	xindex, xkernel = _kernel(kx, grid, width, beta)
+	yindex, ykernel = _kernel(ky, grid, width, beta)
+
+	# interpolate the samples of every angle from the grid, one kernel
+	# offset at a time
+	samples = np.zeros(image.shape[:-2] + (len(kx),), dtype=complex_dtype)
+	for dy in range(width):
+		for dx in range(width):
+			samples += spectrum[..., yindex[dy] * grid + xindex[dx]] * (ykernel[dy] * xkernel[dx]).astype(dtype)
+	samples = samples.reshape(image.shape[:-2] + (len(p), m))
+
+	# shift the phase so that the projections start at t = -n/2 + 0.5, then
+	# take the inverse FFT of all of the projections in one call
+	samples *= np.exp(2j * np.pi * rho * x[0]).astype(complex_dtype)
+	depth = np.real(scipy.fft.ifft(samples, axis=-1)[..., :n]).astype(dtype)
+
+	monitor.count('fourier_project', padded.nbytes + 2 * spectrum.nbytes + 2 * samples.nbytes, 5)
+
+	return depth
+
+
+def _beta(oversample, width):
+	"""returns the Kaiser-Bessel shape parameter suggested by Beatty et al.
+	(2005) for a grid oversample times the image size"""
+
+	return math.pi * math.sqrt(max(pow(width / oversample, 2) * pow(oversample - 0.5, 2) - 0.8, 0))
+
+
+def _kernel(k, grid, width, beta):
+	"""returns the grid indices (width x samples), wrapped to the FFT order
+	of a grid with grid points, and the Kaiser-Bessel weights of each sample
+	at positions k, in grid points"""
+
+	start = np.floor(k - width / 2).astype(int) + 1
+	index = start[np.newaxis, :] + np.arange(width)[:, np.newaxis]
+	distance = index - k[np.newaxis, :]
+	kernel = np.i0(beta * np.sqrt(np.maximum(1 - pow(2 * distance / width, 2), 0)))
+	kernel[np.abs(distance) > width / 2] = 0
+
+	return index % grid, kernel
+
+
+def _kernel_transform(x, grid, width, beta):
+	"""returns the Fourier transform of the Kaiser-Bessel kernel at the
+	pixel positions x, for a frequency grid of grid points"""
+
+	z = np.sqrt((pow(beta, 2) - pow(np.pi * width * x / grid, 2)).astype(complex))
+	return width * np.real(np.sinh(z) / z)
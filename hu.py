@@ -1,16 +1,66 @@
+import math
 import numpy as np
 from attenuate import *
 from ct_calibrate import *
+from ct_lib import *
 
-def hu(p, material, reconstruction, scale):
+def hu(p, material, reconstruction, scale, out=None, pixels=None, calibrated=True, fov=False):
 	""" convert CT reconstruction output to Hounsfield Units
 	calibrated = hu(p, material, reconstruction, scale) converts the reconstruction into Hounsfield
-	Units, using the material coefficients, photon energy p and scale given."""
+	Units, using the material coefficients, photon energy p and scale given.
 
-	# use result to convert to hounsfield units
-	reconstruction = (reconstruction - 1) * 1000 
+	Water is taken as water_coefficient(p, material), its attenuation in
+	cm^-1 at the effective energy of p. If calibrated is False, the
+	reconstruction is the attenuation in cm^-1, as from ct_calibrate with
+	correct=False. Otherwise it is from a calibrated sinogram, in which
+	ct_calibrate converts each detection to the depth of water which would
+	give it, so its unit is the attenuation of water at that same effective
+	energy and water is exactly one.
 
-	# limit minimum to -1024, which is normal for CT data.
-	reconstruction[reconstruction < -1024] = -1024
+	This is done as one pass over each slice, in place where possible:
+	out can be an existing array for the output, which can be
+	reconstruction itself, and pixels can be a uint16 array of the same
+	shape which is also given the DICOM pixel values from dicom_pixels. If
+	fov is True, pixels outside the reconstructed circle are set to -1024,
+	using the cached mask from fov_mask, so the reconstruction does not
+	need to have been masked by back_project. reconstruction can be a single
+	image or a whole volume (slices x rows x columns)."""
 
-	return reconstruction
\ No newline at end of file
+	# water and the unit of reconstruction, both in cm^-1, so that
+	# HU = 1000 (reconstruction * unit - water) / water
+	water = water_coefficient(p, material)
+	unit = water if calibrated else 1.0
+	water = water / unit
+
+	if out is None:
+		out = np.empty(reconstruction.shape, dtype=reconstruction.dtype if reconstruction.dtype == np.float32 else np.float64)
+	if fov:
+		outside = ~fov_mask(reconstruction.shape[-1])
+
+	for index in np.ndindex(reconstruction.shape[:-2]):
+		image = out[index]
+
+		# use result to convert to hounsfield units
+		np.subtract(reconstruction[index], water, out=image)
+		image *= 1000 / water
+
+		# limit minimum to -1024, which is normal for CT data.
+		np.maximum(image, -1024, out=image)
+		if fov:
+			image[outside] = -1024
+
+		if pixels is not None:
+			dicom_pixels(image, out=pixels[index])
+
+	return out
+
+
+def water_coefficient(p, material, depth=20):
+	"""returns the effective linear attenuation coefficient of water in
+	cm^-1 for the source energies p, which is that of the energy at which a
+	single energy source is attenuated as much as p by depth cm of water"""
+
+	energy = np.flatnonzero(p)
+	transmitted = np.sum(p[energy] * np.exp(-material.coeff('Water')[energy] * depth)) / np.sum(p[energy])
+
+	return -math.log(transmitted) / depth
@@ -0,0 +1,103 @@
+import numpy as np
+from ramp_filter import *
+from back_project import *
+from back_project import _back_project_grid
+from ct_kernels import *
+from ct_monitor import *
+
+
+class IncrementalReconstruction(object):
+	def __init__(self, ns, angles, scale, alpha=0.001, slices=None, jit=None, monitor=None, dtype=np.float64):
+		"""IncrementalReconstruction builds up a filtered back-projection as
+		the projections arrive, rather than waiting for the whole sinogram.
+
+		r = IncrementalReconstruction(ns, angles, scale) reconstructs a
+		sinogram of angles angles in 180 degrees, each of ns samples, with
+		the same angles, filtering and output as back_project(ramp_filter(
+		sinogram, scale)). alpha is the raised-cosine power for ramp_filter.
+
+		If slices is given, each projection is instead (slices x ns), such
+		as one angle of every scan from Xtreme.get_rsq_scan once it has been
+		calibrated, and the output is (slices x ns x ns).
+
+		Projections are given to add, in any order, and each is filtered and
+		back-projected into a running total straight away. image() returns
+		the reconstruction from the angles added so far at any time, without
+		recomputing them.
+
+		jit, monitor and dtype are used as for back_project."""
+
+		self.ns = ns
+		self.angles = angles
+		self.scale = scale
+		self.alpha = alpha
+		self.slices = slices
+		self.jit = use_jit(jit)
+		self.monitor = get_monitor(monitor)
+		self.dtype = np.float32 if dtype == np.float32 else np.float64
+
+		# which angles have been added, and the running total
+		self.added = np.zeros(angles, dtype=bool)
+		self.xs, self.ys = output_grid(ns)
+		shape = (ns, ns) if slices is None else (slices, ns, ns)
+		self.total = np.zeros(shape, dtype=self.dtype)
+
+	def add(self, projection, angle):
+		"""adds projection, the calibrated (not filtered) projection at angle
+		index angle (0 to angles-1). projection can also be a block of
+		consecutive angles starting at angle, which is (block x ns), or
+		(slices x block x ns) if slices was given."""
+
+		single = 1 if self.slices is None else 2
+		projection = np.asarray(projection)
+		if projection.ndim == single:
+			projection = projection[..., np.newaxis, :]
+		elif projection.ndim != single + 1:
+			raise ValueError('projection has ' + str(projection.ndim) + ' dimensions, expected ' + str(single) + ' or ' + str(single + 1))
+		if projection.shape[-1] != self.ns:
+			raise ValueError('projection has ' + str(projection.shape[-1]) + ' samples, expected ' + str(self.ns))
+
+		block = projection.shape[-2]
+		if (angle < 0) or (angle + block > self.angles):
+			raise ValueError('angles ' + str(angle) + ' to ' + str(angle + block - 1) + ' are not within 0 to ' + str(self.angles - 1))
+		if self.added[angle:angle + block].any():
+			raise ValueError('angles ' + str(angle) + ' to ' + str(angle + block - 1) + ' have already been added')
+
+		with self.monitor.stage('incremental_reconstruction'):
+
+			# each row is filtered on its own, so filtering as they arrive is
+			# the same as filtering the whole sinogram
+			filtered = ramp_filter(projection.astype(self.dtype, copy=False), self.scale, self.alpha)
+
+			_back_project_grid(filtered, self.xs, self.ys, self.total, self.jit, None, first=angle, total=self.angles, mask=False)
+
+		self.added[angle:angle + block] = True
+		self.monitor.progress('incremental_reconstruction', self.count(), self.angles)
+
+	def count(self):
+		"""returns the number of angles added so far"""
+
+		return int(np.sum(self.added))
+
+	def complete(self):
+		"""returns True once every angle has been added"""
+
+		return bool(self.added.all())
+
+	def image(self, normalise=True):
+		"""returns the reconstruction from the angles added so far. If
+		normalise is True, this is scaled by the fraction of angles which
+		have been added, so that a partial reconstruction has roughly the
+		right values. Once every angle has been added this is the same as
+		back_project."""
+
+		reconstruction = self.total.copy()
+		count = self.count()
+		if normalise and (count > 0):
+			reconstruction *= self.angles / count
+
+		# ensure any data outside the reconstructed circle is set to invalid
+		xi, yi = np.meshgrid(self.xs, self.ys)
+		reconstruction[..., (xi ** 2 + yi ** 2) > (self.ns/2)**2] = -1
+
+		return reconstruction
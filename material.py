@@ -57,4 +57,26 @@ class Material(object):
 
 		# return the appropriate coeff
 		index = self.name.index(input)
-		return self.coeffs[index]
\ No newline at end of file
+		return self.coeffs[index]
+
+
+	def table(self, mev, quantity='attenuation'):
+		"""Given a photon energy in mev, this returns a lookup table with one
+		value for every material, so that table[phantom] converts a label
+		phantom from ct_phantom in a single step. The nearest tabulated
+		energy is used, and quantity can be:
+			'attenuation' - linear attenuation coefficients
+			'relative' - attenuation relative to water, as reconstructed
+			'hu' - Hounsfield Units, limited to -1024 as by hu"""
+
+		values = self.coeffs[:, np.argmin(np.abs(self.mev - mev))]
+		if quantity == 'attenuation':
+			return values
+
+		relative = values / values[self.name.index('Water')]
+		if quantity == 'relative':
+			return relative
+		if quantity == 'hu':
+			return np.maximum((relative - 1) * 1000, -1024)
+
+		raise ValueError('quantity should be attenuation, relative or hu, got ' + str(quantity))
\ No newline at end of file
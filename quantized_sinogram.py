@@ -0,0 +1,113 @@
+import numpy as np
+
+
+class QuantizedSinogram(object):
+	def __init__(self, data, scale=1.0, offset=0.0, kind='counts', dtype=np.float64):
+		"""QuantizedSinogram is a compact sinogram held as integers, such as
+		uint16 or uint32 detector counts, or the log of the counts as int16,
+		rather than as float64. The values it represents are
+
+			data * scale + offset
+
+		kind is 'counts' if the values are detector counts, as from ct_scan
+		or Xtreme.get_rsq_slice, or 'log' if they are the natural log of the
+		counts, which keeps the same relative precision for high and low
+		counts. ct_calibrate accepts either, and converts them a block of
+		angles at a time rather than widening the whole sinogram at once.
+
+		sinogram[index] returns the values at index as dtype, and
+		sinogram[index] = values quantizes values into the data. Values
+		outside the range of the integer type are clipped.
+
+		Quantized sinograms are made with quantize_sinogram, or with
+		empty_sinogram and filled as they are scanned."""
+
+		if kind not in ('counts', 'log'):
+			raise ValueError('kind should be counts or log, got ' + str(kind))
+		if not np.issubdtype(data.dtype, np.integer):
+			raise ValueError('data should be an integer type, got ' + str(data.dtype))
+
+		self.data = data
+		self.scale = float(scale)
+		self.offset = float(offset)
+		self.kind = kind
+		self.dtype = np.dtype(dtype)
+
+	@property
+	def shape(self):
+		return self.data.shape
+
+	@property
+	def ndim(self):
+		return self.data.ndim
+
+	@property
+	def nbytes(self):
+		return self.data.nbytes
+
+	def __len__(self):
+		return len(self.data)
+
+	def __getitem__(self, index):
+		values = self.data[index].astype(self.dtype)
+		values *= self.dtype.type(self.scale)
+		values += self.dtype.type(self.offset)
+		return values
+
+	def __setitem__(self, index, values):
+		limits = np.iinfo(self.data.dtype)
+		q = np.rint((np.asarray(values, dtype=np.float64) - self.offset) / self.scale)
+		self.data[index] = np.clip(q, limits.min, limits.max)
+
+	def __array__(self, dtype=None, copy=None):
+		values = self[...]
+		return values if dtype is None else values.astype(dtype)
+
+	def subset(self, index):
+		"""returns a QuantizedSinogram of part of this one, such as a single
+		slice of a stack, which shares the same data"""
+
+		return QuantizedSinogram(self.data[index], self.scale, self.offset, self.kind, self.dtype)
+
+
+def empty_sinogram(shape, kind='counts', lower=0, upper=1, storage=None, dtype=np.float64):
+
+	""" Create an empty QuantizedSinogram
+	sinogram = empty_sinogram(shape, kind, lower, upper) creates a zero
+	QuantizedSinogram of the given shape, whose integer steps evenly cover
+	the values from lower to upper.
+
+	storage is the integer type, which defaults to np.uint32 for 'counts'
+	and np.int16 for 'log', and dtype is the floating point type returned
+	when the sinogram is read."""
+
+	if storage is None:
+		storage = np.uint32 if kind == 'counts' else np.int16
+	limits = np.iinfo(storage)
+
+	scale = (upper - lower) / (float(limits.max) - float(limits.min))
+	if scale <= 0:
+		scale = 1.0
+	offset = lower - limits.min * scale
+
+	return QuantizedSinogram(np.zeros(shape, dtype=storage), scale, offset, kind, dtype)
+
+
+def quantize_sinogram(sinogram, kind='counts', storage=None, dtype=None):
+
+	""" Quantize a sinogram
+	q = quantize_sinogram(sinogram) returns a QuantizedSinogram of the
+	detector counts in sinogram (angles x samples, or a stack of them), using
+	the range of its values. q = quantize_sinogram(np.log(sinogram), 'log')
+	instead keeps the log of the counts, for which int16 is enough.
+
+	storage is the integer type, as for empty_sinogram, and dtype is the
+	floating point type returned when q is read, which defaults to that of
+	sinogram."""
+
+	if dtype is None:
+		dtype = sinogram.dtype if sinogram.dtype == np.float32 else np.float64
+
+	q = empty_sinogram(sinogram.shape, kind, np.min(sinogram), np.max(sinogram), storage, dtype)
+	q[...] = sinogram
+	return q
@@ -1,29 +1,57 @@
 import math
 import numpy as np
+import scipy.fft
 import numpy.matlib
 import matplotlib.pyplot as plt
+from ct_monitor import *
+from ct_tune import *
 
-def ramp_filter(sinogram, scale, alpha=0.001):
+@monitored('ramp_filter')
+def ramp_filter(sinogram, scale, alpha=0.001, monitor=None, length='pow2'):
 	""" Ram-Lak filter with raised-cosine for CT reconstruction
 
 	fs = ramp_filter(sinogram, scale) filters the input in sinogram (angles x samples)
 	using a Ram-Lak filter.
 
 	fs = ramp_filter(sinogram, scale, alpha) can be used to modify the Ram-Lak filter by a
-	cosine raised to the power given by alpha."""
+	cosine raised to the power given by alpha.
+
+	sinogram can also be a stack (slices x angles x samples), in which case
+	every row is filtered in the same batched FFT.
+
+	If sinogram is np.float32 the FFTs are done in single precision
+	(np.complex64) and the output is np.float32, otherwise np.float64.
+
+	The filter is at least twice as long as the input. length can be 'pow2',
+	the next power of two, which is the default, or 'fast', the next length
+	which scipy.fft transforms quickly, which is often shorter. The two
+	differ slightly in the result, by about 2e-4 relative, so the length
+	chosen by ct_benchmark.autotune for the size of sinogram is only used if
+	length is 'tuned' (falling back to 'pow2' if it has not been tuned).
+
+	monitor is an optional ct_monitor.Monitor which is told about the time
+	and memory used, and the length used."""
 
 	# get input dimensions
-	angles = sinogram.shape[0]
-	n = sinogram.shape[1]
+	n = sinogram.shape[-1]
+	dtype = sinogram.dtype if sinogram.dtype == np.float32 else np.float64
 
 	# set up filter to be at least twice as long as input
-	m = np.ceil(np.log(2*n-1) / np.log(2))
-	m = int(2 ** m)
-
-	print('Ramp filtering')
+	if length == 'tuned':
+		angles = sinogram.shape[-2] if sinogram.ndim > 1 else 1
+		length = tuned(n, angles, dtype).get('fft_length', 'pow2')
+	monitor.note('ramp_filter', fft_length=length)
+	if length == 'pow2':
+		m = np.ceil(np.log(2*n-1) / np.log(2))
+		m = int(2 ** m)
+	elif length == 'fast':
+		m = scipy.fft.next_fast_len(2*n-1, real=True)
+	else:
+		raise ValueError('length should be pow2, fast or tuned, got ' + str(length))
 
 	# initialise frequency array and set max frequency to nyquist frequency
-	f = np.fft.fftfreq(m)
+	# only the non-negative frequencies are needed for a real input
+	f = np.fft.rfftfreq(m)
 	f_max = 1 / (2 * scale)
 
 	# digital correction
@@ -31,14 +59,17 @@ def ramp_filter(sinogram, scale, alpha=0.001):
 
 	# Ram-Lak filter with raised_cosine
 	filter = 2 * f_max * np.abs(f) * np.power(np.cos(np.pi/2 * f / f_max), alpha)
+	filter = filter.astype(dtype)
 
 	# compute fft of sinogram
-	freq_distribution = np.fft.fft(sinogram, m, axis=1)
+	freq_distribution = scipy.fft.rfft(sinogram.astype(dtype, copy=False), m, axis=-1)
 	
 	# filter implementation
 	freq_distribution *= filter
 
 	# compute filtered sinogram
-	sinogram = np.real(np.fft.ifft(freq_distribution, axis=1))[:, :n]
+	sinogram = scipy.fft.irfft(freq_distribution, m, axis=-1)[..., :n]
+
+	monitor.count('ramp_filter', 2 * freq_distribution.nbytes + sinogram.nbytes, 3)
 
 	return sinogram
\ No newline at end of file
@@ -0,0 +1,148 @@
+import glob
+import os
+import numpy as np
+import pydicom
+from concurrent.futures import ThreadPoolExecutor
+
+
+def read_dicom(directory, pattern='*.dcm', threads=None, out=None, mmap_file=None, dtype=np.float32):
+
+	""" Read a DICOM series back into a single volume of Hounsfield Units
+
+	x = read_dicom(directory) reads every file matching `*.dcm' in directory,
+	as written by create_dicom or create_dicom_volume, and returns the data
+	in x (slices x rows x columns) in Hounsfield Units, ordered by the
+	position of each slice along the z-axis.
+
+	Only the headers are read to sort the slices, using ImagePositionPatient,
+	or SliceLocation or InstanceNumber if that is not present. The frames of
+	a multi-frame file are placed using the position of each frame in an
+	enhanced file, or otherwise SpacingBetweenSlices (or SliceThickness)
+	from the position of the first. The pixel data of each file is then
+	decoded once, by a pool of threads (os.cpu_count() if threads is not
+	given), and each of its frames is copied straight into its place in the
+	output, where RescaleSlope and RescaleIntercept are applied.
+
+	x = read_dicom(directory, pattern, threads, out) decodes into the existing
+	array out, which must have the correct shape. x = read_dicom(directory,
+	mmap_file=filename) instead creates out as a memory-mapped .npy file,
+	which can later be opened with ct_lib.load_numpy_array."""
+
+	# find series files, which can also be given as a single file
+	if os.path.isfile(directory):
+		files = [directory]
+	else:
+		files = sorted(glob.glob(os.path.join(directory, pattern)))
+	if len(files) == 0:
+		raise Exception('No DICOM files named ' + os.path.join(directory, pattern))
+
+	if threads is None:
+		threads = os.cpu_count()
+
+	with ThreadPoolExecutor(max_workers=threads) as pool:
+
+		# read headers only and expand any multi-frame files into frames
+		headers = pool.map(lambda f: pydicom.dcmread(f, stop_before_pixels=True), files)
+		frames = []
+		for filename, ds in zip(files, headers):
+			frames.extend(_frames(filename, ds))
+
+		# sort by position along the z-axis
+		frames.sort(key=lambda frame: frame[2])
+
+		rows = frames[0][3]
+		columns = frames[0][4]
+		for frame in frames:
+			if (frame[3] != rows) or (frame[4] != columns):
+				raise ValueError('DICOM series contains slices of different sizes')
+		shape = (len(frames), rows, columns)
+
+		# create output
+		if out is None:
+			if mmap_file is None:
+				out = np.empty(shape, dtype=dtype)
+			else:
+				out = np.lib.format.open_memmap(mmap_file, mode='w+', dtype=dtype, shape=shape)
+		elif out.shape != shape:
+			raise ValueError('input out has shape ' + str(out.shape) + ', expected ' + str(shape))
+
+		# the place in the output of each frame of each file
+		places = {}
+		for z, (filename, index, position, r, c, slope, intercept) in enumerate(frames):
+			places.setdefault(filename, {})[index] = z
+
+		# decode each file once, and each of its frames straight into its
+		# place in the output
+		def decode(filename):
+			for index, pixels in enumerate(_read_frames(filename)):
+				z = places[filename][index]
+				slope, intercept = frames[z][5:7]
+				np.multiply(pixels, slope, out=out[z], casting='unsafe')
+				out[z] += intercept
+
+		list(pool.map(decode, places))
+
+	return out
+
+
+def _frames(filename, ds):
+	"""returns (filename, frame index, z position, rows, columns, slope,
+	intercept) for every frame in the file with header ds"""
+
+	rows = int(ds.Rows)
+	columns = int(ds.Columns)
+	frames = int(ds.get('NumberOfFrames', 1))
+
+	if 'PerFrameFunctionalGroupsSequence' in ds:
+
+		# enhanced multi-frame image
+		shared = ds.SharedFunctionalGroupsSequence[0]
+		output = []
+		for index, group in enumerate(ds.PerFrameFunctionalGroupsSequence):
+			position = _position(group.PlanePositionSequence[0]) if 'PlanePositionSequence' in group else index
+			if 'PixelValueTransformationSequence' in group:
+				slope, intercept = _rescale(group.PixelValueTransformationSequence[0])
+			elif 'PixelValueTransformationSequence' in shared:
+				slope, intercept = _rescale(shared.PixelValueTransformationSequence[0])
+			else:
+				slope, intercept = _rescale(ds)
+			output.append((filename, index, position, rows, columns, slope, intercept))
+		return output
+
+	# frames of other multi-frame images are evenly spaced from the first
+	slope, intercept = _rescale(ds)
+	spacing = float(ds.get('SpacingBetweenSlices', ds.get('SliceThickness', 1)) or 1)
+	return [(filename, index, _position(ds) + index * spacing, rows, columns, slope, intercept) for index in range(frames)]
+
+
+def _position(ds):
+	"""returns the z-axis position of a slice from its header"""
+
+	if 'ImagePositionPatient' in ds:
+		return float(ds.ImagePositionPatient[2])
+	if 'SliceLocation' in ds:
+		return float(ds.SliceLocation)
+	return float(ds.get('InstanceNumber', 0))
+
+
+def _rescale(ds):
+	"""returns the slope and intercept which convert stored values to HU"""
+
+	return float(ds.get('RescaleSlope', 1)), float(ds.get('RescaleIntercept', 0))
+
+
+def _read_frames(filename):
+	"""yields the decoded pixel data of each frame in a DICOM file in turn,
+	reading the file once"""
+
+	# newer versions of pydicom can decode one frame at a time
+	try:
+		from pydicom.pixels import iter_pixels
+	except ImportError:
+		pixels = pydicom.dcmread(filename).pixel_array
+		if pixels.ndim == 2:
+			pixels = pixels[np.newaxis]
+		yield from pixels
+		return
+
+	yield from iter_pixels(filename)
@@ -3,34 +3,218 @@ from ct_calibrate import *
 from ct_lib import *
 from ramp_filter import *
 from back_project import *
+from fast_back_project import *
+from fourier_reconstruct import *
 from hu import *
+from binning import *
+import os
+import threading
+import warnings
+from concurrent.futures import ThreadPoolExecutor
 
-def scan_and_reconstruct(photons, material, phantom, scale, angles, mas=10000, alpha=0.001):
+def scan_and_reconstruct(photons, material, phantom, scale, angles, mas=10000, alpha=0.001, monitor=None, dtype=np.float64, engine='back_project', preview=None, quantize=None, noise=True, rng=None, fidelity=1, threshold=None):
 
 	""" Simulation of the CT scanning process
 		reconstruction = scan_and_reconstruct(photons, material, phantom, scale, angles, mas, alpha)
 		takes the phantom data in phantom (samples x samples), scans it using the
 		source photons and material information given, as well as the scale (in cm),
 		number of angles, time-current product in mas, and raised-cosine power
-		alpha for filtering. The output reconstruction is the same size as phantom."""
+		alpha for filtering. The output reconstruction is the same size as phantom.
 
+		monitor is an optional ct_monitor.Monitor, which is given the progress of
+		each stage. Once the reconstruction is complete, monitor.report() has the
+		time and memory of each stage, and this is also passed to the monitor's
+		report function.
 
-	# convert source (photons per (mas, cm^2)) to photons
-	photons = photons * mas * pow(scale, 2)
+		dtype can be np.float32 to keep the material phantoms, coordinates,
+		sinograms, FFTs (as np.complex64) and reconstruction in single
+		precision. This halves the memory used, and changes the reconstructed
+		attenuation by 1e-5 or less, which is far below the errors checked in
+		ct_test_example (see test_8).
 
-	# create sinogram from phantom data, with received detector values
-	sinogram = ct_scan(photons, material, phantom, scale, angles, mas)
+		engine chooses how the sinogram is reconstructed:
+			'back_project' - ramp_filter and back_project (the default)
+			'fast_back_project' - ramp_filter and the hierarchical fast_back_project
+			'fourier' - direct Fourier reconstruction with fourier_reconstruct
+		all of which give the same units, so hu is applied in the same way.
 
-	# convert detector values into calibrated attenuation values
-	sinogram = ct_calibrate(photons, material, sinogram, scale)
+		preview is an optional function preview(image) which is given a quick
+		half resolution reconstruction in Hounsfield Units, at about 1/16 of
+		the cost of the back-projection, before the full reconstruction is
+		done (see back_project_progressive). This can be used to stop
+		runs which are not worth finishing, for example by raising an
+		exception. It can only be used with the 'back_project' engine.
 
-	# Ram-Lak
-	sinogram = ramp_filter(sinogram, scale, alpha)
+		quantize can be 'counts' or 'log' to keep the scan as a compact
+		QuantizedSinogram until it is calibrated (see ct_scan).
 
-	# Back-projection
-	phantom = back_project(sinogram)
+		noise can be False for a reconstruction without noise, for instance
+		as a reference, and rng is an optional numpy.random.Generator for the
+		noise. threshold can be given, such as 1000, to draw counts above it
+		from the faster Gaussian approximation (see ct_detect).
 
-	# convert to Hounsfield Units
-	phantom = hu(photons, material, phantom, scale)
+		fidelity can be 1/4 or 1/16 (or any 1/k^2) for a quick screening run
+		at about that fraction of the cost, for example in a parameter sweep.
+		The phantom is downsampled k times with downsample_phantom, keeping
+		the partial volumes of each material, and scanned at every angle,
+		then each k angles are binned together with bin_sinogram before the
+		reconstruction. The result is k times coarser, repeated up to the
+		size of phantom. Such runs give a ScreeningWarning, so that their
+		results are not mistaken for full reconstructions, and are flagged
+		with their fidelity in the 'scan_and_reconstruct' stage of the
+		monitor report."""
 
-	return phantom
\ No newline at end of file
+	if engine not in ('back_project', 'fast_back_project', 'fourier'):
+		raise ValueError('engine should be back_project, fast_back_project or fourier, got ' + str(engine))
+	if (preview is not None) and (engine != 'back_project'):
+		raise ValueError('preview can only be used with the back_project engine')
+
+	factor = fidelity_factor(fidelity)
+	if (factor > 1) and (angles % factor != 0):
+		raise ValueError(str(angles) + ' angles cannot be binned for a fidelity of ' + str(fidelity))
+
+	monitor = get_monitor(monitor)
+
+	with monitor.stage('scan_and_reconstruct') as record:
+
+		# a low fidelity run scans the partial volumes of larger pixels
+		if factor > 1:
+			if record is not None:
+				record['fidelity'] = fidelity
+			phantom = downsample_phantom(phantom, factor, len(material.name))
+			scale = scale * factor
+
+		# convert source (photons per (mas, cm^2)) to photons
+		photons = photons * mas * pow(scale, 2)
+
+		# create sinogram from phantom data, with received detector values
+		sinogram = ct_scan(photons, material, phantom, scale, angles, mas, monitor=monitor, dtype=dtype, quantize=quantize, noise=noise, rng=rng, fractions=factor > 1, threshold=threshold)
+
+		# keep the counts of every angle, but reconstruct fewer
+		if factor > 1:
+			sinogram, scale = bin_sinogram(sinogram, scale, 1, factor)
+
+		# convert detector values into calibrated attenuation values
+		sinogram = ct_calibrate(photons, material, sinogram, scale, monitor=monitor, noise=noise, rng=rng, threshold=threshold)
+
+		if engine == 'fourier':
+
+			# filtering is part of the direct Fourier reconstruction
+			phantom = fourier_reconstruct(sinogram, scale, alpha, monitor=monitor)
+
+		else:
+
+			# Ram-Lak
+			sinogram = ramp_filter(sinogram, scale, alpha, monitor=monitor)
+
+			# Back-projection, leaving the pixels outside the reconstructed
+			# circle for hu to set
+			if engine == 'fast_back_project':
+				phantom = fast_back_project(sinogram, monitor=monitor)
+			elif preview is not None:
+				phantom = back_project(sinogram, monitor=monitor, mask=False, preview=lambda image: preview(hu(photons, material, image, scale, fov=True)))
+			else:
+				phantom = back_project(sinogram, monitor=monitor, mask=False)
+
+		# convert to Hounsfield Units, with -1024 outside the reconstructed
+		# circle
+		with monitor.stage('hu'):
+			phantom = hu(photons, material, phantom, scale, out=phantom, fov=True)
+
+		if factor > 1:
+			phantom = np.repeat(np.repeat(phantom, factor, axis=-2), factor, axis=-1)
+
+	monitor.emit()
+
+	if factor > 1:
+		warnings.warn('reconstruction at a fidelity of ' + str(fidelity) + ' is a screening run, ' + str(factor) + ' times coarser than the phantom', ScreeningWarning, stacklevel=2)
+
+	return phantom
+
+
+def scan_and_reconstruct_volume(photons, material, phantom, scale, angles, mas=10000, alpha=0.001, workers=None, monitor=None, dtype=np.float64, store=None, quantize=None, noise=True, rng=None, threshold=None):
+
+	""" Simulation of the CT scanning process for a multi-slice volume
+		reconstruction = scan_and_reconstruct_volume(photons, material, phantom, scale, angles, mas, alpha)
+		is the same as scan_and_reconstruct, but for a phantom volume
+		(slices x samples x samples) such as that from ct_phantom_volume. The
+		output reconstruction is the same size as phantom, and can be saved
+		directly using create_dicom_volume.
+
+		All of the slices are scanned using the same rotated coordinates, then
+		calibrated and filtered together as one stack of sinograms. The
+		back-projection is shared between a pool of workers threads, which
+		defaults to os.cpu_count(). The compiled back_project kernel already
+		uses every core, so when numba is available the blocks are instead
+		back-projected one after another. monitor, dtype, quantize, noise, rng and
+		threshold are used as for scan_and_reconstruct.
+
+		store is an optional ArrayStore from ct_store, with the same shape as
+		phantom, into which each block of slices is written in Hounsfield
+		Units as soon as it is reconstructed, so that the whole volume is
+		never held in memory. The store is then returned instead of the
+		reconstruction."""
+
+	if workers is None:
+		workers = os.cpu_count()
+	if (store is not None) and (store.shape != phantom.shape):
+		raise ValueError('store has shape ' + str(store.shape) + ', expected ' + str(phantom.shape))
+
+	monitor = get_monitor(monitor)
+
+	with monitor.stage('scan_and_reconstruct_volume'):
+
+		# convert source (photons per (mas, cm^2)) to photons
+		photons = photons * mas * pow(scale, 2)
+
+		# create sinograms (slices x angles x samples) for all slices at once
+		sinogram = ct_scan(photons, material, phantom, scale, angles, mas, monitor=monitor, dtype=dtype, quantize=quantize, noise=noise, rng=rng, threshold=threshold)
+
+		# convert detector values into calibrated attenuation values
+		sinogram = ct_calibrate(photons, material, sinogram, scale, monitor=monitor, noise=noise, rng=rng, threshold=threshold)
+
+		# Ram-Lak, as one batched FFT over every row of the stack
+		sinogram = ramp_filter(sinogram, scale, alpha, monitor=monitor)
+
+		# Back-projection of contiguous blocks of slices in parallel, which
+		# is timed here as the threads cannot share the monitor
+		slices = sinogram.shape[0]
+		blocks = np.array_split(np.arange(slices), min(workers, slices))
+		if store is None:
+			reconstruction = np.zeros(phantom.shape, dtype=dtype)
+
+		# blocks may share chunks of the store, so write one at a time, and
+		# count the slices finished, as blocks may finish in any order
+		lock = threading.Lock()
+		finished = [0]
+
+		def back_project_block(block):
+			block = slice(block[0], block[-1] + 1)
+			if store is None:
+				reconstruction[block] = back_project(sinogram[block], mask=False)
+			else:
+				image = back_project(sinogram[block], mask=False)
+				hu(photons, material, image, scale, out=image, fov=True)
+				with lock:
+					store[block] = image
+			with lock:
+				finished[0] += block.stop - block.start
+				monitor.progress('back_project', finished[0], slices)
+
+		with monitor.stage('back_project'):
+			# threads of the compiled kernel within each worker would compete
+			with ThreadPoolExecutor(max_workers=1 if use_jit() else workers) as pool:
+				list(pool.map(back_project_block, blocks))
+
+		# convert to Hounsfield Units, which has already been done for each
+		# block written to the store
+		if store is None:
+			with monitor.stage('hu'):
+				reconstruction = hu(photons, material, reconstruction, scale, out=reconstruction, fov=True)
+		else:
+			store.flush()
+			reconstruction = store
+
+	monitor.emit()
+
+	return reconstruction
\ No newline at end of file
@@ -7,6 +7,7 @@ import sys
 from ramp_filter import *
 from back_project import *
 from create_dicom import *
+from quantized_sinogram import *
 
 class Xtreme(object):
     def __init__(self, file):
@@ -143,14 +144,18 @@ class Xtreme(object):
 
         return Y, Ymin, Ymax
 
-    def get_rsq_slice(self, scan):
+    def get_rsq_slice(self, scan, quantized=False):
 
         """ [Y, Ymin, Ymax] = get_rsq_slice( F ) reads in slice F from the file.
 
         The returned data Y is a fan-based sinogram of size (angles x 
         samples), Ymin are the recorded detections when there is no X-ray
         source, and Ymax are the recorded detections when there is no object in
-        the scanner."""
+        the scanner.
+
+        [Y, Ymin, Ymax] = get_rsq_slice( F, True ) returns Y as a
+        QuantizedSinogram of the int16 detections as they are stored in the
+        file, rather than widening them to float64."""
 
         if not self.okay:
             print('File not opened correctly')
@@ -175,15 +180,18 @@ class Xtreme(object):
         b = f.read(self.samples*2)
         Ymax = np.frombuffer(b, np.int16, self.samples)
 
-        # loop to read scan
-        Y = np.zeros([self.angles, self.samples])
-        for angle in range(0, self.angles):
-            f.seek(self.skip_samples*2, 1)
-            b = f.read(2*self.samples)
-            Y[angle] = np.frombuffer(b, np.int16, self.samples)
+        # read the whole scan at once, and drop the skipped samples before
+        # each angle
+        b = f.read((self.samples+self.skip_samples)*self.angles*2)
+        Y = np.frombuffer(b, np.int16).reshape((self.angles, self.samples+self.skip_samples))[:, self.skip_samples:]
 
         f.close()
 
+        if quantized:
+            return QuantizedSinogram(Y.copy(), 1.0, 0.0, 'counts'), Ymin, Ymax
+
+        Y = Y.astype(np.float64)
+
         return Y, Ymin, Ymax
 
     def fan_to_parallel(self, X):